@@ -11,19 +11,37 @@ import random
 import string
 import time
 import threading
+import functools
+import zlib
+import codecs
+import gzip
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from typing import List, Optional, Dict, Any, Tuple
+from typing import List, Optional, Dict, Any, Tuple, Callable, Awaitable
 from dataclasses import dataclass
 from enum import Enum
 
 import aiohttp
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from tenacity import retry, wait_fixed, stop_after_attempt, retry_if_exception_type, RetryError as TenacityRetryError
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton, BotCommand, BotCommandScopeDefault
 from telegram.constants import ChatAction, ParseMode
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes, ConversationHandler
 import pytz
 
+# backendهای اختیاری سریع‌تر برای parse صفحات نتایج جستجو
+try:
+    from selectolax.parser import HTMLParser as SelectolaxHTMLParser
+except ImportError:
+    SelectolaxHTMLParser = None
+try:
+    import lxml  # noqa: F401
+    LXML_AVAILABLE = True
+except ImportError:
+    LXML_AVAILABLE = False
+
 # کلیدهای API
 TELEGRAM_BOT_TOKEN = "1951771121:AAHxdMix9xAR6a592sTZKC6aBArdfIaLwco"
 METIS_API_KEY = "tpsg-6WW8eb5cZfq6fZru3B6tUbSaKB2EkVm"
@@ -49,6 +67,7 @@ RATE_LIMIT_PER_HOUR = 100
 CONTENT_TYPES = ['text', 'image', 'video', 'audio', 'document']
 MAX_SAVED_CONTENT = 100
 MAX_FAVORITES = 50
+PAGE_SIZE = 5  # تعداد آیتم در هر صفحه از لیست‌ها
 
 # تنظیمات یادآوری
 REMINDER_TYPES = ['daily', 'weekly', 'monthly', 'custom']
@@ -56,7 +75,89 @@ MAX_REMINDERS_PER_USER = 10
 
 # تنظیمات آمار
 ANALYTICS_RETENTION_DAYS = 365
+SEARCH_HISTORY_RETENTION_DAYS = 180
+NOTIFICATION_RETENTION_DAYS = 90  # اعلان‌های خوانده شده
+RETENTION_CHUNK_ROWS = 500  # تعداد ردیف حذف شده در هر تراکنش
+RETENTION_VACUUM_PAGES = 1000  # تعداد صفحه آزاد شده در هر مرحله incremental_vacuum
+RETENTION_PAUSE_SECONDS = 0.05  # مکث بین تراکنش‌ها تا نوشتن‌ها معطل نمانند
+ANALYTICS_ROLLUP_INTERVAL_MINUTES = 15
 BACKUP_INTERVAL_HOURS = 24
+BACKUP_PAGES_PER_STEP = 1024  # تعداد صفحه کپی شده در هر مرحله backup
+BACKUP_STEP_PAUSE_SECONDS = 0.005  # مکث بین مراحل تا نوشتن‌ها معطل نمانند
+BACKUP_CHUNK_SIZE = 256 * 1024  # اندازه قطعه‌های ذخیره‌سازی content-addressed
+
+# تنظیمات HTTP
+HTTP_SCRAPE_LIMIT = 40  # حداکثر اتصال هم‌زمان برای جستجو و واکشی صفحات
+HTTP_SCRAPE_LIMIT_PER_HOST = 6
+HTTP_API_LIMIT = 20  # حداکثر اتصال هم‌زمان به Metis
+HTTP_API_LIMIT_PER_HOST = 10
+HTTP_API_TIMEOUT_SECONDS = 90
+HTTP_DNS_CACHE_SECONDS = 300
+HTTP_KEEPALIVE_SECONDS = 30
+HTTP_FETCH_MAX_BYTES = 2 * 1024 * 1024  # سقف حجم بدنه هر واکشی (بعد از باز کردن gzip)
+HTTP_FETCH_CHUNK_BYTES = 16384
+HTTP_CHARSET_SNIFF_BYTES = 4096  # بایت‌های ابتدایی که برای تشخیص charset بررسی می‌شوند
+HTTP_HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml')
+HTTP_SNIFFED_CONTENT_TYPES = ('', 'text/plain', 'application/octet-stream')
+HTTP_CACHE_ENABLED = True  # کش دیسکی پاسخ‌های fetch_page
+HTTP_CACHE_PATH = "http_cache.db"
+HTTP_CACHE_MAX_BYTES = 64 * 1024 * 1024  # سقف حجم بدنه‌های فشرده؛ بیشتر از آن LRU حذف می‌شود
+HTTP_CACHE_MAX_TTL_SECONDS = 24 * 3600
+# بدنه پس از decode توسط aiohttp به Accept-Encoding وابسته نیست؛ Vary روی هر هدر دیگر یعنی ذخیره نشود
+HTTP_CACHE_IGNORED_VARY = {'accept-encoding'}
+
+# تنظیمات circuit breaker هر host
+SCRAPE_BREAKER_WINDOW = 20  # تعداد آخرین درخواست‌ها برای نرخ خطا و تأخیر
+SCRAPE_BREAKER_MIN_REQUESTS = 5
+SCRAPE_BREAKER_ERROR_RATE = 0.5  # باز شدن مدار با این نرخ خطا در پنجره
+SCRAPE_BREAKER_CONSECUTIVE_FAILURES = 3  # یا با این تعداد خطای پشت سر هم
+SCRAPE_BREAKER_COOLDOWN_SECONDS = 30  # دو برابر می‌شود با هر بار باز شدن مجدد
+SCRAPE_BREAKER_MAX_COOLDOWN_SECONDS = 900
+SCRAPE_MIN_TIMEOUT_SECONDS = 3
+SCRAPE_TIMEOUT_LATENCY_FACTOR = 3  # timeout تطبیقی = p95 تأخیر × این ضریب
+SCRAPE_HEALTH_MAX_HOSTS = 512
+
+# تنظیمات تحقیق
+RESEARCH_PROVIDER_TIMEOUT_SECONDS = 8  # سقف زمان هر موتور جستجو
+# timeout واکشی صفحه نتایج؛ کوتاه‌تر از سقف موتور تا timeout به جای لغو شدن، خطای host ثبت شود
+RESEARCH_FETCH_TIMEOUT_SECONDS = 6
+RESEARCH_HEDGE_DELAY_SECONDS = 1.0  # موتور دوم فقط اگر اولی تا این زمان کافی نبود شروع می‌شود
+RESEARCH_MIN_SNIPPETS = 5  # بازگشت زودهنگام پس از رسیدن این تعداد snippet خوب
+RESEARCH_MIN_SNIPPET_LENGTH = 40
+RESEARCH_MAX_RESULTS = 8
+RESEARCH_CACHE_SIZE = 256  # تعداد موضوع نگه‌داری شده در حافظه
+RESEARCH_CACHE_TTL_HOURS = 24
+RESEARCH_DEPTH_PAGES = {'basic': 0, 'comprehensive': 0, 'deep': 6}  # تعداد صفحه کامل خوانده‌شده بر اساس user_settings.research_depth (فقط deep؛ اختیاری)
+DEEP_RESEARCH_CONCURRENCY = 4
+DEEP_RESEARCH_PAGE_TIMEOUT_SECONDS = 8
+DEEP_RESEARCH_MAX_PAGE_BYTES = 512 * 1024  # سقف حجم دریافتی هر صفحه
+DEEP_RESEARCH_MAX_CHARS_PER_PAGE = 1500  # سقف متن استخراج‌شده هر صفحه در prompt
+HTML_PARSER_BACKEND = 'auto'  # auto / selectolax / lxml / html.parser
+HTML_PARSE_EXECUTOR = 'thread'  # thread / process / None (اجرا روی event loop)
+HTML_PARSE_WORKERS = 2
+HTML_PARSE_OFFLOAD_MIN_BYTES = 20000  # صفحات کوچک‌تر مستقیم parse می‌شوند
+
+# تنظیمات دیتابیس
+DB_BUSY_TIMEOUT_SECONDS = 10
+DB_CACHE_SIZE_KB = 16 * 1024  # 16MB کش صفحات برای هر اتصال
+DB_MMAP_SIZE = 128 * 1024 * 1024  # 128MB
+DB_STATEMENT_CACHE_SIZE = 256
+DB_STARTUP_VACUUM_MAX_MB = 256  # دیتابیس‌های بزرگ‌تر در startup با VACUUM مسدود نمی‌شوند
+DB_EXECUTOR_WORKERS = 2  # threadهای اختصاصی دیتابیس برای handlerهای async
+DB_ANALYTICS_WORKERS = 1  # thread جدا برای کوئری‌های آماری سنگین
+DB_ANALYTICS_QUERY_BUDGET_SECONDS = 2.0  # سقف زمان کوئری‌های آماری روی اتصال فقط‌خواندنی
+DB_PROGRESS_HANDLER_OPS = 10000  # فاصله بررسی سقف زمان (تعداد دستور ماشین مجازی SQLite)
+DB_WRITE_BEHIND_INTERVAL_MS = 500  # فاصله commit گروهی
+DB_WRITE_BEHIND_MAX_ROWS = 200  # commit زودتر در صورت پر شدن صف
+# تعداد فایل‌های دیتابیس برای جداول کاربرمحور (1 = یک فایل). shard صفر همان فایل اصلی است؛
+# داده موجود جابه‌جا نمی‌شود، پس این مقدار فقط روی دیتابیس جدید تغییر کند
+DB_SHARD_COUNT = 1
+DB_SHARD_ID_SPAN = 10 ** 12  # بازه id هر shard تا idها در همه shardها یکتا باشند
+CONTENT_DICT_SIZE = 32 * 1024  # حداکثر اندازه دیکشنری zlib
+CONTENT_DICT_MIN_SAMPLES = 100  # حداقل تعداد پست برای آموزش دیکشنری
+CONTENT_DICT_SAMPLE_SIZE = 1000  # تعداد پست‌های اخیر برای آموزش
+USER_CACHE_SIZE = 2048  # حداکثر کاربران نگه‌داری شده در کش
+USER_CACHE_TTL_SECONDS = 300
 
 # تنظیمات logging
 logging.basicConfig(
@@ -72,6 +173,11 @@ class UserRole(Enum):
     ADMIN = "admin"
     MODERATOR = "moderator"
 
+class BreakerState(Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
 class ContentStatus(Enum):
     DRAFT = "draft"
     PUBLISHED = "published"
@@ -93,6 +199,14 @@ class UserSession:
     last_activity: datetime
     preferences: Dict[str, Any]
 
+@dataclass
+class QuotaReservation:
+    user_id: int
+    date: str
+    count: int
+    committed: bool = False
+    refunded: bool = False
+
 @dataclass
 class ContentItem:
     id: int
@@ -118,6 +232,93 @@ class ContentGenerationError(Exception):
 class DatabaseError(Exception):
     pass
 
+class QueryBudgetExceeded(DatabaseError):
+    pass
+
+# نگاشت حروف عربی و ارقام به معادل فارسی/لاتین برای جستجو و کلیدگذاری
+PERSIAN_CHAR_MAP = str.maketrans({
+    'ي': 'ی', 'ى': 'ی',
+    'ك': 'ک',
+    'ة': 'ه', 'ۀ': 'ه',
+    'أ': 'ا', 'إ': 'ا', 'ٱ': 'ا',
+    'ؤ': 'و',
+    # نیم‌فاصله مرز کلمه است تا «هوش‌مصنوعی» و «هوش مصنوعی» یکسان توکن شوند
+    '\u200c': ' ', '\u200d': '', '\u200e': '', '\u200f': '', '\u0640': '',
+    **{chr(0x06F0 + i): str(i) for i in range(10)},
+    **{chr(0x0660 + i): str(i) for i in range(10)},
+})
+PERSIAN_DIACRITICS = re.compile(r'[\u064B-\u065F\u0670]')
+
+def normalize_persian_text(text: str) -> str:
+    """نرمال‌سازی متن فارسی (ی/ک عربی، نیم‌فاصله، اعراب و ارقام)"""
+    if not text:
+        return ""
+    text = PERSIAN_DIACRITICS.sub('', text.translate(PERSIAN_CHAR_MAP))
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+def compress_content(text: str, zdict: Optional[bytes] = None) -> Tuple[str, bytes]:
+    """فشرده‌سازی متن پست با zlib (در صورت وجود با دیکشنری آموزش‌دیده)؛ (codec، داده)"""
+    raw = text.encode('utf-8')
+    if zdict:
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY, zdict)
+        codec = 'zlib-dict'
+    else:
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -15, 9)
+        codec = 'zlib'
+    data = compressor.compress(raw) + compressor.flush()
+    
+    # متن‌های خیلی کوتاه گاهی با فشرده‌سازی بزرگ‌تر می‌شوند
+    if len(data) >= len(raw):
+        return 'raw', raw
+    return codec, data
+
+def inflate_content(codec: str, data: bytes, zdict: Optional[bytes] = None) -> Optional[str]:
+    """بازگرداندن متن از داده فشرده (تابع SQL به نام fa_inflate)"""
+    if data is None:
+        return None
+    if codec == 'raw':
+        return bytes(data).decode('utf-8')
+    if codec == 'zlib-dict':
+        decompressor = zlib.decompressobj(-15, zdict)
+    else:
+        decompressor = zlib.decompressobj(-15)
+    return (decompressor.decompress(data) + decompressor.flush()).decode('utf-8')
+
+def train_compression_dictionary(samples: List[str], size: int = CONTENT_DICT_SIZE) -> bytes:
+    """ساخت دیکشنری zlib از عبارات پرتکرار پیکره پست‌ها
+    
+    zlib آموزش‌دهنده ندارد؛ n-gramهای کلمه‌ای (۱ تا ۳ کلمه) بر اساس «تکرار × طول» رتبه‌بندی
+    می‌شوند و پرارزش‌ترین‌ها در انتهای دیکشنری قرار می‌گیرند (فاصله کوتاه‌تر در deflate).
+    """
+    counts = Counter()
+    for text in samples:
+        for line in text.splitlines():
+            words = line.split()
+            for n in (3, 2, 1):
+                for i in range(len(words) - n + 1):
+                    counts[' '.join(words[i:i + n])] += 1
+    
+    ranked = sorted(
+        (gram for gram, count in counts.items() if count > 1),
+        key=lambda gram: (counts[gram] - 1) * len(gram.encode('utf-8')),
+        reverse=True
+    )
+    
+    pieces = []
+    dictionary_text = ''
+    total = 0
+    for gram in ranked:
+        if gram in dictionary_text:
+            continue  # داخل یک عبارت بلندتر انتخاب شده وجود دارد
+        encoded = (gram + ' ').encode('utf-8')
+        if total + len(encoded) > size:
+            break
+        pieces.append(encoded)
+        dictionary_text += gram + ' '
+        total += len(encoded)
+    
+    return b''.join(reversed(pieces))
+
 class RateLimiter:
     """کلاس محدودیت نرخ درخواست"""
     
@@ -213,60 +414,305 @@ class SecurityManager:
         return True, ""
 
 class BackupManager:
-    """کلاس مدیریت پشتیبان"""
+    """کلاس مدیریت پشتیبان
     
-    def __init__(self, db_path: str):
+    هر پشتیبان یک manifest (backup_<زمان>.json) است که فهرست قطعه‌های فایل دیتابیس را
+    نگه می‌دارد. قطعه‌ها با sha256 نام‌گذاری می‌شوند و فقط یک بار در backups/chunks ذخیره
+    می‌شوند؛ پس هر پشتیبان جدید فقط قطعه‌های تغییر کرده را می‌نویسد.
+    """
+    
+    def __init__(self, db_path: str, db_manager=None):
         self.db_path = db_path
+        self.db = db_manager
         self.backup_dir = "backups"
+        self.chunk_dir = os.path.join(self.backup_dir, "chunks")
+        # جلوگیری از حذف قطعه‌ها توسط cleanup در حین نوشتن یک پشتیبان جدید
+        self.store_lock = threading.Lock()
         self.ensure_backup_dir()
     
     def ensure_backup_dir(self):
         """ایجاد پوشه پشتیبان"""
-        if not os.path.exists(self.backup_dir):
-            os.makedirs(self.backup_dir)
+        if not os.path.exists(self.chunk_dir):
+            os.makedirs(self.chunk_dir)
     
-    def create_backup(self) -> str:
-        """ایجاد پشتیبان از دیتابیس"""
+    def _source_paths(self) -> List[str]:
+        """فایل‌های دیتابیس که باید پشتیبان گرفته شوند (فایل اصلی و shardها)"""
+        if self.db:
+            return [shard.db_path for shard in self.db.shards]
+        return [self.db_path]
+    
+    def create_backup(self, progress=None) -> str:
+        """ایجاد پشتیبان آنلاین و افزایشی از دیتابیس
+        
+        snapshot با API پشتیبان SQLite به صورت مرحله‌ای گرفته می‌شود تا نوشتن‌های هم‌زمان
+        مسدود نشوند؛ progress(copied_pages, total_pages) پس از هر مرحله صدا زده می‌شود.
+        در حالت shard، همه فایل‌ها در یک manifest ثبت می‌شوند (هر فایل snapshot مستقل خودش).
+        مسیر manifest پشتیبان برگردانده می‌شود.
+        """
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        manifest_path = os.path.join(self.backup_dir, f"backup_{timestamp}.json")
+        source_paths = self._source_paths()
+        snapshots = []
+        
         try:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_path = os.path.join(self.backup_dir, f"backup_{timestamp}.db")
-            
-            import shutil
-            shutil.copy2(self.db_path, backup_path)
-            
-            logger.info(f"Backup created: {backup_path}")
-            return backup_path
+            for index, source_path in enumerate(source_paths):
+                snapshot_path = os.path.join(self.backup_dir, f"backup_{timestamp}.{index}.db.part")
+                snapshots.append((source_path, snapshot_path) + self._snapshot(
+                    source_path, snapshot_path, index, len(source_paths), progress
+                ))
+            
+            with self.store_lock:
+                entries = [
+                    self._store_snapshot(snapshot_path, source_path, page_size, page_count)
+                    for source_path, snapshot_path, page_size, page_count in snapshots
+                ]
+                manifest = {'format': 'chunked', 'created_at': datetime.now().isoformat(), **entries[0]}
+                if len(entries) > 1:
+                    manifest['shards'] = entries[1:]
+                with open(manifest_path + '.part', 'w', encoding='utf-8') as f:
+                    json.dump(manifest, f, ensure_ascii=False)
+                os.replace(manifest_path + '.part', manifest_path)
+            
+            logger.info(
+                f"Backup created: {manifest_path} ({sum(entry['new_chunks'] for entry in entries)}/"
+                f"{sum(len(entry['chunks']) for entry in entries)} new chunks, "
+                f"{sum(entry['stored_bytes'] for entry in entries)} bytes stored)"
+            )
+            return manifest_path
         except Exception as e:
             logger.error(f"Backup creation failed: {e}")
             return ""
+        finally:
+            for index in range(len(source_paths)):
+                snapshot_path = os.path.join(self.backup_dir, f"backup_{timestamp}.{index}.db.part")
+                if os.path.exists(snapshot_path):
+                    os.remove(snapshot_path)
+    
+    def _snapshot(self, source_path: str, snapshot_path: str, index: int, total_files: int,
+                  progress=None) -> Tuple[int, int]:
+        """کپی مرحله‌ای یک فایل دیتابیس؛ (page_size، page_count) برگردانده می‌شود"""
+        def on_step(status, remaining, total):
+            if progress:
+                # پیشرفت کلی: هر فایل سهم برابری از کل دارد
+                progress(index * total + total - remaining, total_files * total)
+            time.sleep(BACKUP_STEP_PAUSE_SECONDS)
+        
+        source = sqlite3.connect(source_path, timeout=DB_BUSY_TIMEOUT_SECONDS)
+        target = sqlite3.connect(snapshot_path)
+        try:
+            # تراکنش خواندنی باز یک snapshot ثابت (WAL) نگه می‌دارد؛ بدون آن هر نوشتن
+            # از اتصال دیگر، backup مرحله‌ای را از ابتدا شروع می‌کند
+            source.execute('BEGIN')
+            source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+            source.backup(target, pages=BACKUP_PAGES_PER_STEP, progress=on_step)
+            source.rollback()
+            page_size = target.execute('PRAGMA page_size').fetchone()[0]
+            page_count = target.execute('PRAGMA page_count').fetchone()[0]
+        finally:
+            target.close()
+            source.close()
+        return page_size, page_count
+    
+    def _store_snapshot(self, snapshot_path: str, source_path: str, page_size: int, page_count: int) -> dict:
+        """تقسیم snapshot به قطعه‌ها و ذخیره فقط قطعه‌های جدید؛ مشخصات فایل برگردانده می‌شود"""
+        chunks = []
+        new_chunks = 0
+        stored_bytes = 0
+        db_hash = hashlib.sha256()
+        with open(snapshot_path, 'rb') as raw:
+            for chunk in iter(lambda: raw.read(BACKUP_CHUNK_SIZE), b''):
+                db_hash.update(chunk)
+                chunk_hash = hashlib.sha256(chunk).hexdigest()
+                chunks.append(chunk_hash)
+                written = self._store_chunk(chunk_hash, chunk)
+                if written:
+                    new_chunks += 1
+                    stored_bytes += written
+        
+        return {
+            'source': os.path.abspath(source_path),
+            'page_size': page_size,
+            'page_count': page_count,
+            'size': os.path.getsize(snapshot_path),
+            'sha256': db_hash.hexdigest(),
+            'chunk_size': BACKUP_CHUNK_SIZE,
+            'chunks': chunks,
+            'new_chunks': new_chunks,
+            'stored_bytes': stored_bytes
+        }
+    
+    def _chunk_path(self, chunk_hash: str) -> str:
+        """مسیر فایل یک قطعه در انبار content-addressed"""
+        return os.path.join(self.chunk_dir, chunk_hash[:2], chunk_hash)
+    
+    def _store_chunk(self, chunk_hash: str, data: bytes) -> int:
+        """ذخیره فشرده قطعه در صورت نبود؛ تعداد بایت نوشته شده (0 اگر تکراری بود)"""
+        path = self._chunk_path(chunk_hash)
+        if os.path.exists(path):
+            return 0
+        
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        compressed = zlib.compress(data, 6)
+        with open(path + '.part', 'wb') as f:
+            f.write(compressed)
+        os.replace(path + '.part', path)
+        return len(compressed)
+    
+    @staticmethod
+    def _load_manifest(manifest_path: str) -> dict:
+        """خواندن manifest پشتیبان"""
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
+    def backup_file_count(self, backup_path: str) -> int:
+        """تعداد فایل‌های دیتابیس (shardها) در یک پشتیبان"""
+        if backup_path.endswith('.json'):
+            manifest = self._load_manifest(backup_path)
+            if manifest.get('format') == 'chunked':
+                return 1 + len(manifest.get('shards', []))
+        return 1
+    
+    def rebuild_snapshot(self, backup_path: str, output_path: str, shard_index: int = 0) -> str:
+        """بازسازی فایل کامل دیتابیس (یا shard) از یک پشتیبان و بررسی checksum آن؛ sha256 فایل را برمی‌گرداند"""
+        db_hash = hashlib.sha256()
+        
+        with open(output_path, 'wb') as output:
+            if backup_path.endswith('.json'):
+                manifest = self._load_manifest(backup_path)
+                if shard_index:
+                    if shard_index > len(manifest.get('shards', [])):
+                        raise ValueError(f"Backup has no shard {shard_index}")
+                    manifest = manifest['shards'][shard_index - 1]
+                    manifest['format'] = 'chunked'
+                if manifest.get('format') == 'chunked':
+                    for chunk_hash in manifest['chunks']:
+                        with open(self._chunk_path(chunk_hash), 'rb') as f:
+                            chunk = zlib.decompress(f.read())
+                        if hashlib.sha256(chunk).hexdigest() != chunk_hash:
+                            raise ValueError(f"Corrupted backup chunk: {chunk_hash}")
+                        db_hash.update(chunk)
+                        output.write(chunk)
+                else:
+                    # پشتیبان کامل gzip از نسخه‌های قبلی
+                    legacy_path = os.path.join(os.path.dirname(backup_path), manifest['file'])
+                    with gzip.open(legacy_path, 'rb') as compressed:
+                        for chunk in iter(lambda: compressed.read(1024 * 1024), b''):
+                            db_hash.update(chunk)
+                            output.write(chunk)
+                
+                if db_hash.hexdigest() != manifest['sha256']:
+                    raise ValueError("Backup checksum mismatch")
+            else:
+                # فایل‌های قدیمی بدون manifest (.db یا .db.gz)
+                opener = gzip.open if backup_path.endswith('.gz') else open
+                with opener(backup_path, 'rb') as source:
+                    for chunk in iter(lambda: source.read(1024 * 1024), b''):
+                        db_hash.update(chunk)
+                        output.write(chunk)
+        
+        return db_hash.hexdigest()
     
     def restore_backup(self, backup_path: str) -> bool:
-        """بازیابی از پشتیبان"""
+        """بازیابی از پشتیبان پس از بررسی checksum و integrity_check همه فایل‌ها"""
+        target_paths = self._source_paths()
+        snapshot_paths = [f"{path}.restore" for path in target_paths]
         try:
             if not os.path.exists(backup_path):
                 return False
             
-            import shutil
-            shutil.copy2(backup_path, self.db_path)
+            if self.backup_file_count(backup_path) != len(target_paths):
+                raise ValueError("Backup shard count does not match the database")
+            
+            sources = []
+            try:
+                for index, snapshot_path in enumerate(snapshot_paths):
+                    self.rebuild_snapshot(backup_path, snapshot_path, index)
+                    source = sqlite3.connect(snapshot_path)
+                    sources.append(source)
+                    result = source.execute('PRAGMA integrity_check').fetchone()[0]
+                    if result != 'ok':
+                        raise ValueError(f"Backup integrity check failed: {result}")
+                
+                # نوشته‌های در صف قبل از جایگزینی ثبت شوند تا بعداً روی داده بازیابی شده ننشینند
+                if self.db:
+                    self.db.flush_writes()
+                
+                # جایگزینی در یک تراکنش با API پشتیبان: اتصال‌های باز pool روی همان فایل
+                # می‌مانند و داده جدید را می‌بینند (os.replace آن‌ها را روی inode قدیمی رها می‌کرد)
+                for source, target_path in zip(sources, target_paths):
+                    target = sqlite3.connect(target_path, timeout=DB_BUSY_TIMEOUT_SECONDS)
+                    try:
+                        source.backup(target)
+                    finally:
+                        target.close()
+            finally:
+                for source in sources:
+                    source.close()
+            
+            if self.db:
+                self.db.reset_caches()
+            
             logger.info(f"Backup restored from: {backup_path}")
             return True
         except Exception as e:
             logger.error(f"Backup restoration failed: {e}")
             return False
+        finally:
+            for snapshot_path in snapshot_paths:
+                if os.path.exists(snapshot_path):
+                    os.remove(snapshot_path)
     
     def cleanup_old_backups(self, keep_days: int = 7):
-        """پاک کردن پشتیبان‌های قدیمی"""
+        """پاک کردن پشتیبان‌های قدیمی و قطعه‌هایی که دیگر استفاده نمی‌شوند"""
+        with self.store_lock:
+            self._cleanup_old_backups(keep_days)
+    
+    def _cleanup_old_backups(self, keep_days: int):
+        """حذف manifestهای منقضی، فایل‌های کامل قدیمی و قطعه‌های بدون ارجاع"""
         try:
             cutoff_time = datetime.now() - timedelta(days=keep_days)
+            manifests = sorted(
+                filename for filename in os.listdir(self.backup_dir)
+                if filename.startswith("backup_") and filename.endswith(".json")
+            )
             
+            referenced = set()
+            for filename in manifests:
+                file_path = os.path.join(self.backup_dir, filename)
+                manifest = self._load_manifest(file_path)
+                created_at = datetime.fromisoformat(manifest['created_at'])
+                
+                # جدیدترین پشتیبان همیشه نگه داشته می‌شود
+                if created_at < cutoff_time and filename != manifests[-1]:
+                    if manifest.get('format') != 'chunked':
+                        legacy_path = os.path.join(self.backup_dir, manifest['file'])
+                        if os.path.exists(legacy_path):
+                            os.remove(legacy_path)
+                    os.remove(file_path)
+                    logger.info(f"Old backup removed: {filename}")
+                else:
+                    referenced.update(manifest.get('chunks', []))
+                    for shard in manifest.get('shards', []):
+                        referenced.update(shard['chunks'])
+            
+            # فایل‌های کامل قدیمی بدون manifest
             for filename in os.listdir(self.backup_dir):
-                if filename.startswith("backup_") and filename.endswith(".db"):
+                if filename.startswith("backup_") and filename.endswith((".db", ".db.gz")):
                     file_path = os.path.join(self.backup_dir, filename)
-                    file_time = datetime.fromtimestamp(os.path.getctime(file_path))
-                    
-                    if file_time < cutoff_time:
+                    if datetime.fromtimestamp(os.path.getctime(file_path)) < cutoff_time:
                         os.remove(file_path)
                         logger.info(f"Old backup removed: {filename}")
+            
+            # جمع‌آوری قطعه‌های بدون ارجاع
+            removed_chunks = 0
+            for prefix in os.listdir(self.chunk_dir):
+                prefix_dir = os.path.join(self.chunk_dir, prefix)
+                for chunk_hash in os.listdir(prefix_dir):
+                    if chunk_hash not in referenced:
+                        os.remove(os.path.join(prefix_dir, chunk_hash))
+                        removed_chunks += 1
+            if removed_chunks:
+                logger.info(f"Removed {removed_chunks} unreferenced backup chunks")
         except Exception as e:
             logger.error(f"Backup cleanup failed: {e}")
 
@@ -431,53 +877,183 @@ class ContentTemplate:
 class AnalyticsManager:
     """کلاس مدیریت آمار و تحلیل"""
     
+    # کوئری‌های پرتکرار (در DatabaseManager.hot_queries هم برای بررسی query plan استفاده می‌شوند)
+    ROLLUP_REQUESTS_SQL = '''
+        INSERT INTO user_daily_stats (user_id, date, category, total_requests, successful_requests,
+                                      failed_requests, timed_requests, total_processing_time)
+        SELECT user_id, date(created_at), COALESCE(category, 'general'), COUNT(*),
+               COUNT(CASE WHEN status = 'completed' THEN 1 END),
+               COUNT(CASE WHEN status = 'failed' THEN 1 END),
+               COUNT(processing_time), COALESCE(SUM(processing_time), 0)
+        FROM requests
+        WHERE created_at >= ?
+        GROUP BY date(created_at), user_id, COALESCE(category, 'general')
+    '''
+    NEW_USERS_SINCE_SQL = 'SELECT date(join_date), COUNT(*) FROM users WHERE join_date >= ? GROUP BY date(join_date)'
+    USER_DAILY_STATS_SQL = '''
+        SELECT date, SUM(total_requests) FROM user_daily_stats
+        WHERE user_id = ? AND date >= date('now', '-6 days') AND date < date('now')
+        GROUP BY date
+        UNION ALL
+        SELECT date('now'), COUNT(*) FROM requests
+        WHERE user_id = ? AND created_at >= date('now')
+        HAVING COUNT(*) > 0
+        ORDER BY 1 DESC
+    '''
+    GLOBAL_PAST_SQL = '''
+        SELECT COALESCE(SUM(total_requests), 0),
+               COALESCE(SUM(successful_requests), 0),
+               COALESCE(SUM(failed_requests), 0),
+               COALESCE(SUM(CASE WHEN date >= date('now', '-6 days') THEN total_requests END), 0),
+               COALESCE(SUM(CASE WHEN date >= date('now', '-6 days') THEN new_users END), 0),
+               COALESCE(SUM(CASE WHEN date >= date('now', '-29 days') THEN new_users END), 0),
+               (SELECT total_users FROM analytics WHERE date < date('now') ORDER BY date DESC LIMIT 1)
+        FROM analytics WHERE date < date('now')
+    '''
+    NEW_USERS_TODAY_SQL = "SELECT COUNT(*) FROM users WHERE join_date >= date('now')"
+    REQUESTS_TODAY_SQL = '''
+        SELECT COUNT(*),
+               COUNT(CASE WHEN status = 'completed' THEN 1 END),
+               COUNT(CASE WHEN status = 'failed' THEN 1 END),
+               COUNT(DISTINCT user_id),
+               COALESCE(SUM(processing_time), 0),
+               COUNT(processing_time)
+        FROM requests WHERE created_at >= date('now')
+    '''
+    
     def __init__(self, db_manager):
         self.db = db_manager
     
-    def get_user_analytics(self, user_id: int) -> dict:
-        """دریافت آمار کاربر"""
+    def refresh_rollups(self) -> int:
+        """به‌روزرسانی تدریجی جداول تجمیعی روزانه از آخرین watermark تا امروز
+        
+        user_daily_stats در هر shard از درخواست‌های همان shard ساخته می‌شود و جدول سراسری
+        analytics در فایل اصلی از جمع نتایج shardها.
+        """
         try:
-            conn = sqlite3.connect(self.db.db_path)
-            cursor = conn.cursor()
+            self.db.flush_writes()  # دیدن نوشته‌های در صف
+            with self.db.pool.connection() as conn:
+                today = conn.execute("SELECT date('now')").fetchone()[0]
+                row = conn.execute("SELECT value FROM rollup_state WHERE name = 'daily'").fetchone()
+                if row:
+                    # روز قبل از watermark هم دوباره محاسبه می‌شود تا نوشته‌های دیررس نیمه‌شب از دست نروند
+                    start = conn.execute("SELECT date(?, '-1 day')", (row[0],)).fetchone()[0]
+                else:
+                    start = None
+            
+            if start is None:
+                # اولین اجرا: پر کردن کل تاریخچه
+                days = []
+                for shard in self.db.shards:
+                    with shard.pool.connection() as conn:
+                        days.append(conn.execute('SELECT date(MIN(created_at)) FROM requests').fetchone()[0])
+                with self.db.pool.connection() as conn:
+                    days.append(conn.execute('SELECT date(MIN(join_date)) FROM users').fetchone()[0])
+                start = min((day for day in days if day), default=today)
+            
+            daily = {}
+            categories = {}
+            system_errors = {}
+            for shard in self.db.shards:
+                with shard.pool.connection() as conn:
+                    cursor = conn.cursor()
+                    
+                    # تجمیع روزانه هر کاربر (فقط بازه تغییر کرده)
+                    cursor.execute('DELETE FROM user_daily_stats WHERE date >= ?', (start,))
+                    cursor.execute(self.ROLLUP_REQUESTS_SQL, (start,))
+                    
+                    # جمع روزانه این shard از روی جدول کاربر-روز (کاربران بین shardها مشترک نیستند)
+                    for row in cursor.execute('''
+                        SELECT date, SUM(total_requests), SUM(successful_requests), SUM(failed_requests),
+                               SUM(timed_requests), SUM(total_processing_time), COUNT(DISTINCT user_id)
+                        FROM user_daily_stats WHERE date >= ? GROUP BY date
+                    ''', (start,)):
+                        previous = daily.get(row[0], (0, 0, 0, 0, 0, 0))
+                        daily[row[0]] = tuple(a + b for a, b in zip(previous, row[1:]))
+                    
+                    for day, category, count in cursor.execute('''
+                        SELECT date, category, SUM(total_requests) FROM user_daily_stats
+                        WHERE date >= ? GROUP BY date, category
+                    ''', (start,)):
+                        day_categories = categories.setdefault(day, {})
+                        day_categories[category] = day_categories.get(category, 0) + count
+                    
+                    for day, count in cursor.execute('''
+                        SELECT date(created_at), COUNT(*) FROM requests
+                        WHERE created_at >= ? AND status = 'failed' AND error_message IS NOT NULL
+                        GROUP BY date(created_at)
+                    ''', (start,)):
+                        system_errors[day] = system_errors.get(day, 0) + count
+                    conn.commit()
+            
+            with self.db.pool.connection() as conn:
+                cursor = conn.cursor()
+                new_users = dict(cursor.execute(self.NEW_USERS_SINCE_SQL, (start,)).fetchall())
+                total_users = cursor.execute(
+                    'SELECT COUNT(*) FROM users WHERE join_date < ?', (start,)
+                ).fetchone()[0]
+                
+                rows = []
+                day = datetime.strptime(start, '%Y-%m-%d').date()
+                last_day = datetime.strptime(today, '%Y-%m-%d').date()
+                while day <= last_day:
+                    key = day.isoformat()
+                    total, ok, failed, timed, proc_time, active = daily.get(key, (0, 0, 0, 0, 0, 0))
+                    total_users += new_users.get(key, 0)
+                    rows.append((
+                        key, total, ok, failed, total_users, new_users.get(key, 0), active,
+                        proc_time / timed if timed else None,
+                        json.dumps(categories.get(key, {}), ensure_ascii=False),
+                        system_errors.get(key, 0)
+                    ))
+                    day += timedelta(days=1)
+                
+                cursor.executemany('''
+                    INSERT INTO analytics (date, total_requests, successful_requests, failed_requests,
+                                           total_users, new_users, active_users, avg_processing_time,
+                                           popular_categories, system_errors)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(date) DO UPDATE SET
+                        total_requests = excluded.total_requests,
+                        successful_requests = excluded.successful_requests,
+                        failed_requests = excluded.failed_requests,
+                        total_users = excluded.total_users,
+                        new_users = excluded.new_users,
+                        active_users = excluded.active_users,
+                        avg_processing_time = excluded.avg_processing_time,
+                        popular_categories = excluded.popular_categories,
+                        system_errors = excluded.system_errors
+                ''', rows)
+                
+                cursor.execute('''
+                    INSERT INTO rollup_state (name, value) VALUES ('daily', ?)
+                    ON CONFLICT(name) DO UPDATE SET value = excluded.value
+                ''', (today,))
+                conn.commit()
             
-            # آمار کلی کاربر
-            cursor.execute('''
-                SELECT COUNT(*) as total_requests,
-                       COUNT(CASE WHEN status = 'completed' THEN 1 END) as successful_requests,
-                       COUNT(CASE WHEN status = 'failed' THEN 1 END) as failed_requests
-                FROM requests WHERE user_id = ?
-            ''', (user_id,))
-            stats = cursor.fetchone()
-            
-            # دسته‌بندی‌های محبوب
-            cursor.execute('''
-                SELECT category, COUNT(*) as count
-                FROM requests 
-                WHERE user_id = ? 
-                GROUP BY category 
-                ORDER BY count DESC 
-                LIMIT 5
-            ''', (user_id,))
-            categories = cursor.fetchall()
-            
-            # آمار روزانه
-            cursor.execute('''
-                SELECT DATE(created_at) as date, COUNT(*) as count
-                FROM requests 
-                WHERE user_id = ? 
-                AND created_at >= date('now', '-7 days')
-                GROUP BY DATE(created_at)
-                ORDER BY date DESC
-            ''', (user_id,))
-            daily_stats = cursor.fetchall()
+            logger.info(f"Analytics rollups refreshed from {start} ({len(rows)} days)")
+            return len(rows)
+        except Exception as e:
+            logger.error(f"Error refreshing analytics rollups: {e}")
+            return 0
+    
+    def get_user_analytics(self, user_id: int) -> dict:
+        """دریافت آمار کاربر از شمارنده‌های تجمعی و آمار روزانه هفته اخیر"""
+        try:
+            counters = self.db.get_user_counters(user_id)
+            if not counters:
+                return {}
             
-            conn.close()
+            shard = self.db.shard_for_user(user_id)
+            with shard.read_pool.connection() as conn:
+                # آمار روزانه: روزهای تجمیع شده + امروز به صورت زنده
+                daily_stats = conn.execute(self.USER_DAILY_STATS_SQL, (user_id, user_id)).fetchall()
             
             return {
-                'total_requests': stats[0] if stats else 0,
-                'successful_requests': stats[1] if stats else 0,
-                'failed_requests': stats[2] if stats else 0,
-                'popular_categories': categories,
+                'total_requests': counters['total_requests'],
+                'successful_requests': counters['successful_requests'],
+                'failed_requests': counters['failed_requests'],
+                'popular_categories': counters['popular_categories'],
                 'daily_stats': daily_stats
             }
         except Exception as e:
@@ -485,43 +1061,132 @@ class AnalyticsManager:
             return {}
     
     def get_global_analytics(self) -> dict:
-        """دریافت آمار کلی سیستم"""
+        """دریافت آمار کلی سیستم از جدول analytics و درخواست‌های امروز"""
         try:
-            conn = sqlite3.connect(self.db.db_path)
-            cursor = conn.cursor()
-            
-            # آمار کلی
-            cursor.execute('''
-                SELECT COUNT(*) as total_users,
-                       COUNT(CASE WHEN join_date >= date('now', '-7 days') THEN 1 END) as new_users_week,
-                       COUNT(CASE WHEN join_date >= date('now', '-30 days') THEN 1 END) as new_users_month
-                FROM users
-            ''')
-            user_stats = cursor.fetchone()
-            
-            # آمار درخواست‌ها
-            cursor.execute('''
-                SELECT COUNT(*) as total_requests,
-                       COUNT(CASE WHEN created_at >= date('now', '-24 hours') THEN 1 END) as requests_today,
-                       COUNT(CASE WHEN created_at >= date('now', '-7 days') THEN 1 END) as requests_week
-                FROM requests
-            ''')
-            request_stats = cursor.fetchone()
+            self.db.flush_writes()  # دیدن نوشته‌های در صف
+            with self.db.read_pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                # روزهای گذشته از جدول تجمیعی
+                past = cursor.execute(self.GLOBAL_PAST_SQL).fetchone()
+                new_users_today = cursor.execute(self.NEW_USERS_TODAY_SQL).fetchone()[0]
             
-            conn.close()
+            # امروز به صورت زنده از همه shardها (با ایندکس created_at)
+            today = [0, 0, 0, 0, 0, 0]
+            for shard in self.db.shards:
+                with shard.read_pool.connection() as conn:
+                    row = conn.execute(self.REQUESTS_TODAY_SQL).fetchone()
+                today = [a + b for a, b in zip(today, row)]
             
             return {
-                'total_users': user_stats[0] if user_stats else 0,
-                'new_users_week': user_stats[1] if user_stats else 0,
-                'new_users_month': user_stats[2] if user_stats else 0,
-                'total_requests': request_stats[0] if request_stats else 0,
-                'requests_today': request_stats[1] if request_stats else 0,
-                'requests_week': request_stats[2] if request_stats else 0
+                'total_users': (past[6] or 0) + new_users_today,
+                'new_users_week': past[4] + new_users_today,
+                'new_users_month': past[5] + new_users_today,
+                'total_requests': past[0] + today[0],
+                'successful_requests': past[1] + today[1],
+                'failed_requests': past[2] + today[2],
+                'requests_today': today[0],
+                'requests_week': past[3] + today[0],
+                'active_users_today': today[3],
+                'avg_processing_time_today': today[4] / today[5] if today[5] else None
             }
         except Exception as e:
             logger.error(f"Error getting global analytics: {e}")
             return {}
 
+class RetentionManager:
+    """کلاس نگه‌داشت داده: حذف تدریجی ردیف‌های منقضی و بازپس‌گیری فضا"""
+    
+    def __init__(self, db_manager, chunk_rows: int = RETENTION_CHUNK_ROWS):
+        self.db = db_manager
+        self.chunk_rows = chunk_rows
+    
+    def _policies(self) -> List[Tuple[str, str, tuple]]:
+        """سیاست‌های نگه‌داشت: (جدول، شرط حذف، پارامترها)"""
+        return [
+            ('requests', "created_at < datetime('now', ?)", (f'-{ANALYTICS_RETENTION_DAYS} days',)),
+            ('search_history', "created_at < datetime('now', ?)", (f'-{SEARCH_HISTORY_RETENTION_DAYS} days',)),
+            ('system_notifications',
+             "(expires_at IS NOT NULL AND datetime(expires_at) < datetime('now')) "
+             "OR (is_read = 1 AND created_at < datetime('now', ?))",
+             (f'-{NOTIFICATION_RETENTION_DAYS} days',)),
+            ('content_shares', "expires_at IS NOT NULL AND datetime(expires_at) < datetime('now')", ()),
+            ('research_cache', "expires_at < datetime('now')", ()),
+        ]
+    
+    def _delete_in_chunks(self, pool, table: str, where: str, params: tuple) -> int:
+        """حذف ردیف‌ها در تراکنش‌های کوچک تا قفل نوشتن طولانی نشود"""
+        total = 0
+        while True:
+            with pool.connection() as conn:
+                # ترتیب id باعث می‌شود ردیف‌های قدیمی (ابتدای جدول) زود پیدا شوند
+                cursor = conn.execute(f'''
+                    DELETE FROM {table} WHERE id IN (
+                        SELECT id FROM {table} WHERE {where} ORDER BY id LIMIT ?
+                    )
+                ''', (*params, self.chunk_rows))
+                conn.commit()
+            
+            total += cursor.rowcount
+            if cursor.rowcount < self.chunk_rows:
+                return total
+            time.sleep(RETENTION_PAUSE_SECONDS)
+    
+    def _reclaim_space(self, pool) -> int:
+        """آزادسازی صفحه‌های خالی با incremental_vacuum به صورت مرحله‌ای"""
+        freed = 0
+        with pool.connection() as conn:
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                return 0
+            
+            free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            while free_pages:
+                # execute فقط یک step اجرا می‌کند (یک صفحه)؛ executescript تا انتها اجرا می‌کند
+                conn.executescript(f'PRAGMA incremental_vacuum({min(free_pages, RETENTION_VACUUM_PAGES)});')
+                remaining = conn.execute('PRAGMA freelist_count').fetchone()[0]
+                if remaining >= free_pages:
+                    break
+                freed += free_pages - remaining
+                free_pages = remaining
+                time.sleep(RETENTION_PAUSE_SECONDS)
+        return freed
+    
+    def run(self) -> Dict[str, Any]:
+        """اجرای یک دور کامل نگه‌داشت داده"""
+        started = time.monotonic()
+        report = {'deleted': {}, 'freed_pages': 0}
+        
+        for table, where, params in self._policies():
+            # جداول کاربرمحور در همه shardها، بقیه فقط در فایل اصلی
+            shards = self.db.shards if table in self.db.SHARDED_TABLES else self.db.shards[:1]
+            for shard in shards:
+                try:
+                    deleted = self._delete_in_chunks(shard.pool, table, where, params)
+                    report['deleted'][table] = report['deleted'].get(table, 0) + deleted
+                except Exception as e:
+                    logger.error(f"Retention failed for {table} in {shard.db_path}: {e}")
+        
+        for shard in self.db.shards:
+            try:
+                deleted = shard.blobs.delete_unreferenced(self.chunk_rows)
+                report['deleted']['content_blobs'] = report['deleted'].get('content_blobs', 0) + deleted
+            except Exception as e:
+                logger.error(f"Retention failed for content_blobs in {shard.db_path}: {e}")
+            
+            try:
+                report['freed_pages'] += self._reclaim_space(shard.pool)
+                with shard.pool.connection() as conn:
+                    conn.execute('PRAGMA optimize')
+            except Exception as e:
+                logger.error(f"Space reclamation failed for {shard.db_path}: {e}")
+        
+        report['elapsed_seconds'] = round(time.monotonic() - started, 2)
+        logger.info(
+            f"Retention completed in {report['elapsed_seconds']}s: "
+            f"deleted {report['deleted']}, freed {report['freed_pages']} pages"
+        )
+        return report
+
 class NotificationManager:
     """کلاس مدیریت اعلان‌ها"""
     
@@ -602,472 +1267,1628 @@ class ContentScheduler:
         if user_id in self.scheduled_content:
             self.scheduled_content[user_id]['sent'] = True
 
-class DatabaseManager:
-    def __init__(self, db_path="bot_database.db"):
+class TTLCache:
+    """کش LRU با انقضای زمانی و شمارنده‌های hit/miss (thread-safe)"""
+    
+    def __init__(self, max_size: int = USER_CACHE_SIZE, ttl_seconds: float = USER_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+    
+    def get(self, key):
+        """دریافت مقدار از کش (None در صورت نبود یا انقضا)"""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._items[key]
+                self.stats['misses'] += 1
+                return None
+            self._items.move_to_end(key)
+            self.stats['hits'] += 1
+            return item[1]
+    
+    def set(self, key, value, ttl_seconds: Optional[float] = None):
+        """ذخیره مقدار در کش و حذف قدیمی‌ترین آیتم در صورت پر شدن"""
+        with self._lock:
+            self._items[key] = (time.monotonic() + (ttl_seconds or self.ttl_seconds), value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.stats['evictions'] += 1
+    
+    def invalidate(self, key):
+        """حذف یک کلید از کش"""
+        with self._lock:
+            self._items.pop(key, None)
+    
+    def clear(self):
+        """خالی کردن کامل کش"""
+        with self._lock:
+            self._items.clear()
+    
+    def hit_rate(self) -> float:
+        """نسبت hit به کل درخواست‌ها"""
+        total = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / total if total else 0.0
+    
+    def __len__(self):
+        return len(self._items)
+
+class ConnectionPool:
+    """کلاس مدیریت اتصال‌های ماندگار دیتابیس (یک اتصال برای هر thread)
+    
+    با read_only=True اتصال‌ها خواننده WAL با query_only هستند و اگر query_budget داده شود،
+    کوئری‌هایی که از سقف زمان بگذرند با progress handler لغو می‌شوند.
+    """
+    
+    def __init__(self, db_path: str, read_only: bool = False, query_budget: Optional[float] = None):
         self.db_path = db_path
-        self.init_database()
+        self.read_only = read_only
+        self.query_budget = query_budget
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
     
-    def init_database(self):
-        """ایجاد جداول دیتابیس پیشرفته"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # جدول کاربران پیشرفته
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    first_name TEXT,
-                    last_name TEXT,
-                    join_date TEXT DEFAULT (datetime('now')),
-                    daily_requests INTEGER DEFAULT 0,
-                    last_request_date TEXT,
-                    preferred_category TEXT DEFAULT 'general',
-                    language TEXT DEFAULT 'fa',
-                    role TEXT DEFAULT 'user',
-                    is_premium BOOLEAN DEFAULT 0,
-                    premium_expires TEXT,
-                    total_requests INTEGER DEFAULT 0,
-                    total_content_saved INTEGER DEFAULT 0,
-                    last_activity TEXT DEFAULT (datetime('now')),
-                    timezone TEXT DEFAULT 'Asia/Tehran',
-                    notification_settings TEXT DEFAULT '{}'
-                )
-            ''')
-            
-            # جدول درخواست‌های پیشرفته
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS requests (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    topic TEXT,
-                    category TEXT,
-                    content_type TEXT DEFAULT 'educational',
-                    language TEXT DEFAULT 'fa',
-                    created_at TEXT DEFAULT (datetime('now')),
-                    status TEXT DEFAULT 'completed',
-                    processing_time REAL,
-                    content_length INTEGER,
-                    word_count INTEGER,
-                    error_message TEXT,
-                    metadata TEXT DEFAULT '{}',
-                    FOREIGN KEY (user_id) REFERENCES users (user_id)
-                )
-            ''')
-            
-            # جدول آمار پیشرفته
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS analytics (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    date TEXT,
-                    total_requests INTEGER DEFAULT 0,
-                    successful_requests INTEGER DEFAULT 0,
-                    failed_requests INTEGER DEFAULT 0,
-                    total_users INTEGER DEFAULT 0,
-                    new_users INTEGER DEFAULT 0,
-                    active_users INTEGER DEFAULT 0,
-                    avg_processing_time REAL,
-                    popular_categories TEXT DEFAULT '{}',
-                    system_errors INTEGER DEFAULT 0
-                )
-            ''')
-            
-            # جدول محتوای ذخیره شده پیشرفته
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS saved_content (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    topic TEXT,
-                    category TEXT,
-                    content TEXT,
-                    content_type TEXT DEFAULT 'text',
-                    language TEXT DEFAULT 'fa',
-                    created_at TEXT DEFAULT (datetime('now')),
-                    updated_at TEXT DEFAULT (datetime('now')),
-                    is_favorite BOOLEAN DEFAULT 0,
-                    is_public BOOLEAN DEFAULT 0,
-                    tags TEXT DEFAULT '[]',
-                    metadata TEXT DEFAULT '{}',
-                    view_count INTEGER DEFAULT 0,
-                    share_count INTEGER DEFAULT 0,
-                    rating REAL DEFAULT 0,
-                    rating_count INTEGER DEFAULT 0,
-                    FOREIGN KEY (user_id) REFERENCES users (user_id)
-                )
-            ''')
-            
-            # جدول تنظیمات کاربر پیشرفته
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS user_settings (
-                    user_id INTEGER PRIMARY KEY,
-                    language TEXT DEFAULT 'fa',
-                    content_length TEXT DEFAULT 'medium',
-                    content_type TEXT DEFAULT 'educational',
-                    notification_enabled BOOLEAN DEFAULT 1,
-                    auto_save BOOLEAN DEFAULT 1,
-                    preferred_categories TEXT DEFAULT 'general',
-                    theme TEXT DEFAULT 'default',
-                    privacy_level TEXT DEFAULT 'private',
-                    auto_translate BOOLEAN DEFAULT 0,
-                    target_language TEXT DEFAULT 'fa',
-                    content_format TEXT DEFAULT 'structured',
-                    ai_assistant_enabled BOOLEAN DEFAULT 1,
-                    research_depth TEXT DEFAULT 'comprehensive',
-                    created_at TEXT DEFAULT (datetime('now')),
-                    updated_at TEXT DEFAULT (datetime('now')),
-                    FOREIGN KEY (user_id) REFERENCES users (user_id)
-                )
-            ''')
-            
-            # جدول یادآوری‌های پیشرفته
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS reminders (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    title TEXT,
-                    topic TEXT,
-                    message TEXT,
-                    reminder_type TEXT DEFAULT 'custom',
-                    scheduled_time TEXT,
-                    repeat_interval TEXT,
-                    is_sent BOOLEAN DEFAULT 0,
-                    sent_count INTEGER DEFAULT 0,
-                    last_sent TEXT,
-                    is_active BOOLEAN DEFAULT 1,
-                    created_at TEXT DEFAULT (datetime('now')),
-                    updated_at TEXT DEFAULT (datetime('now')),
-                    metadata TEXT DEFAULT '{}',
-                    FOREIGN KEY (user_id) REFERENCES users (user_id)
-                )
-            ''')
-            
-            # جدول بازخورد پیشرفته
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS feedback (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    topic TEXT,
-                    content_id INTEGER,
-                    rating INTEGER,
-                    comment TEXT,
-                    feedback_type TEXT DEFAULT 'general',
-                    category TEXT,
-                    created_at TEXT DEFAULT (datetime('now')),
-                    is_helpful BOOLEAN DEFAULT 0,
-                    helpful_count INTEGER DEFAULT 0,
-                    response TEXT,
-                    status TEXT DEFAULT 'pending',
-                    FOREIGN KEY (user_id) REFERENCES users (user_id),
-                    FOREIGN KEY (content_id) REFERENCES saved_content (id)
-                )
-            ''')
-            
-            # جدول جستجو و تاریخچه
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS search_history (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    query TEXT,
-                    category TEXT,
-                    results_count INTEGER,
-                    created_at TEXT DEFAULT (datetime('now')),
-                    is_successful BOOLEAN DEFAULT 1,
-                    processing_time REAL,
-                    FOREIGN KEY (user_id) REFERENCES users (user_id)
-                )
-            ''')
-            
-            # جدول اشتراک‌گذاری
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS content_shares (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    content_id INTEGER,
-                    user_id INTEGER,
-                    share_type TEXT DEFAULT 'public',
-                    share_url TEXT,
-                    share_count INTEGER DEFAULT 0,
-                    created_at TEXT DEFAULT (datetime('now')),
-                    expires_at TEXT,
-                    is_active BOOLEAN DEFAULT 1,
-                    FOREIGN KEY (content_id) REFERENCES saved_content (id),
-                    FOREIGN KEY (user_id) REFERENCES users (user_id)
-                )
-            ''')
-            
-            # جدول دسته‌بندی‌های سفارشی
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS custom_categories (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    name TEXT,
-                    description TEXT,
-                    color TEXT DEFAULT '#007bff',
-                    icon TEXT DEFAULT '📁',
-                    is_default BOOLEAN DEFAULT 0,
-                    created_at TEXT DEFAULT (datetime('now')),
-                    updated_at TEXT DEFAULT (datetime('now')),
-                    FOREIGN KEY (user_id) REFERENCES users (user_id)
-                )
-            ''')
-            
-            # جدول قالب‌های سفارشی
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS custom_templates (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    name TEXT,
-                    category TEXT,
-                    template_structure TEXT,
-                    is_public BOOLEAN DEFAULT 0,
-                    usage_count INTEGER DEFAULT 0,
-                    rating REAL DEFAULT 0,
-                    created_at TEXT DEFAULT (datetime('now')),
-                    updated_at TEXT DEFAULT (datetime('now')),
-                    FOREIGN KEY (user_id) REFERENCES users (user_id)
-                )
-            ''')
-            
-            # جدول اعلان‌های سیستم
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS system_notifications (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    title TEXT,
-                    message TEXT,
-                    notification_type TEXT DEFAULT 'info',
-                    is_read BOOLEAN DEFAULT 0,
-                    created_at TEXT DEFAULT (datetime('now')),
-                    expires_at TEXT,
-                    action_url TEXT,
-                    metadata TEXT DEFAULT '{}',
-                    FOREIGN KEY (user_id) REFERENCES users (user_id)
-                )
-            ''')
-            
-            # ایجاد ایندکس‌ها برای بهبود عملکرد
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_join_date ON users(join_date)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_requests_user_date ON requests(user_id, created_at)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_saved_content_user ON saved_content(user_id, created_at)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_reminders_scheduled ON reminders(scheduled_time, is_active)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_feedback_user ON feedback(user_id, created_at)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_search_history_user ON search_history(user_id, created_at)')
-            
-            conn.commit()
-            conn.close()
-            logger.info("Advanced database initialized successfully")
-        except Exception as e:
-            logger.error(f"Error initializing database: {e}")
-            raise DatabaseError(f"خطا در راه‌اندازی دیتابیس: {str(e)}")
+    def _connect(self) -> sqlite3.Connection:
+        """ایجاد اتصال جدید با تنظیمات بهینه"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=DB_BUSY_TIMEOUT_SECONDS,
+            check_same_thread=False,
+            cached_statements=DB_STATEMENT_CACHE_SIZE
+        )
+        if self.read_only:
+            # journal_mode توسط pool نوشتن تنظیم شده است؛ این اتصال هرگز نمی‌نویسد
+            conn.execute('PRAGMA query_only=ON')
+            if self.query_budget:
+                conn.set_progress_handler(self._check_budget, DB_PROGRESS_HANDLER_OPS)
+        else:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA cache_size=-{DB_CACHE_SIZE_KB}')
+        conn.execute(f'PRAGMA mmap_size={DB_MMAP_SIZE}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        # تابع نرمال‌سازی فارسی برای triggerهای ایندکس جستجو
+        conn.create_function('fa_normalize', 1, normalize_persian_text, deterministic=True)
+        # بازگشایی بدنه‌های فشرده saved_content داخل کوئری‌ها و triggerها
+        conn.create_function('fa_inflate', 3, inflate_content, deterministic=True)
+        return conn
     
-    def get_user(self, user_id: int) -> Optional[Dict]:
-        """دریافت اطلاعات کاربر"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-            user = cursor.fetchone()
-            conn.close()
-            
-            if user:
-                return {
-                    'user_id': user[0],
-                    'username': user[1],
-                    'first_name': user[2],
-                    'last_name': user[3],
-                    'join_date': user[4],
-                    'daily_requests': user[5],
-                    'last_request_date': user[6],
-                    'preferred_category': user[7],
-                    'language': user[8]
-                }
-            return None
-        except Exception as e:
-            logger.error(f"Error getting user {user_id}: {e}")
-            return None
+    def get_connection(self) -> sqlite3.Connection:
+        """دریافت اتصال ماندگار thread جاری"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self.local.conn = conn
+            with self.lock:
+                self.connections.append(conn)
+        return conn
     
-    def create_user(self, user_id: int, username: str, first_name: str, last_name: str):
-        """ایجاد کاربر جدید"""
+    def _check_budget(self) -> int:
+        """progress handler: مقدار غیرصفر کوئری در حال اجرا را لغو می‌کند"""
+        deadline = getattr(self.local, 'deadline', None)
+        return 1 if deadline is not None and time.monotonic() > deadline else 0
+    
+    @contextmanager
+    def connection(self):
+        """دریافت اتصال و برگرداندن تراکنش ناتمام در صورت خطا"""
+        conn = self.get_connection()
+        if self.query_budget:
+            self.local.deadline = time.monotonic() + self.query_budget
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT OR REPLACE INTO users (user_id, username, first_name, last_name)
-                VALUES (?, ?, ?, ?)
-            ''', (user_id, username, first_name, last_name))
-            conn.commit()
-            conn.close()
-            logger.info(f"User {user_id} created/updated successfully")
-        except Exception as e:
-            logger.error(f"Error creating user {user_id}: {e}")
+            yield conn
+        except sqlite3.OperationalError as e:
+            if conn.in_transaction:
+                conn.rollback()
+            if self.query_budget and 'interrupted' in str(e):
+                logger.warning(f"Read query cancelled after {self.query_budget}s budget on {self.db_path}")
+                raise QueryBudgetExceeded(f"کوئری از سقف زمان {self.query_budget} ثانیه گذشت") from e
             raise
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            self.local.deadline = None
     
-    def update_daily_requests(self, user_id: int) -> int:
-        """به‌روزرسانی تعداد درخواست‌های روزانه"""
-        try:
-            today = datetime.now().strftime('%Y-%m-%d')
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # بررسی تاریخ آخرین درخواست
-            cursor.execute('SELECT last_request_date, daily_requests FROM users WHERE user_id = ?', (user_id,))
-            result = cursor.fetchone()
-            
-            if result and result[0]:
+    def close_all(self):
+        """بستن همه اتصال‌های باز"""
+        with self.lock:
+            for conn in self.connections:
                 try:
-                    last_date = datetime.strptime(result[0], '%Y-%m-%d').date()
-                    today_date = datetime.now().date()
-                    if last_date == today_date:
-                        # همان روز - افزایش شمارنده
-                        new_count = result[1] + 1
-                    else:
-                        # روز جدید - ریست شمارنده
-                        new_count = 1
-                except ValueError:
-                    # اگر فرمت تاریخ اشتباه باشد
-                    new_count = 1
+                    conn.close()
+                except Exception as e:
+                    logger.warning(f"Error closing database connection: {e}")
+            self.connections = []
+            # اتصال‌های قبلی در threadها دیگر استفاده نمی‌شوند
+            self.local = threading.local()
+
+class WriteBehindQueue:
+    """کلاس صف نوشتن تأخیری برای درج‌های افزایشی با commit گروهی"""
+    
+    def __init__(self, pool: ConnectionPool, flush_interval_ms: int = DB_WRITE_BEHIND_INTERVAL_MS,
+                 max_rows: int = DB_WRITE_BEHIND_MAX_ROWS):
+        self.pool = pool
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_rows = max_rows
+        self.pending = []
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.stats = {'flushes': 0, 'flushed_rows': 0, 'dropped_rows': 0}
+        self.thread = threading.Thread(target=self._worker, name='db-write-behind', daemon=True)
+        self.thread.start()
+    
+    def enqueue(self, sql: str, params: tuple):
+        """افزودن یک درج به صف"""
+        with self.lock:
+            self.pending.append((sql, params))
+            backlog = len(self.pending)
+        if backlog >= self.max_rows:
+            self.wakeup.set()
+    
+    def enqueue_many(self, items: List[Tuple[str, tuple]]):
+        """افزودن چند درج به صف به صورت یکجا (همه در یک flush و یک تراکنش نوشته می‌شوند)"""
+        with self.lock:
+            self.pending.extend(items)
+            backlog = len(self.pending)
+        if backlog >= self.max_rows:
+            self.wakeup.set()
+    
+    def backlog_size(self) -> int:
+        """تعداد ردیف‌های در انتظار نوشتن"""
+        with self.lock:
+            return len(self.pending)
+    
+    def _worker(self):
+        """commit دوره‌ای صف (هیچ خطایی thread را متوقف نمی‌کند)"""
+        while not self.stopped.is_set():
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Write-behind worker error: {e}")
+    
+    # خطاهای محیطی (قفل، دیسک پر، I/O): ردیف‌ها سالم‌اند و باید دوباره تلاش شوند، نه حذف
+    TRANSIENT_ERRORS = ('locked', 'busy', 'disk', 'full', 'i/o', 'readonly', 'unable to open')
+    
+    @classmethod
+    def _is_transient(cls, error: Exception) -> bool:
+        """آیا خطا به ردیف‌ها مربوط نیست و با تلاش مجدد برطرف می‌شود"""
+        if isinstance(error, sqlite3.OperationalError):
+            return any(marker in str(error).lower() for marker in cls.TRANSIENT_ERRORS)
+        # خطاهای غیر SQLite (مثلاً OSError) هم به ردیف‌ها مربوط نیستند
+        return not isinstance(error, sqlite3.Error)
+    
+    @staticmethod
+    def _group(batch: List[tuple]) -> List[tuple]:
+        """گروه‌بندی درج‌های پشت‌سرهم با SQL یکسان (با حفظ ترتیب)"""
+        groups = []
+        for sql, params in batch:
+            if groups and groups[-1][0] == sql:
+                groups[-1][1].append(params)
             else:
-                # اولین درخواست
-                new_count = 1
+                groups.append((sql, [params]))
+        return groups
+    
+    def flush(self) -> int:
+        """نوشتن همه ردیف‌های صف در یک تراکنش"""
+        with self.flush_lock:
+            with self.lock:
+                batch, self.pending = self.pending, []
+            if not batch:
+                return 0
             
-            cursor.execute('''
-                UPDATE users 
-                SET daily_requests = ?, last_request_date = ?
-                WHERE user_id = ?
-            ''', (new_count, today, user_id))
+            try:
+                try:
+                    with self.pool.connection() as conn:
+                        for sql, rows in self._group(batch):
+                            conn.executemany(sql, rows)
+                        conn.commit()
+                    written = len(batch)
+                except Exception as e:
+                    if self._is_transient(e):
+                        raise
+                    logger.error(f"Write-behind batch failed, retrying row by row: {e}")
+                    written = self._flush_rows(batch)
+            except Exception as e:
+                # تراکنش برگشت خورده است - ردیف‌ها برای تلاش بعدی به ابتدای صف برمی‌گردند
+                if 'locked' in str(e) or 'busy' in str(e):
+                    logger.warning(f"Write-behind flush deferred: {e}")
+                else:
+                    logger.error(f"Write-behind flush failed, {len(batch)} rows requeued: {e}")
+                with self.lock:
+                    self.pending = batch + self.pending
+                return 0
             
+            self.stats['flushes'] += 1
+            self.stats['flushed_rows'] += written
+            logger.debug(f"Write-behind flushed {written} rows")
+            return written
+    
+    def _flush_rows(self, batch: List[tuple]) -> int:
+        """نوشتن تک‌تک ردیف‌ها و کنار گذاشتن ردیف‌های نامعتبر (خطای محیطی کل batch را برمی‌گرداند)"""
+        written = 0
+        dropped = 0
+        with self.pool.connection() as conn:
+            for sql, params in batch:
+                try:
+                    conn.execute(sql, params)
+                    written += 1
+                except sqlite3.Error as e:
+                    if self._is_transient(e):
+                        raise
+                    dropped += 1
+                    logger.error(f"Dropping write-behind row: {e}")
             conn.commit()
-            conn.close()
-            logger.debug(f"Updated daily requests for user {user_id}: {new_count}")
-            return new_count
-        except Exception as e:
-            logger.error(f"Error updating daily requests for user {user_id}: {e}")
-            return 0
+        self.stats['dropped_rows'] += dropped
+        return written
     
-    def can_make_request(self, user_id: int) -> bool:
-        """بررسی امکان درخواست"""
-        try:
-            count = self.update_daily_requests(user_id)
-            return count <= MAX_DAILY_REQUESTS
-        except Exception as e:
-            logger.error(f"Error checking request limit for user {user_id}: {e}")
-            return True  # در صورت خطا، اجازه درخواست بده
+    def close(self):
+        """توقف thread و نوشتن باقی‌مانده صف"""
+        self.stopped.set()
+        self.wakeup.set()
+        self.thread.join()
+        self.flush()
+
+class QuotaManager:
+    """کلاس سهمیه روزانه با رزرو اتمی (یک UPSERT...RETURNING) و کش در حافظه"""
     
-    def log_request(self, user_id: int, topic: str, category: str):
-        """ثبت درخواست"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+    RESERVE_SQL = '''
+        INSERT INTO users (user_id, daily_requests, last_request_date)
+        VALUES (?, 1, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            daily_requests = CASE WHEN last_request_date = excluded.last_request_date
+                                  THEN daily_requests + 1 ELSE 1 END,
+            last_request_date = excluded.last_request_date
+        WHERE last_request_date IS NOT excluded.last_request_date OR daily_requests < ?
+        RETURNING daily_requests
+    '''
+    
+    REFUND_SQL = '''
+        UPDATE users SET daily_requests = daily_requests - 1
+        WHERE user_id = ? AND last_request_date = ? AND daily_requests > 0
+        RETURNING daily_requests
+    '''
+    
+    def __init__(self, pool: ConnectionPool, daily_limit: int = MAX_DAILY_REQUESTS):
+        self.pool = pool
+        self.daily_limit = daily_limit
+        self.cache = TTLCache()  # user_id -> (date, count)؛ محدود تا برای هر کاربر تا ابد نماند
+    
+    @staticmethod
+    def _today() -> str:
+        return datetime.now().strftime('%Y-%m-%d')
+    
+    def _cached_count(self, user_id: int, today: str) -> Optional[int]:
+        cached = self.cache.get(user_id)
+        if cached and cached[0] == today:
+            return cached[1]
+        return None
+    
+    def _remember(self, user_id: int, today: str, count: int):
+        self.cache.set(user_id, (today, count))
+    
+    def reserve(self, user_id: int) -> Optional[QuotaReservation]:
+        """رزرو اتمی یک واحد سهمیه"""
+        today = self._today()
+        cached = self._cached_count(user_id, today)
+        if cached is not None and cached >= self.daily_limit:
+            return None  # سهمیه تمام شده - بدون مراجعه به دیتابیس
+        
+        with self.pool.connection() as conn:
+            row = conn.execute(self.RESERVE_SQL, (user_id, today, self.daily_limit)).fetchone()
+            conn.commit()
+        
+        if row is None:
+            self._remember(user_id, today, self.daily_limit)
+            return None
+        
+        self._remember(user_id, today, row[0])
+        logger.debug(f"Quota reserved for user {user_id}: {row[0]}/{self.daily_limit}")
+        return QuotaReservation(user_id, today, row[0])
+    
+    def commit(self, reservation: QuotaReservation):
+        """قطعی کردن رزرو (شمارنده قبلاً افزایش یافته است)"""
+        reservation.committed = True
+    
+    def refund(self, reservation: QuotaReservation):
+        """بازگرداندن یک واحد سهمیه رزرو شده"""
+        if reservation.committed or reservation.refunded or reservation.count == 0:
+            return
+        reservation.refunded = True
+        
+        with self.pool.connection() as conn:
+            row = conn.execute(self.REFUND_SQL, (reservation.user_id, reservation.date)).fetchone()
+            conn.commit()
+        
+        if row is not None:
+            self._remember(reservation.user_id, reservation.date, row[0])
+        logger.debug(f"Quota refunded for user {reservation.user_id}")
+    
+    def remaining(self, user_id: int) -> int:
+        """تعداد درخواست‌های باقی‌مانده امروز"""
+        today = self._today()
+        count = self._cached_count(user_id, today)
+        if count is None:
+            with self.pool.connection() as conn:
+                row = conn.execute(
+                    'SELECT daily_requests, last_request_date FROM users WHERE user_id = ?', (user_id,)
+                ).fetchone()
+            count = row[0] if row and row[1] == today else 0
+            self._remember(user_id, today, count)
+        return max(0, self.daily_limit - count)
+
+# عبارت SQL بدنه کامل یک ردیف saved_content (متن قدیمی یا blob فشرده)
+def content_body_sql(alias: str = '') -> str:
+    """عبارت SQL برای خواندن شفاف بدنه saved_content"""
+    prefix = f'{alias}.' if alias else ''
+    return f'''COALESCE({prefix}content, (
+        SELECT fa_inflate(b.codec, b.data, d.data)
+        FROM content_blobs b LEFT JOIN compression_dicts d ON d.id = b.dict_id
+        WHERE b.hash = {prefix}content_hash
+    ))'''
+
+class ContentBlobStore:
+    """کلاس ذخیره‌سازی content-addressed و فشرده بدنه محتوای ذخیره شده"""
+    
+    INSERT_BLOB_SQL = '''
+        INSERT INTO content_blobs (hash, codec, dict_id, data, size)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(hash) DO NOTHING
+    '''
+    
+    def __init__(self, pool: ConnectionPool, read_pool: Optional[ConnectionPool] = None):
+        self.pool = pool
+        self.read_pool = read_pool or pool  # گزارش‌ها روی اتصال فقط‌خواندنی
+        self.lock = threading.Lock()
+        self.dictionary = None  # (dict_id, bytes) دیکشنری فعال
+        self.dictionary_loaded = False
+    
+    @staticmethod
+    def content_hash(text: str) -> str:
+        """کلید محتوا (sha256 متن)"""
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+    
+    def current_dictionary(self) -> Optional[Tuple[int, bytes]]:
+        """دریافت آخرین دیکشنری فشرده‌سازی (با کش در حافظه)"""
+        with self.lock:
+            if not self.dictionary_loaded:
+                with self.pool.connection() as conn:
+                    row = conn.execute(
+                        'SELECT id, data FROM compression_dicts ORDER BY id DESC LIMIT 1'
+                    ).fetchone()
+                self.dictionary = (row[0], bytes(row[1])) if row else None
+                self.dictionary_loaded = True
+            return self.dictionary
+    
+    def encode(self, text: str) -> tuple:
+        """ساخت پارامترهای درج blob برای یک متن: (hash, codec, dict_id, data, size)"""
+        dictionary = self.current_dictionary()
+        codec, data = compress_content(text, dictionary[1] if dictionary else None)
+        dict_id = dictionary[0] if codec == 'zlib-dict' else None
+        return self.content_hash(text), codec, dict_id, data, len(text.encode('utf-8'))
+    
+    def train_dictionary(self, min_samples: int = CONTENT_DICT_MIN_SAMPLES) -> Optional[int]:
+        """آموزش دیکشنری جدید از پست‌های اخیر و فشرده‌سازی مجدد blobهای بدون دیکشنری"""
+        with self.pool.connection() as conn:
+            samples = [row[0] for row in conn.execute(f'''
+                SELECT {content_body_sql('sc')} FROM saved_content sc
+                ORDER BY sc.id DESC LIMIT ?
+            ''', (CONTENT_DICT_SAMPLE_SIZE,)) if row[0]]
+        
+        if len(samples) < min_samples:
+            return None
+        
+        zdict = train_compression_dictionary(samples)
+        if not zdict:
+            return None
+        
+        with self.pool.connection() as conn:
+            dict_id = conn.execute(
+                'INSERT INTO compression_dicts (data, sample_count) VALUES (?, ?) RETURNING id',
+                (zdict, len(samples))
+            ).fetchone()[0]
+            conn.commit()
+        
+        with self.lock:
+            self.dictionary = (dict_id, zdict)
+            self.dictionary_loaded = True
+        
+        recompressed = self.recompress()
+        logger.info(
+            f"Trained content dictionary {dict_id} ({len(zdict)} bytes from {len(samples)} posts), "
+            f"recompressed {recompressed} blobs"
+        )
+        return dict_id
+    
+    def maybe_train_dictionary(self) -> Optional[int]:
+        """آموزش دیکشنری فقط اگر هنوز دیکشنری وجود ندارد"""
+        if self.current_dictionary():
+            return None
+        return self.train_dictionary()
+    
+    def recompress(self, batch_size: int = 200) -> int:
+        """فشرده‌سازی مجدد blobهایی که با دیکشنری فعلی ساخته نشده‌اند (به صورت دسته‌ای)"""
+        dictionary = self.current_dictionary()
+        if not dictionary:
+            return 0
+        
+        dict_id, zdict = dictionary
+        total = 0
+        last_hash = ''
+        while True:
+            with self.pool.connection() as conn:
+                rows = conn.execute('''
+                    SELECT b.hash, b.codec, b.data, d.data FROM content_blobs b
+                    LEFT JOIN compression_dicts d ON d.id = b.dict_id
+                    WHERE b.hash > ? AND b.dict_id IS NOT ?
+                    ORDER BY b.hash LIMIT ?
+                ''', (last_hash, dict_id, batch_size)).fetchall()
+                if not rows:
+                    return total
+                
+                updates = []
+                for content_hash, codec, data, old_dict in rows:
+                    text = inflate_content(codec, data, old_dict)
+                    new_codec, new_data = compress_content(text, zdict)
+                    if len(new_data) < len(data):
+                        updates.append((new_codec, dict_id if new_codec == 'zlib-dict' else None,
+                                        new_data, content_hash))
+                conn.executemany(
+                    'UPDATE content_blobs SET codec = ?, dict_id = ?, data = ? WHERE hash = ?', updates
+                )
+                conn.commit()
+            
+            total += len(updates)
+            last_hash = rows[-1][0]
+    
+    def delete_unreferenced(self, chunk_rows: int = RETENTION_CHUNK_ROWS) -> int:
+        """حذف blobهایی که هیچ ردیف saved_content به آن‌ها اشاره نمی‌کند"""
+        total = 0
+        while True:
+            with self.pool.connection() as conn:
+                cursor = conn.execute('''
+                    DELETE FROM content_blobs WHERE hash IN (
+                        SELECT b.hash FROM content_blobs b
+                        WHERE NOT EXISTS (SELECT 1 FROM saved_content sc WHERE sc.content_hash = b.hash)
+                        LIMIT ?
+                    )
+                ''', (chunk_rows,))
+                conn.commit()
+            total += cursor.rowcount
+            if cursor.rowcount < chunk_rows:
+                return total
+            time.sleep(RETENTION_PAUSE_SECONDS)
+    
+    def get_report(self) -> Dict[str, Any]:
+        """گزارش حذف تکرار و صرفه‌جویی فضا"""
+        with self.read_pool.connection() as conn:
+            rows, referenced, logical_bytes = conn.execute('''
+                SELECT COUNT(*), COUNT(b.hash), COALESCE(SUM(b.size), 0)
+                FROM saved_content sc LEFT JOIN content_blobs b ON b.hash = sc.content_hash
+            ''').fetchone()
+            blobs, unique_bytes, stored_bytes = conn.execute('''
+                SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(length(data)), 0) FROM content_blobs
+            ''').fetchone()
+        
+        dictionary = self.current_dictionary()
+        return {
+            'rows': rows,
+            'blob_rows': referenced,
+            'unique_blobs': blobs,
+            'dedup_ratio': referenced / blobs if blobs else 1.0,
+            'logical_bytes': logical_bytes,
+            'unique_bytes': unique_bytes,
+            'stored_bytes': stored_bytes,
+            'bytes_saved': logical_bytes - stored_bytes,
+            'compression_ratio': unique_bytes / stored_bytes if stored_bytes else 1.0,
+            'dictionary_id': dictionary[0] if dictionary else None,
+            'dictionary_size': len(dictionary[1]) if dictionary else 0
+        }
+
+class StorageShard:
+    """یک فایل دیتابیس با pool اتصال، صف نوشتن و انبار blob مخصوص خودش"""
+    
+    def __init__(self, index: int, db_path: str):
+        self.index = index
+        self.db_path = db_path
+        self.pool = ConnectionPool(db_path)
+        # اتصال‌های جدا برای کوئری‌های آماری تا اسکن‌های سنگین اتصال‌های نوشتن را اشغال نکنند
+        self.read_pool = ConnectionPool(db_path, read_only=True, query_budget=DB_ANALYTICS_QUERY_BUDGET_SECONDS)
+        self.write_queue = WriteBehindQueue(self.pool)
+        self.blobs = ContentBlobStore(self.pool, self.read_pool)
+    
+    def close(self):
+        """نوشتن صف و بستن اتصال‌های shard"""
+        self.write_queue.close()
+        try:
+            with self.pool.connection() as conn:
+                conn.execute('PRAGMA optimize')
+        except Exception as e:
+            logger.warning(f"PRAGMA optimize failed for {self.db_path}: {e}")
+        self.read_pool.close_all()
+        self.pool.close_all()
+
+class DatabaseManager:
+    # جداول کاربرمحور که بر اساس user_id بین shardها پخش می‌شوند
+    SHARDED_TABLES = ('requests', 'saved_content', 'search_history', 'reminders', 'system_notifications')
+    
+    def __init__(self, db_path="bot_database.db", shard_count: int = DB_SHARD_COUNT):
+        self.db_path = db_path
+        # shard صفر فایل اصلی است و جداول سراسری (کاربران، تنظیمات، آمار، اشتراک‌ها) را هم دارد
+        self.shards = [StorageShard(0, db_path)] + [
+            StorageShard(index, self._shard_path(index)) for index in range(1, max(1, shard_count))
+        ]
+        self.pool = self.shards[0].pool
+        self.read_pool = self.shards[0].read_pool
+        self.write_queue = self.shards[0].write_queue
+        self.blobs = self.shards[0].blobs
+        self.init_database()
+        self.quota = QuotaManager(self.pool)
+        self.user_cache = TTLCache()
+        self.settings_cache = TTLCache()
+    
+    def _shard_path(self, index: int) -> str:
+        """مسیر فایل shard شماره index (کنار فایل اصلی)"""
+        base, ext = os.path.splitext(self.db_path)
+        return f"{base}.shard{index}{ext or '.db'}"
+    
+    def shard_for_user(self, user_id: int) -> StorageShard:
+        """shard مسئول داده‌های یک کاربر (hash پایدار user_id)"""
+        if len(self.shards) == 1:
+            return self.shards[0]
+        return self.shards[zlib.crc32(str(user_id).encode()) % len(self.shards)]
+    
+    def shard_for_id(self, row_id: int) -> StorageShard:
+        """shard صاحب یک ردیف از روی بازه id آن"""
+        index = row_id // DB_SHARD_ID_SPAN
+        return self.shards[index] if 0 <= index < len(self.shards) else self.shards[0]
+    
+    def flush_writes(self):
+        """نوشتن صف همه shardها"""
+        for shard in self.shards:
+            shard.write_queue.flush()
+    
+    def write_backlog(self) -> int:
+        """مجموع ردیف‌های در انتظار نوشتن در همه shardها"""
+        return sum(shard.write_queue.backlog_size() for shard in self.shards)
+    
+    def close(self):
+        """نوشتن صف و بستن اتصال‌های دیتابیس"""
+        for shard in self.shards:
+            shard.close()
+    
+    def reset_caches(self):
+        """خالی کردن کش‌های حافظه (مثلاً پس از بازیابی پشتیبان)"""
+        self.user_cache.clear()
+        self.settings_cache.clear()
+        self.quota.cache.clear()
+        for shard in self.shards:
+            with shard.blobs.lock:
+                shard.blobs.dictionary_loaded = False
+    
+    def get_content_storage_report(self) -> Dict[str, Any]:
+        """گزارش ذخیره‌سازی بدنه محتوا (حذف تکرار و فشرده‌سازی) برای همه shardها"""
+        try:
+            self.flush_writes()
+            reports = [shard.blobs.get_report() for shard in self.shards]
+            report = {
+                key: sum(item[key] for item in reports)
+                for key in ('rows', 'blob_rows', 'unique_blobs', 'logical_bytes',
+                            'unique_bytes', 'stored_bytes', 'bytes_saved')
+            }
+            report['dedup_ratio'] = report['blob_rows'] / report['unique_blobs'] if report['unique_blobs'] else 1.0
+            report['compression_ratio'] = (
+                report['unique_bytes'] / report['stored_bytes'] if report['stored_bytes'] else 1.0
+            )
+            report['dictionary_id'] = reports[0]['dictionary_id']
+            report['dictionary_size'] = reports[0]['dictionary_size']
+            return report
+        except Exception as e:
+            logger.error(f"Error getting content storage report: {e}")
+            return {}
+    
+    def train_content_dictionaries(self) -> int:
+        """آموزش دیکشنری فشرده‌سازی برای shardهایی که هنوز دیکشنری ندارند"""
+        return sum(1 for shard in self.shards if shard.blobs.maybe_train_dictionary())
+    
+    # مهاجرت‌های شِما به ترتیب نسخه: (نسخه، توضیح، نام متد، اجرا داخل تراکنش)
+    MIGRATIONS = [
+        (1, 'baseline schema', '_migration_baseline', True),
+        (2, 'hot-path lookup indexes', '_migration_lookup_indexes', True),
+        (3, 'incremental auto_vacuum', '_migration_incremental_vacuum', False),
+        (4, 'content-addressed saved_content bodies', '_migration_content_blobs', True),
+        (5, 'incremental per-user counters', '_migration_user_counters', True),
+        (6, 'persistent research cache', '_migration_research_cache', True),
+        (7, 'rebuild full-text index with ZWNJ word boundaries', '_migration_rebuild_fulltext_index', True),
+    ]
+    
+    # کوئری‌های پرتکرار؛ متدها و hot_queries از همین ثابت‌ها استفاده می‌کنند تا بررسی plan از کد واقعی عقب نماند
+    GET_USER_SQL = '''
+        SELECT user_id, username, first_name, last_name, join_date, daily_requests,
+               last_request_date, preferred_category, language, role, is_premium
+        FROM users WHERE user_id = ?
+    '''
+    USER_SETTINGS_SQL = '''
+        SELECT user_id, language, content_length, content_type, notification_enabled,
+               auto_save, preferred_categories, theme, privacy_level, auto_translate,
+               target_language, content_format, ai_assistant_enabled, research_depth
+        FROM user_settings WHERE user_id = ?
+    '''
+    USER_STATS_SQL = 'SELECT daily_requests, join_date, last_activity, is_premium FROM users WHERE user_id = ?'
+    SAVED_CONTENT_PAGE_SQL = f'''
+        SELECT id, topic, category, {content_body_sql('saved_content')}, created_at, is_favorite
+        FROM saved_content
+    '''
+    TOGGLE_FAVORITE_SQL = '''
+        UPDATE saved_content
+        SET is_favorite = CASE WHEN is_favorite = 1 THEN 0 ELSE 1 END
+        WHERE id = ? AND user_id = ?
+    '''
+    REMINDERS_PAGE_SQL = '''
+        SELECT id, title, topic, message, scheduled_time, reminder_type,
+               repeat_interval, is_sent, sent_count, last_sent, is_active
+        FROM reminders
+    '''
+    SEARCH_HISTORY_PAGE_SQL = '''
+        SELECT id, query, category, results_count, created_at, is_successful
+        FROM search_history
+    '''
+    NOTIFICATIONS_PAGE_SQL = '''
+        SELECT id, title, message, notification_type, is_read, created_at,
+               action_url, expires_at
+        FROM system_notifications
+    '''
+    SHARE_LOOKUP_SQL = '''
+        SELECT id, content_id, user_id, share_type, expires_at
+        FROM content_shares
+        WHERE share_url = ? AND is_active = 1
+          AND (expires_at IS NULL OR datetime(expires_at) > datetime('now'))
+    '''
+    SHARED_CONTENT_SQL = f'''
+        SELECT sc.topic, sc.category, {content_body_sql('sc')}, sc.content_type, sc.language
+        FROM saved_content sc WHERE sc.id = ?
+    '''
+    CUSTOM_CATEGORIES_SQL = '''
+        SELECT id, name, description, color, icon, is_default, created_at
+        FROM custom_categories
+        WHERE user_id = ?
+        ORDER BY created_at ASC
+    '''
+    USER_COUNTERS_SQL = '''
+        SELECT total_requests, successful_requests, failed_requests, timed_requests,
+               total_processing_time, last_request_at, content_saved, favorites, public_content
+        FROM user_counters WHERE user_id = ?
+    '''
+    USER_CATEGORY_COUNTERS_SQL = '''
+        SELECT category, total_requests FROM user_category_counters
+        WHERE user_id = ? ORDER BY total_requests DESC LIMIT ?
+    '''
+    
+    def init_database(self):
+        """ایجاد و به‌روزرسانی شِمای دیتابیس با مهاجرت‌های نسخه‌دار (روی همه shardها)"""
+        try:
+            # هر shard شِمای کامل را دارد تا یک لیست مهاجرت برای همه فایل‌ها کافی باشد
+            self.fts_enabled = True
+            for shard in self.shards:
+                with shard.pool.connection() as conn:
+                    self._run_migrations(conn)
+                    self.fts_enabled = self._init_fulltext_index(conn) and self.fts_enabled
+                    if shard.index:
+                        self._reserve_id_range(conn, shard.index)
+            
+            for name, detail in self.check_query_plans():
+                logger.warning(f"Hot query '{name}' uses a full table scan: {detail}")
+            logger.info("Advanced database initialized successfully")
+        except Exception as e:
+            logger.error(f"Error initializing database: {e}")
+            raise DatabaseError(f"خطا در راه‌اندازی دیتابیس: {str(e)}")
+    
+    def _reserve_id_range(self, conn: sqlite3.Connection, index: int):
+        """شروع شمارنده AUTOINCREMENT جداول کاربرمحور از ابتدای بازه id این shard"""
+        base = index * DB_SHARD_ID_SPAN
+        for table in self.SHARDED_TABLES:
+            row = conn.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()
+            if row is None:
+                conn.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (table, base))
+            elif row[0] < base:
+                conn.execute('UPDATE sqlite_sequence SET seq = ? WHERE name = ?', (base, table))
+        conn.commit()
+    
+    def get_schema_version(self) -> int:
+        """دریافت نسخه فعلی شِمای دیتابیس"""
+        with self.pool.connection() as conn:
+            return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+    
+    def _run_migrations(self, conn: sqlite3.Connection):
+        """اجرای مهاجرت‌های اعمال‌نشده، هر کدام در یک تراکنش جدا"""
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at TEXT DEFAULT (datetime('now'))
+            )
+        ''')
+        conn.commit()
+        
+        current = conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+        for version, description, method_name, transactional in self.MIGRATIONS:
+            if version <= current:
+                continue
+            
+            if not transactional:
+                # دستوراتی مثل VACUUM داخل تراکنش اجرا نمی‌شوند؛ این مهاجرت‌ها باید تکرارپذیر باشند
+                getattr(self, method_name)(conn.cursor())
+                conn.execute(
+                    'INSERT OR IGNORE INTO schema_version (version, description) VALUES (?, ?)',
+                    (version, description)
+                )
+                conn.commit()
+                logger.info(f"Applied schema migration {version}: {description}")
+                continue
+            
+            # قفل نوشتن تا دو فرآیند هم‌زمان یک مهاجرت را دوبار اجرا نکنند
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if conn.execute('SELECT 1 FROM schema_version WHERE version = ?', (version,)).fetchone():
+                    conn.rollback()
+                    continue
+                getattr(self, method_name)(conn.cursor())
+                conn.execute(
+                    'INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                    (version, description)
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            logger.info(f"Applied schema migration {version}: {description}")
+    
+    def _migration_baseline(self, cursor: sqlite3.Cursor):
+        """مهاجرت ۱: جداول و ایندکس‌های پایه (برای دیتابیس‌های قدیمی بدون تغییر اجرا می‌شود)"""
+        # جدول کاربران پیشرفته
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                username TEXT,
+                first_name TEXT,
+                last_name TEXT,
+                join_date TEXT DEFAULT (datetime('now')),
+                daily_requests INTEGER DEFAULT 0,
+                last_request_date TEXT,
+                preferred_category TEXT DEFAULT 'general',
+                language TEXT DEFAULT 'fa',
+                role TEXT DEFAULT 'user',
+                is_premium BOOLEAN DEFAULT 0,
+                premium_expires TEXT,
+                total_requests INTEGER DEFAULT 0,
+                total_content_saved INTEGER DEFAULT 0,
+                last_activity TEXT DEFAULT (datetime('now')),
+                timezone TEXT DEFAULT 'Asia/Tehran',
+                notification_settings TEXT DEFAULT '{}'
+            )
+        ''')
+
+        # جدول درخواست‌های پیشرفته
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS requests (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                topic TEXT,
+                category TEXT,
+                content_type TEXT DEFAULT 'educational',
+                language TEXT DEFAULT 'fa',
+                created_at TEXT DEFAULT (datetime('now')),
+                status TEXT DEFAULT 'completed',
+                processing_time REAL,
+                content_length INTEGER,
+                word_count INTEGER,
+                error_message TEXT,
+                metadata TEXT DEFAULT '{}',
+                FOREIGN KEY (user_id) REFERENCES users (user_id)
+            )
+        ''')
+
+        # جدول آمار پیشرفته
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS analytics (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                date TEXT,
+                total_requests INTEGER DEFAULT 0,
+                successful_requests INTEGER DEFAULT 0,
+                failed_requests INTEGER DEFAULT 0,
+                total_users INTEGER DEFAULT 0,
+                new_users INTEGER DEFAULT 0,
+                active_users INTEGER DEFAULT 0,
+                avg_processing_time REAL,
+                popular_categories TEXT DEFAULT '{}',
+                system_errors INTEGER DEFAULT 0
+            )
+        ''')
+
+        # جدول تجمیعی روزانه هر کاربر به تفکیک دسته‌بندی
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_daily_stats (
+                user_id INTEGER,
+                date TEXT,
+                category TEXT,
+                total_requests INTEGER DEFAULT 0,
+                successful_requests INTEGER DEFAULT 0,
+                failed_requests INTEGER DEFAULT 0,
+                timed_requests INTEGER DEFAULT 0,
+                total_processing_time REAL DEFAULT 0,
+                PRIMARY KEY (user_id, date, category)
+            )
+        ''')
+
+        # وضعیت کارهای تجمیعی (watermark)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS rollup_state (
+                name TEXT PRIMARY KEY,
+                value TEXT
+            )
+        ''')
+
+        # جدول محتوای ذخیره شده پیشرفته
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS saved_content (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                topic TEXT,
+                category TEXT,
+                content TEXT,
+                content_type TEXT DEFAULT 'text',
+                language TEXT DEFAULT 'fa',
+                created_at TEXT DEFAULT (datetime('now')),
+                updated_at TEXT DEFAULT (datetime('now')),
+                is_favorite BOOLEAN DEFAULT 0,
+                is_public BOOLEAN DEFAULT 0,
+                tags TEXT DEFAULT '[]',
+                metadata TEXT DEFAULT '{}',
+                view_count INTEGER DEFAULT 0,
+                share_count INTEGER DEFAULT 0,
+                rating REAL DEFAULT 0,
+                rating_count INTEGER DEFAULT 0,
+                FOREIGN KEY (user_id) REFERENCES users (user_id)
+            )
+        ''')
+
+        # جدول تنظیمات کاربر پیشرفته
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_settings (
+                user_id INTEGER PRIMARY KEY,
+                language TEXT DEFAULT 'fa',
+                content_length TEXT DEFAULT 'medium',
+                content_type TEXT DEFAULT 'educational',
+                notification_enabled BOOLEAN DEFAULT 1,
+                auto_save BOOLEAN DEFAULT 1,
+                preferred_categories TEXT DEFAULT 'general',
+                theme TEXT DEFAULT 'default',
+                privacy_level TEXT DEFAULT 'private',
+                auto_translate BOOLEAN DEFAULT 0,
+                target_language TEXT DEFAULT 'fa',
+                content_format TEXT DEFAULT 'structured',
+                ai_assistant_enabled BOOLEAN DEFAULT 1,
+                research_depth TEXT DEFAULT 'comprehensive',
+                created_at TEXT DEFAULT (datetime('now')),
+                updated_at TEXT DEFAULT (datetime('now')),
+                FOREIGN KEY (user_id) REFERENCES users (user_id)
+            )
+        ''')
+
+        # جدول یادآوری‌های پیشرفته
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS reminders (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                title TEXT,
+                topic TEXT,
+                message TEXT,
+                reminder_type TEXT DEFAULT 'custom',
+                scheduled_time TEXT,
+                repeat_interval TEXT,
+                is_sent BOOLEAN DEFAULT 0,
+                sent_count INTEGER DEFAULT 0,
+                last_sent TEXT,
+                is_active BOOLEAN DEFAULT 1,
+                created_at TEXT DEFAULT (datetime('now')),
+                updated_at TEXT DEFAULT (datetime('now')),
+                metadata TEXT DEFAULT '{}',
+                FOREIGN KEY (user_id) REFERENCES users (user_id)
+            )
+        ''')
+
+        # جدول بازخورد پیشرفته
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS feedback (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                topic TEXT,
+                content_id INTEGER,
+                rating INTEGER,
+                comment TEXT,
+                feedback_type TEXT DEFAULT 'general',
+                category TEXT,
+                created_at TEXT DEFAULT (datetime('now')),
+                is_helpful BOOLEAN DEFAULT 0,
+                helpful_count INTEGER DEFAULT 0,
+                response TEXT,
+                status TEXT DEFAULT 'pending',
+                FOREIGN KEY (user_id) REFERENCES users (user_id),
+                FOREIGN KEY (content_id) REFERENCES saved_content (id)
+            )
+        ''')
+
+        # جدول جستجو و تاریخچه
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS search_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                query TEXT,
+                category TEXT,
+                results_count INTEGER,
+                created_at TEXT DEFAULT (datetime('now')),
+                is_successful BOOLEAN DEFAULT 1,
+                processing_time REAL,
+                FOREIGN KEY (user_id) REFERENCES users (user_id)
+            )
+        ''')
+
+        # جدول اشتراک‌گذاری
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS content_shares (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                content_id INTEGER,
+                user_id INTEGER,
+                share_type TEXT DEFAULT 'public',
+                share_url TEXT,
+                share_count INTEGER DEFAULT 0,
+                created_at TEXT DEFAULT (datetime('now')),
+                expires_at TEXT,
+                is_active BOOLEAN DEFAULT 1,
+                FOREIGN KEY (content_id) REFERENCES saved_content (id),
+                FOREIGN KEY (user_id) REFERENCES users (user_id)
+            )
+        ''')
+
+        # جدول دسته‌بندی‌های سفارشی
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS custom_categories (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                name TEXT,
+                description TEXT,
+                color TEXT DEFAULT '#007bff',
+                icon TEXT DEFAULT '📁',
+                is_default BOOLEAN DEFAULT 0,
+                created_at TEXT DEFAULT (datetime('now')),
+                updated_at TEXT DEFAULT (datetime('now')),
+                FOREIGN KEY (user_id) REFERENCES users (user_id)
+            )
+        ''')
+
+        # جدول قالب‌های سفارشی
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS custom_templates (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                name TEXT,
+                category TEXT,
+                template_structure TEXT,
+                is_public BOOLEAN DEFAULT 0,
+                usage_count INTEGER DEFAULT 0,
+                rating REAL DEFAULT 0,
+                created_at TEXT DEFAULT (datetime('now')),
+                updated_at TEXT DEFAULT (datetime('now')),
+                FOREIGN KEY (user_id) REFERENCES users (user_id)
+            )
+        ''')
+
+        # جدول اعلان‌های سیستم
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS system_notifications (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                title TEXT,
+                message TEXT,
+                notification_type TEXT DEFAULT 'info',
+                is_read BOOLEAN DEFAULT 0,
+                created_at TEXT DEFAULT (datetime('now')),
+                expires_at TEXT,
+                action_url TEXT,
+                metadata TEXT DEFAULT '{}',
+                FOREIGN KEY (user_id) REFERENCES users (user_id)
+            )
+        ''')
+
+        # ایجاد ایندکس‌ها برای بهبود عملکرد
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_join_date ON users(join_date)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_requests_user_date ON requests(user_id, created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_requests_created ON requests(created_at)')
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_analytics_date ON analytics(date)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_saved_content_user ON saved_content(user_id, created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_reminders_scheduled ON reminders(scheduled_time, is_active)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_feedback_user ON feedback(user_id, created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_search_history_user ON search_history(user_id, created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_notifications_user_date ON system_notifications(user_id, created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_reminders_user_time ON reminders(user_id, scheduled_time)')
+    
+    def _migration_lookup_indexes(self, cursor: sqlite3.Cursor):
+        """مهاجرت ۲: ایندکس‌های جستجوهای پرتکرار (بر اساس EXPLAIN QUERY PLAN)"""
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_content_shares_url ON content_shares(share_url)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_notifications_user_unread ON system_notifications(user_id, is_read, created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_custom_categories_user ON custom_categories(user_id, created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_reminders_user_active ON reminders(user_id, is_active, scheduled_time)')
+    
+    def _migration_incremental_vacuum(self, cursor: sqlite3.Cursor):
+        """مهاجرت ۳: فعال کردن auto_vacuum=INCREMENTAL تا فضای حذف شده قابل بازپس‌گیری باشد"""
+        if cursor.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            # تغییر حالت auto_vacuum روی دیتابیس موجود فقط با VACUUM اعمال می‌شود (یک بار)؛
+            # VACUUM کل فایل را بازنویسی و قفل می‌کند، پس فقط برای فایل‌های کوچک در startup اجرا می‌شود
+            page_count = cursor.execute('PRAGMA page_count').fetchone()[0]
+            page_size = cursor.execute('PRAGMA page_size').fetchone()[0]
+            size_mb = page_count * page_size / (1024 * 1024)
+            if size_mb <= DB_STARTUP_VACUUM_MAX_MB:
+                cursor.execute('VACUUM')
+            else:
+                logger.warning(
+                    f"Skipping startup VACUUM for {size_mb:.0f} MB database; auto_vacuum=INCREMENTAL takes effect "
+                    f"after running VACUUM manually during a maintenance window"
+                )
+    
+    def _migration_content_blobs(self, cursor: sqlite3.Cursor):
+        """مهاجرت ۴: انتقال بدنه saved_content به جدول blob فشرده و content-addressed"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS compression_dicts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                data BLOB NOT NULL,
+                sample_count INTEGER,
+                created_at TEXT DEFAULT (datetime('now'))
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS content_blobs (
+                hash TEXT PRIMARY KEY,
+                codec TEXT NOT NULL,
+                dict_id INTEGER REFERENCES compression_dicts (id),
+                data BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created_at TEXT DEFAULT (datetime('now'))
+            )
+        ''')
+        
+        columns = {row[1] for row in cursor.execute('PRAGMA table_info(saved_content)')}
+        if 'content_hash' not in columns:
+            cursor.execute('ALTER TABLE saved_content ADD COLUMN content_hash TEXT')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_saved_content_hash ON saved_content(content_hash)')
+        
+        # triggerهای FTS با تعریف جدید (خواندن از blob) در _init_fulltext_index ساخته می‌شوند؛
+        # حذف آن‌ها پیش از انتقال، ایندکس موجود را دست‌نخورده نگه می‌دارد
+        for trigger in ('saved_content_fts_insert', 'saved_content_fts_update'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        
+        rows = cursor.execute(
+            'SELECT id, content FROM saved_content WHERE content IS NOT NULL AND content_hash IS NULL'
+        ).fetchall()
+        for row_id, content in rows:
+            # هنگام مهاجرت هنوز دیکشنری آموزش ندیده است؛ بعداً با recompress بهینه می‌شود
+            content_hash = ContentBlobStore.content_hash(content)
+            codec, data = compress_content(content)
+            cursor.execute(ContentBlobStore.INSERT_BLOB_SQL,
+                           (content_hash, codec, None, data, len(content.encode('utf-8'))))
+            cursor.execute(
+                'UPDATE saved_content SET content_hash = ?, content = NULL WHERE id = ?',
+                (content_hash, row_id)
+            )
+    
+    def _migration_user_counters(self, cursor: sqlite3.Cursor):
+        """مهاجرت ۵: شمارنده‌های تجمعی هر کاربر که با trigger در همان فایل (shard) به‌روز می‌شوند"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_counters (
+                user_id INTEGER PRIMARY KEY,
+                total_requests INTEGER NOT NULL DEFAULT 0,
+                successful_requests INTEGER NOT NULL DEFAULT 0,
+                failed_requests INTEGER NOT NULL DEFAULT 0,
+                timed_requests INTEGER NOT NULL DEFAULT 0,
+                total_processing_time REAL NOT NULL DEFAULT 0,
+                last_request_at TEXT,
+                content_saved INTEGER NOT NULL DEFAULT 0,
+                favorites INTEGER NOT NULL DEFAULT 0,
+                public_content INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_category_counters (
+                user_id INTEGER NOT NULL,
+                category TEXT NOT NULL,
+                total_requests INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, category)
+            ) WITHOUT ROWID
+        ''')
+        
+        # شمارنده درخواست‌ها تجمعی است و با حذف نگه‌داشت (retention) کم نمی‌شود
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS requests_counters_insert AFTER INSERT ON requests BEGIN
+                INSERT INTO user_counters (user_id, total_requests, successful_requests, failed_requests,
+                                           timed_requests, total_processing_time, last_request_at)
+                VALUES (new.user_id, 1, new.status = 'completed', new.status = 'failed',
+                        new.processing_time IS NOT NULL, COALESCE(new.processing_time, 0), new.created_at)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    total_requests = total_requests + 1,
+                    successful_requests = successful_requests + excluded.successful_requests,
+                    failed_requests = failed_requests + excluded.failed_requests,
+                    timed_requests = timed_requests + excluded.timed_requests,
+                    total_processing_time = total_processing_time + excluded.total_processing_time,
+                    last_request_at = excluded.last_request_at;
+                INSERT INTO user_category_counters (user_id, category, total_requests)
+                VALUES (new.user_id, COALESCE(new.category, 'general'), 1)
+                ON CONFLICT(user_id, category) DO UPDATE SET total_requests = total_requests + 1;
+            END
+        ''')
+        
+        # شمارنده محتوا وضعیت فعلی را نشان می‌دهد (درج، حذف و تغییر علاقه‌مندی/عمومی)
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS saved_content_counters_insert AFTER INSERT ON saved_content BEGIN
+                INSERT INTO user_counters (user_id, content_saved, favorites, public_content)
+                VALUES (new.user_id, 1, COALESCE(new.is_favorite, 0) != 0, COALESCE(new.is_public, 0) != 0)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    content_saved = content_saved + 1,
+                    favorites = favorites + excluded.favorites,
+                    public_content = public_content + excluded.public_content;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS saved_content_counters_delete AFTER DELETE ON saved_content BEGIN
+                UPDATE user_counters SET
+                    content_saved = content_saved - 1,
+                    favorites = favorites - (COALESCE(old.is_favorite, 0) != 0),
+                    public_content = public_content - (COALESCE(old.is_public, 0) != 0)
+                WHERE user_id = old.user_id;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS saved_content_counters_update AFTER UPDATE OF is_favorite, is_public ON saved_content BEGIN
+                UPDATE user_counters SET
+                    favorites = favorites + (COALESCE(new.is_favorite, 0) != 0) - (COALESCE(old.is_favorite, 0) != 0),
+                    public_content = public_content + (COALESCE(new.is_public, 0) != 0) - (COALESCE(old.is_public, 0) != 0)
+                WHERE user_id = new.user_id;
+            END
+        ''')
+        
+        # مقداردهی اولیه از داده‌های موجود
+        cursor.execute('''
+            INSERT INTO user_counters (user_id, total_requests, successful_requests, failed_requests,
+                                       timed_requests, total_processing_time, last_request_at)
+            SELECT user_id, COUNT(*), COUNT(CASE WHEN status = 'completed' THEN 1 END),
+                   COUNT(CASE WHEN status = 'failed' THEN 1 END), COUNT(processing_time),
+                   COALESCE(SUM(processing_time), 0), MAX(created_at)
+            FROM requests GROUP BY user_id
+        ''')
+        cursor.execute('''
+            INSERT INTO user_counters (user_id, content_saved, favorites, public_content)
+            SELECT user_id, COUNT(*), COUNT(CASE WHEN is_favorite = 1 THEN 1 END),
+                   COUNT(CASE WHEN is_public = 1 THEN 1 END)
+            FROM saved_content WHERE true GROUP BY user_id
+            ON CONFLICT(user_id) DO UPDATE SET
+                content_saved = excluded.content_saved,
+                favorites = excluded.favorites,
+                public_content = excluded.public_content
+        ''')
+        cursor.execute('''
+            INSERT INTO user_category_counters (user_id, category, total_requests)
+            SELECT user_id, COALESCE(category, 'general'), COUNT(*)
+            FROM requests GROUP BY user_id, COALESCE(category, 'general')
+        ''')
+    
+    def _migration_research_cache(self, cursor: sqlite3.Cursor):
+        """مهاجرت ۶: لایه دوم (ماندگار) کش نتایج تحقیق"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS research_cache (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                topic_key TEXT NOT NULL UNIQUE,
+                topic TEXT,
+                research_content TEXT NOT NULL,
+                sources TEXT DEFAULT '[]',
+                created_at TEXT DEFAULT (datetime('now')),
+                expires_at TEXT NOT NULL
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_research_cache_expires ON research_cache(expires_at)')
+    
+    def _migration_rebuild_fulltext_index(self, cursor: sqlite3.Cursor):
+        """مهاجرت ۷: حذف ایندکس FTS قدیمی (نیم‌فاصله حذف می‌شد) تا _init_fulltext_index با نرمال‌سازی جدید دوباره بسازد"""
+        for trigger in ('saved_content_fts_insert', 'saved_content_fts_update', 'saved_content_fts_delete',
+                        'search_history_fts_insert', 'search_history_fts_delete'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        for table in ('saved_content_fts', 'search_history_fts'):
+            cursor.execute(f'DROP TABLE IF EXISTS {table}')
+    
+    def hot_queries(self) -> List[Tuple[str, str]]:
+        """کوئری‌های پرتکرار برای بررسی plan، ساخته‌شده از همان ثابت‌هایی که متدها اجرا می‌کنند"""
+        keyset = self._keyset_sql
+        return [
+            ('get_user', self.GET_USER_SQL),
+            ('get_user_settings', self.USER_SETTINGS_SQL),
+            ('get_user_statistics', self.USER_STATS_SQL),
+            ('saved_content_page', keyset(self.SAVED_CONTENT_PAGE_SQL, 'user_id = ?', 'created_at', True, True)),
+            ('toggle_favorite', self.TOGGLE_FAVORITE_SQL),
+            ('reminders_page', keyset(self.REMINDERS_PAGE_SQL, 'user_id = ? AND is_active = 1', 'scheduled_time', True, False)),
+            ('all_reminders_page', keyset(self.REMINDERS_PAGE_SQL, 'user_id = ?', 'scheduled_time', True, False)),
+            ('search_history_page', keyset(self.SEARCH_HISTORY_PAGE_SQL, 'user_id = ?', 'created_at', True, True)),
+            ('unread_notifications_page',
+             keyset(self.NOTIFICATIONS_PAGE_SQL, 'user_id = ? AND is_read = 0', 'created_at', True, True)),
+            ('all_notifications_page', keyset(self.NOTIFICATIONS_PAGE_SQL, 'user_id = ?', 'created_at', True, True)),
+            ('get_shared_content', self.SHARE_LOOKUP_SQL),
+            ('shared_content_body', self.SHARED_CONTENT_SQL),
+            ('get_custom_categories', self.CUSTOM_CATEGORIES_SQL),
+            ('user_counters', self.USER_COUNTERS_SQL),
+            ('user_category_counters', self.USER_CATEGORY_COUNTERS_SQL),
+            ('user_daily_stats', AnalyticsManager.USER_DAILY_STATS_SQL),
+            ('requests_today', AnalyticsManager.REQUESTS_TODAY_SQL),
+            ('rollup_requests', AnalyticsManager.ROLLUP_REQUESTS_SQL),
+            ('global_analytics', AnalyticsManager.GLOBAL_PAST_SQL),
+            ('new_users_today', AnalyticsManager.NEW_USERS_TODAY_SQL),
+            ('new_users_since', AnalyticsManager.NEW_USERS_SINCE_SQL),
+            ('research_cache', ResearchCache.LOOKUP_SQL),
+        ]
+    
+    def check_query_plans(self) -> List[Tuple[str, str]]:
+        """بررسی EXPLAIN QUERY PLAN کوئری‌های پرتکرار؛ لیست کوئری‌هایی که full scan دارند"""
+        offenders = []
+        # اتصال جدا: plan دستورهای EXPLAIN کش‌شده بعد از تغییر ایندکس‌ها به‌روز نمی‌شود
+        pool = ConnectionPool(self.pool.db_path, read_only=True)
+        try:
+            with pool.connection() as conn:
+                for name, sql in self.hot_queries():
+                    # مقدار پارامترها روی plan اثری ندارد؛ فقط تعدادشان باید درست باشد
+                    params = (None,) * sql.count('?')
+                    for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall():
+                        detail = row[-1]
+                        # SCAN یعنی خواندن کل جدول یا کل ایندکس (جز جداول مجازی FTS)
+                        if detail.startswith('SCAN') and 'VIRTUAL TABLE' not in detail:
+                            offenders.append((name, detail))
+        finally:
+            pool.close_all()
+        return offenders
+    
+    def _init_fulltext_index(self, conn: sqlite3.Connection) -> bool:
+        """ایجاد ایندکس تمام‌متن FTS5 روی محتوا و تاریخچه جستجو"""
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT name FROM sqlite_master WHERE name IN ('saved_content_fts', 'search_history_fts')")
+            existing = {row[0] for row in cursor.fetchall()}
+            
+            # ستون owner شامل 'u<user_id>' است تا فیلتر کاربر داخل خود ایندکس انجام شود
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS saved_content_fts USING fts5(
+                    owner, topic, content,
+                    tokenize = 'unicode61 remove_diacritics 2'
+                )
+            ''')
             cursor.execute('''
-                INSERT INTO requests (user_id, topic, category)
-                VALUES (?, ?, ?)
-            ''', (user_id, topic, category))
+                CREATE VIRTUAL TABLE IF NOT EXISTS search_history_fts USING fts5(
+                    owner, query,
+                    tokenize = 'unicode61 remove_diacritics 2'
+                )
+            ''')
+            
+            # همگام‌سازی با triggerها
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS saved_content_fts_insert AFTER INSERT ON saved_content BEGIN
+                    INSERT INTO saved_content_fts (rowid, owner, topic, content)
+                    VALUES (new.id, 'u' || new.user_id, fa_normalize(new.topic), fa_normalize(%s));
+                END
+            ''' % content_body_sql('new'))
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS saved_content_fts_update AFTER UPDATE OF topic, content, content_hash ON saved_content BEGIN
+                    UPDATE saved_content_fts
+                    SET topic = fa_normalize(new.topic), content = fa_normalize(%s)
+                    WHERE rowid = new.id;
+                END
+            ''' % content_body_sql('new'))
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS saved_content_fts_delete AFTER DELETE ON saved_content BEGIN
+                    DELETE FROM saved_content_fts WHERE rowid = old.id;
+                END
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS search_history_fts_insert AFTER INSERT ON search_history BEGIN
+                    INSERT INTO search_history_fts (rowid, owner, query)
+                    VALUES (new.id, 'u' || new.user_id, fa_normalize(new.query));
+                END
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS search_history_fts_delete AFTER DELETE ON search_history BEGIN
+                    DELETE FROM search_history_fts WHERE rowid = old.id;
+                END
+            ''')
+            
+            # ایندکس کردن داده‌های موجود هنگام اولین ایجاد
+            if 'saved_content_fts' not in existing:
+                cursor.execute('''
+                    INSERT INTO saved_content_fts (rowid, owner, topic, content)
+                    SELECT id, 'u' || user_id, fa_normalize(topic), fa_normalize(%s) FROM saved_content
+                ''' % content_body_sql())
+            if 'search_history_fts' not in existing:
+                cursor.execute('''
+                    INSERT INTO search_history_fts (rowid, owner, query)
+                    SELECT id, 'u' || user_id, fa_normalize(query) FROM search_history
+                ''')
+            
             conn.commit()
-            conn.close()
-            logger.info(f"Request logged for user {user_id}: {topic} ({category})")
+            return True
+        except sqlite3.OperationalError as e:
+            conn.rollback()
+            logger.warning(f"Full-text search unavailable (FTS5): {e}")
+            return False
+    
+    @staticmethod
+    def _build_fts_query(user_id: int, text: str) -> Optional[str]:
+        """ساخت عبارت MATCH امن از ورودی کاربر (جستجوی پیشوندی روی همه کلمات)"""
+        terms = re.findall(r'\w+', normalize_persian_text(text))
+        if not terms:
+            return None
+        return f'owner:"u{user_id}" AND ' + ' '.join(f'"{term}"*' for term in terms)
+    
+    @staticmethod
+    def _keyset_sql(select_sql: str, where: str, sort_column: str, with_cursor: bool, scan_descending: bool) -> str:
+        """ساخت کوئری صفحه keyset (مشترک بین _keyset_page و hot_queries)"""
+        order = 'DESC' if scan_descending else 'ASC'
+        if with_cursor:
+            where += f" AND ({sort_column}, id) {'<' if scan_descending else '>'} (?, ?)"
+        return f"{select_sql} WHERE {where} ORDER BY {sort_column} {order}, id {order} LIMIT ?"
+    
+    def _keyset_page(self, select_sql: str, where: str, params: tuple, sort_column: str,
+                     cursor: Optional[Tuple[str, int]], backward: bool, page_size: int,
+                     descending: bool, row_mapper, pool: Optional[ConnectionPool] = None) -> Dict[str, Any]:
+        """صفحه‌بندی keyset روی (sort_column, id) بدون OFFSET
+        
+        cursor کلید آخرین/اولین ردیف صفحه قبلی است؛ backward یعنی حرکت به سمت ابتدای لیست.
+        """
+        # جهت پیمایش در دیتابیس: رو به جلو همان ترتیب نمایش، رو به عقب ترتیب معکوس
+        scan_descending = descending != backward
+        query_params = list(params)
+        if cursor is not None:
+            query_params.extend(cursor)
+        query_params.append(page_size + 1)
+        
+        with (pool or self.pool).connection() as conn:
+            rows = conn.execute(
+                self._keyset_sql(select_sql, where, sort_column, cursor is not None, scan_descending),
+                query_params
+            ).fetchall()
+        
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if backward:
+            rows.reverse()
+        
+        items = [row_mapper(row) for row in rows]
+        keys = [(item[sort_column], item['id']) for item in items]
+        
+        if backward:
+            has_next, has_prev = cursor is not None, has_more
+        else:
+            has_next, has_prev = has_more, cursor is not None
+        
+        return {
+            'items': items,
+            'next_cursor': keys[-1] if items and has_next else None,
+            'prev_cursor': keys[0] if items and has_prev else None
+        }
+    
+    def get_user(self, user_id: int) -> Optional[Dict]:
+        """دریافت اطلاعات کاربر (با کش)"""
+        cached = self.user_cache.get(user_id)
+        if cached is not None:
+            return dict(cached)
+        
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(self.GET_USER_SQL, (user_id,))
+                user = cursor.fetchone()
+            
+            if user:
+                result = {
+                    'user_id': user[0],
+                    'username': user[1],
+                    'first_name': user[2],
+                    'last_name': user[3],
+                    'join_date': user[4],
+                    'daily_requests': user[5],
+                    'last_request_date': user[6],
+                    'preferred_category': user[7],
+                    'language': user[8],
+                    'role': user[9] or 'user',
+                    'is_premium': bool(user[10])
+                }
+                self.user_cache.set(user_id, result)
+                return dict(result)
+            return None
+        except Exception as e:
+            logger.error(f"Error getting user {user_id}: {e}")
+            return None
+    
+    def create_user(self, user_id: int, username: str, first_name: str, last_name: str):
+        """ایجاد کاربر جدید"""
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                # UPSERT به جای REPLACE تا شمارنده‌ها و سهمیه کاربر ریست نشوند
+                cursor.execute('''
+                    INSERT INTO users (user_id, username, first_name, last_name)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        username = excluded.username,
+                        first_name = excluded.first_name,
+                        last_name = excluded.last_name,
+                        last_activity = datetime('now')
+                ''', (user_id, username, first_name, last_name))
+                conn.commit()
+            self.user_cache.invalidate(user_id)
+            logger.info(f"User {user_id} created/updated successfully")
+        except Exception as e:
+            logger.error(f"Error creating user {user_id}: {e}")
+            raise
+    
+    def reserve_request(self, user_id: int) -> Optional[QuotaReservation]:
+        """رزرو یک واحد از سهمیه روزانه (None در صورت اتمام سهمیه)"""
+        try:
+            reservation = self.quota.reserve(user_id)
+            self.user_cache.invalidate(user_id)  # daily_requests تغییر کرده است
+            return reservation
+        except Exception as e:
+            logger.error(f"Error reserving quota for user {user_id}: {e}")
+            # در صورت خطا، اجازه درخواست بده (رزرو بدون شمارش)
+            return QuotaReservation(user_id, datetime.now().strftime('%Y-%m-%d'), 0)
+    
+    def commit_request(self, reservation: QuotaReservation):
+        """قطعی کردن رزرو پس از تولید موفق"""
+        self.quota.commit(reservation)
+    
+    def refund_request(self, reservation: QuotaReservation):
+        """بازگرداندن رزرو پس از تولید ناموفق"""
+        try:
+            self.quota.refund(reservation)
+            self.user_cache.invalidate(reservation.user_id)
+        except Exception as e:
+            logger.error(f"Error refunding quota for user {reservation.user_id}: {e}")
+    
+    def can_make_request(self, user_id: int) -> bool:
+        """بررسی امکان درخواست (بدون مصرف سهمیه)"""
+        try:
+            return self.quota.remaining(user_id) > 0
+        except Exception as e:
+            logger.error(f"Error checking request limit for user {user_id}: {e}")
+            return True  # در صورت خطا، اجازه درخواست بده
+    
+    def log_request(self, user_id: int, topic: str, category: str, status: str = 'completed',
+                    processing_time: Optional[float] = None, error_message: Optional[str] = None,
+                    content_length: Optional[int] = None):
+        """ثبت درخواست پس از پایان پردازش (از طریق صف نوشتن تأخیری)"""
+        try:
+            self.shard_for_user(user_id).write_queue.enqueue('''
+                INSERT INTO requests (user_id, topic, category, status, processing_time,
+                                      error_message, content_length)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (user_id, topic, category, status, processing_time, error_message, content_length))
+            logger.info(f"Request logged for user {user_id}: {topic} ({category}) - {status}")
         except Exception as e:
             logger.error(f"Error logging request for user {user_id}: {e}")
             # در صورت خطا، ادامه کار بدون ثبت
     
     def save_content(self, user_id: int, topic: str, category: str, content: str):
-        """ذخیره محتوا"""
+        """ذخیره محتوا (از طریق صف نوشتن تأخیری)"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO saved_content (user_id, topic, category, content)
+            # درج blob (ON CONFLICT DO NOTHING) همیشه همراه ردیف و در همان تراکنش نوشته می‌شود؛
+            # بررسی وجود blob پیش از flush کافی نیست چون GC ممکن است تا آن موقع حذفش کند
+            shard = self.shard_for_user(user_id)
+            blob = shard.blobs.encode(content)
+            shard.write_queue.enqueue_many([
+                (ContentBlobStore.INSERT_BLOB_SQL, blob),
+                ('''
+                INSERT INTO saved_content (user_id, topic, category, content_hash)
                 VALUES (?, ?, ?, ?)
-            ''', (user_id, topic, category, content))
-            conn.commit()
-            conn.close()
+                ''', (user_id, topic, category, blob[0])),
+            ])
             logger.info(f"Content saved for user {user_id}")
         except Exception as e:
             logger.error(f"Error saving content for user {user_id}: {e}")
     
     def get_saved_content(self, user_id: int, limit: int = 10) -> List[Dict]:
         """دریافت محتوای ذخیره شده"""
+        return self.get_saved_content_page(user_id, page_size=limit)['items']
+    
+    def get_saved_content_page(self, user_id: int, cursor: Optional[Tuple[str, int]] = None,
+                               backward: bool = False, page_size: int = PAGE_SIZE) -> Dict[str, Any]:
+        """دریافت یک صفحه از محتوای ذخیره شده (صفحه‌بندی keyset روی created_at, id)"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT id, topic, category, content, created_at, is_favorite
-                FROM saved_content 
-                WHERE user_id = ?
-                ORDER BY created_at DESC
-                LIMIT ?
-            ''', (user_id, limit))
-            results = cursor.fetchall()
-            conn.close()
-            
-            return [
-                {
+            shard = self.shard_for_user(user_id)
+            shard.write_queue.flush()  # دیدن نوشته‌های در صف
+            return self._keyset_page(
+                self.SAVED_CONTENT_PAGE_SQL,
+                'user_id = ?', (user_id,), 'created_at',
+                cursor, backward, page_size, descending=True,
+                row_mapper=lambda row: {
                     'id': row[0],
                     'topic': row[1],
                     'category': row[2],
                     'content': row[3],
                     'created_at': row[4],
                     'is_favorite': bool(row[5])
-                }
-                for row in results
-            ]
+                },
+                pool=shard.pool
+            )
         except Exception as e:
             logger.error(f"Error getting saved content for user {user_id}: {e}")
-            return []
+            return {'items': [], 'next_cursor': None, 'prev_cursor': None}
     
     def toggle_favorite(self, content_id: int, user_id: int) -> bool:
         """تغییر وضعیت مورد علاقه"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('''
-                UPDATE saved_content 
-                SET is_favorite = CASE WHEN is_favorite = 1 THEN 0 ELSE 1 END
-                WHERE id = ? AND user_id = ?
-            ''', (content_id, user_id))
-            conn.commit()
-            conn.close()
+            with self.shard_for_user(user_id).pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(self.TOGGLE_FAVORITE_SQL, (content_id, user_id))
+                conn.commit()
             return True
         except Exception as e:
             logger.error(f"Error toggling favorite for content {content_id}: {e}")
             return False
     
     def save_feedback(self, user_id: int, topic: str, rating: int, comment: str = ""):
-        """ذخیره بازخورد"""
+        """ذخیره بازخورد (از طریق صف نوشتن تأخیری)"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('''
+            self.write_queue.enqueue('''
                 INSERT INTO feedback (user_id, topic, rating, comment)
                 VALUES (?, ?, ?, ?)
             ''', (user_id, topic, rating, comment))
-            conn.commit()
-            conn.close()
             logger.info(f"Feedback saved for user {user_id}")
         except Exception as e:
             logger.error(f"Error saving feedback for user {user_id}: {e}")
     
     def get_user_settings(self, user_id: int) -> Dict:
-        """دریافت تنظیمات کاربر"""
+        """دریافت تنظیمات کاربر (با کش)"""
+        cached = self.settings_cache.get(user_id)
+        if cached is not None:
+            return dict(cached)
+        
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM user_settings WHERE user_id = ?', (user_id,))
-            result = cursor.fetchone()
-            conn.close()
-            
-            if result:
-                return {
-                    'user_id': result[0],
-                    'language': result[1],
-                    'content_length': result[2],
-                    'notification_enabled': bool(result[3]),
-                    'auto_save': bool(result[4]),
-                    'preferred_categories': result[5]
-                }
-            else:
-                # ایجاد تنظیمات پیش‌فرض
-                self.create_user_settings(user_id)
-                return self.get_user_settings(user_id)
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                result = cursor.execute(self.USER_SETTINGS_SQL, (user_id,)).fetchone()
+                
+                if not result:
+                    # ایجاد تنظیمات پیش‌فرض
+                    cursor.execute('INSERT OR IGNORE INTO user_settings (user_id) VALUES (?)', (user_id,))
+                    conn.commit()
+                    result = cursor.execute(self.USER_SETTINGS_SQL, (user_id,)).fetchone()
+            
+            settings = {
+                'user_id': result[0],
+                'language': result[1],
+                'content_length': result[2],
+                'content_type': result[3],
+                'notification_enabled': bool(result[4]),
+                'auto_save': bool(result[5]),
+                'preferred_categories': result[6],
+                'theme': result[7],
+                'privacy_level': result[8],
+                'auto_translate': bool(result[9]),
+                'target_language': result[10],
+                'content_format': result[11],
+                'ai_assistant_enabled': bool(result[12]),
+                'research_depth': result[13]
+            }
+            self.settings_cache.set(user_id, settings)
+            return dict(settings)
         except Exception as e:
             logger.error(f"Error getting user settings for {user_id}: {e}")
             return {}
@@ -1075,48 +2896,48 @@ class DatabaseManager:
     def create_user_settings(self, user_id: int):
         """ایجاد تنظیمات پیش‌فرض برای کاربر"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT OR IGNORE INTO user_settings (user_id)
-                VALUES (?)
-            ''', (user_id,))
-            conn.commit()
-            conn.close()
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT OR IGNORE INTO user_settings (user_id)
+                    VALUES (?)
+                ''', (user_id,))
+                conn.commit()
+            self.settings_cache.invalidate(user_id)
         except Exception as e:
             logger.error(f"Error creating user settings for {user_id}: {e}")
     
     def update_user_settings(self, user_id: int, settings: Dict):
         """به‌روزرسانی تنظیمات کاربر پیشرفته"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            updates = []
-            values = []
-            
-            # فیلدهای قابل به‌روزرسانی
-            updatable_fields = [
-                'language', 'content_length', 'content_type', 'notification_enabled', 
-                'auto_save', 'preferred_categories', 'theme', 'privacy_level',
-                'auto_translate', 'target_language', 'content_format', 
-                'ai_assistant_enabled', 'research_depth'
-            ]
-            
-            for field in updatable_fields:
-                if field in settings:
-                    updates.append(f'{field} = ?')
-                    values.append(settings[field])
-            
-            if updates:
-                updates.append('updated_at = ?')
-                values.append(datetime.now().isoformat())
-                values.append(user_id)
-                query = f"UPDATE user_settings SET {', '.join(updates)} WHERE user_id = ?"
-                cursor.execute(query, values)
-                conn.commit()
-            
-            conn.close()
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                updates = []
+                values = []
+                
+                # فیلدهای قابل به‌روزرسانی
+                updatable_fields = [
+                    'language', 'content_length', 'content_type', 'notification_enabled', 
+                    'auto_save', 'preferred_categories', 'theme', 'privacy_level',
+                    'auto_translate', 'target_language', 'content_format', 
+                    'ai_assistant_enabled', 'research_depth'
+                ]
+                
+                for field in updatable_fields:
+                    if field in settings:
+                        updates.append(f'{field} = ?')
+                        values.append(settings[field])
+                
+                if updates:
+                    updates.append('updated_at = ?')
+                    values.append(datetime.now().isoformat())
+                    values.append(user_id)
+                    query = f"UPDATE user_settings SET {', '.join(updates)} WHERE user_id = ?"
+                    cursor.execute(query, values)
+                    conn.commit()
+            
+            self.settings_cache.invalidate(user_id)
             logger.info(f"User settings updated for {user_id}")
         except Exception as e:
             logger.error(f"Error updating user settings for {user_id}: {e}")
@@ -1127,18 +2948,17 @@ class DatabaseManager:
                        repeat_interval: str = None) -> int:
         """ایجاد یادآوری جدید"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO reminders (user_id, title, topic, message, scheduled_time, 
-                                     reminder_type, repeat_interval)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (user_id, title, topic, message, scheduled_time, reminder_type, repeat_interval))
-            
-            reminder_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
+            with self.shard_for_user(user_id).pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    INSERT INTO reminders (user_id, title, topic, message, scheduled_time, 
+                                         reminder_type, repeat_interval)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (user_id, title, topic, message, scheduled_time, reminder_type, repeat_interval))
+                
+                reminder_id = cursor.lastrowid
+                conn.commit()
             
             logger.info(f"Reminder created for user {user_id}: {title}")
             return reminder_id
@@ -1146,30 +2966,25 @@ class DatabaseManager:
             logger.error(f"Error creating reminder for user {user_id}: {e}")
             raise DatabaseError(f"خطا در ایجاد یادآوری: {str(e)}")
     
-    def get_user_reminders(self, user_id: int, active_only: bool = True) -> List[Dict]:
+    def get_user_reminders(self, user_id: int, active_only: bool = True, limit: int = 50) -> List[Dict]:
         """دریافت یادآوری‌های کاربر"""
+        return self.get_user_reminders_page(user_id, active_only, page_size=limit)['items']
+    
+    def get_user_reminders_page(self, user_id: int, active_only: bool = True,
+                                cursor: Optional[Tuple[str, int]] = None, backward: bool = False,
+                                page_size: int = PAGE_SIZE) -> Dict[str, Any]:
+        """دریافت یک صفحه از یادآوری‌ها (صفحه‌بندی keyset روی scheduled_time, id)"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            query = '''
-                SELECT id, title, topic, message, scheduled_time, reminder_type, 
-                       repeat_interval, is_sent, sent_count, last_sent, is_active
-                FROM reminders 
-                WHERE user_id = ?
-            '''
-            
+            shard = self.shard_for_user(user_id)
+            where = 'user_id = ?'
             if active_only:
-                query += ' AND is_active = 1'
-            
-            query += ' ORDER BY scheduled_time ASC'
+                where += ' AND is_active = 1'
             
-            cursor.execute(query, (user_id,))
-            results = cursor.fetchall()
-            conn.close()
-            
-            return [
-                {
+            return self._keyset_page(
+                self.REMINDERS_PAGE_SQL,
+                where, (user_id,), 'scheduled_time',
+                cursor, backward, page_size, descending=False,
+                row_mapper=lambda row: {
                     'id': row[0],
                     'title': row[1],
                     'topic': row[2],
@@ -1181,66 +2996,151 @@ class DatabaseManager:
                     'sent_count': row[8],
                     'last_sent': row[9],
                     'is_active': bool(row[10])
-                }
-                for row in results
-            ]
+                },
+                pool=shard.pool
+            )
         except Exception as e:
             logger.error(f"Error getting reminders for user {user_id}: {e}")
-            return []
+            return {'items': [], 'next_cursor': None, 'prev_cursor': None}
     
     def update_reminder_status(self, reminder_id: int, is_sent: bool = True):
         """به‌روزرسانی وضعیت یادآوری"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                UPDATE reminders 
-                SET is_sent = ?, sent_count = sent_count + 1, last_sent = ?
-                WHERE id = ?
-            ''', (is_sent, datetime.now().isoformat(), reminder_id))
-            
-            conn.commit()
-            conn.close()
+            with self.shard_for_id(reminder_id).pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    UPDATE reminders 
+                    SET is_sent = ?, sent_count = sent_count + 1, last_sent = ?
+                    WHERE id = ?
+                ''', (is_sent, datetime.now().isoformat(), reminder_id))
+                
+                conn.commit()
             logger.info(f"Reminder {reminder_id} status updated")
         except Exception as e:
             logger.error(f"Error updating reminder status: {e}")
     
     def save_search_history(self, user_id: int, query: str, category: str, 
                            results_count: int, processing_time: float, is_successful: bool = True):
-        """ذخیره تاریخچه جستجو"""
+        """ذخیره تاریخچه جستجو (از طریق صف نوشتن تأخیری)"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
+            self.shard_for_user(user_id).write_queue.enqueue('''
                 INSERT INTO search_history (user_id, query, category, results_count, 
                                           processing_time, is_successful)
                 VALUES (?, ?, ?, ?, ?, ?)
             ''', (user_id, query, category, results_count, processing_time, is_successful))
-            
-            conn.commit()
-            conn.close()
             logger.debug(f"Search history saved for user {user_id}")
         except Exception as e:
             logger.error(f"Error saving search history: {e}")
     
     def get_search_history(self, user_id: int, limit: int = 10) -> List[Dict]:
         """دریافت تاریخچه جستجو"""
+        return self.get_search_history_page(user_id, page_size=limit)['items']
+    
+    def get_search_history_page(self, user_id: int, cursor: Optional[Tuple[str, int]] = None,
+                                backward: bool = False, page_size: int = PAGE_SIZE) -> Dict[str, Any]:
+        """دریافت یک صفحه از تاریخچه جستجو (صفحه‌بندی keyset روی created_at, id)"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            shard = self.shard_for_user(user_id)
+            shard.write_queue.flush()  # دیدن نوشته‌های در صف
+            return self._keyset_page(
+                self.SEARCH_HISTORY_PAGE_SQL,
+                'user_id = ?', (user_id,), 'created_at',
+                cursor, backward, page_size, descending=True,
+                row_mapper=lambda row: {
+                    'id': row[0],
+                    'query': row[1],
+                    'category': row[2],
+                    'results_count': row[3],
+                    'created_at': row[4],
+                    'is_successful': bool(row[5])
+                },
+                pool=shard.pool
+            )
+        except Exception as e:
+            logger.error(f"Error getting search history for user {user_id}: {e}")
+            return {'items': [], 'next_cursor': None, 'prev_cursor': None}
+    
+    def search_saved_content(self, user_id: int, query: str, limit: int = 10) -> List[Dict]:
+        """جستجوی تمام‌متن رتبه‌بندی شده در محتوای ذخیره شده کاربر"""
+        try:
+            shard = self.shard_for_user(user_id)
+            shard.write_queue.flush()  # دیدن نوشته‌های در صف
+            match = self._build_fts_query(user_id, query)
+            if not match:
+                return []
             
-            cursor.execute('''
-                SELECT query, category, results_count, created_at, is_successful
-                FROM search_history 
-                WHERE user_id = ?
-                ORDER BY created_at DESC
-                LIMIT ?
-            ''', (user_id, limit))
+            with shard.pool.connection() as conn:
+                cursor = conn.cursor()
+                if self.fts_enabled:
+                    cursor.execute('''
+                        SELECT s.id, s.topic, s.category, s.created_at, s.is_favorite,
+                               snippet(saved_content_fts, 2, '«', '»', '…', 12)
+                        FROM saved_content_fts
+                        JOIN saved_content s ON s.id = saved_content_fts.rowid
+                        WHERE saved_content_fts MATCH ?
+                        ORDER BY bm25(saved_content_fts, 0.0, 5.0, 1.0)
+                        LIMIT ?
+                    ''', (match, limit))
+                else:
+                    pattern = f"%{query.strip()}%"
+                    cursor.execute(f'''
+                        SELECT id, topic, category, created_at, is_favorite, substr(body, 1, 120)
+                        FROM (
+                            SELECT sc.*, {content_body_sql('sc')} AS body
+                            FROM saved_content sc WHERE sc.user_id = ?
+                        )
+                        WHERE topic LIKE ? OR body LIKE ?
+                        ORDER BY created_at DESC
+                        LIMIT ?
+                    ''', (user_id, pattern, pattern, limit))
+                results = cursor.fetchall()
             
-            results = cursor.fetchall()
-            conn.close()
+            return [
+                {
+                    'id': row[0],
+                    'topic': row[1],
+                    'category': row[2],
+                    'created_at': row[3],
+                    'is_favorite': bool(row[4]),
+                    'snippet': row[5]
+                }
+                for row in results
+            ]
+        except Exception as e:
+            logger.error(f"Error searching saved content for user {user_id}: {e}")
+            return []
+    
+    def search_search_history(self, user_id: int, query: str, limit: int = 10) -> List[Dict]:
+        """جستجوی تمام‌متن رتبه‌بندی شده در تاریخچه جستجوی کاربر"""
+        try:
+            shard = self.shard_for_user(user_id)
+            shard.write_queue.flush()  # دیدن نوشته‌های در صف
+            match = self._build_fts_query(user_id, query)
+            if not match:
+                return []
+            
+            with shard.pool.connection() as conn:
+                cursor = conn.cursor()
+                if self.fts_enabled:
+                    cursor.execute('''
+                        SELECT h.query, h.category, h.results_count, h.created_at, h.is_successful,
+                               highlight(search_history_fts, 1, '«', '»')
+                        FROM search_history_fts
+                        JOIN search_history h ON h.id = search_history_fts.rowid
+                        WHERE search_history_fts MATCH ?
+                        ORDER BY bm25(search_history_fts, 0.0, 1.0)
+                        LIMIT ?
+                    ''', (match, limit))
+                else:
+                    cursor.execute('''
+                        SELECT query, category, results_count, created_at, is_successful, query
+                        FROM search_history
+                        WHERE user_id = ? AND query LIKE ?
+                        ORDER BY created_at DESC
+                        LIMIT ?
+                    ''', (user_id, f"%{query.strip()}%", limit))
+                results = cursor.fetchall()
             
             return [
                 {
@@ -1248,31 +3148,31 @@ class DatabaseManager:
                     'category': row[1],
                     'results_count': row[2],
                     'created_at': row[3],
-                    'is_successful': bool(row[4])
+                    'is_successful': bool(row[4]),
+                    'snippet': row[5]
                 }
                 for row in results
             ]
         except Exception as e:
-            logger.error(f"Error getting search history for user {user_id}: {e}")
+            logger.error(f"Error searching search history for user {user_id}: {e}")
             return []
     
     def create_content_share(self, content_id: int, user_id: int, share_type: str = 'public', 
                            expires_at: str = None) -> str:
         """ایجاد اشتراک‌گذاری محتوا"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # ایجاد URL منحصر به فرد
-            share_url = self._generate_share_url(content_id, user_id)
-            
-            cursor.execute('''
-                INSERT INTO content_shares (content_id, user_id, share_type, share_url, expires_at)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (content_id, user_id, share_type, share_url, expires_at))
-            
-            conn.commit()
-            conn.close()
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                # ایجاد URL منحصر به فرد
+                share_url = self._generate_share_url(content_id, user_id)
+                
+                cursor.execute('''
+                    INSERT INTO content_shares (content_id, user_id, share_type, share_url, expires_at)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (content_id, user_id, share_type, share_url, expires_at))
+                
+                conn.commit()
             
             logger.info(f"Content share created: {share_url}")
             return share_url
@@ -1295,20 +3195,18 @@ class DatabaseManager:
     def get_shared_content(self, share_url: str) -> Optional[Dict]:
         """دریافت محتوای اشتراک‌گذاری شده"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT cs.id, cs.content_id, cs.user_id, cs.share_type, cs.expires_at,
-                       sc.topic, sc.category, sc.content, sc.content_type, sc.language
-                FROM content_shares cs
-                JOIN saved_content sc ON cs.content_id = sc.id
-                WHERE cs.share_url = ? AND cs.is_active = 1
-            ''', (share_url,))
-            
-            result = cursor.fetchone()
-            conn.close()
-            
+            with self.pool.connection() as conn:
+                share = conn.execute(self.SHARE_LOOKUP_SQL, (share_url,)).fetchone()
+            if not share:
+                return None
+            
+            # محتوا در shard کاربر صاحب آن است
+            shard = self.shard_for_user(share[2])
+            shard.write_queue.flush()  # دیدن نوشته‌های در صف
+            with shard.pool.connection() as conn:
+                content = conn.execute(self.SHARED_CONTENT_SQL, (share[1],)).fetchone()
+            
+            result = share + content if content else None
             if result:
                 return {
                     'share_id': result[0],
@@ -1331,17 +3229,16 @@ class DatabaseManager:
                              color: str = "#007bff", icon: str = "📁") -> int:
         """ایجاد دسته‌بندی سفارشی"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO custom_categories (user_id, name, description, color, icon)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (user_id, name, description, color, icon))
-            
-            category_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    INSERT INTO custom_categories (user_id, name, description, color, icon)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (user_id, name, description, color, icon))
+                
+                category_id = cursor.lastrowid
+                conn.commit()
             
             logger.info(f"Custom category created for user {user_id}: {name}")
             return category_id
@@ -1352,18 +3249,12 @@ class DatabaseManager:
     def get_custom_categories(self, user_id: int) -> List[Dict]:
         """دریافت دسته‌بندی‌های سفارشی کاربر"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT id, name, description, color, icon, is_default, created_at
-                FROM custom_categories 
-                WHERE user_id = ?
-                ORDER BY created_at ASC
-            ''', (user_id,))
-            
-            results = cursor.fetchall()
-            conn.close()
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute(self.CUSTOM_CATEGORIES_SQL, (user_id,))
+                
+                results = cursor.fetchall()
             
             return [
                 {
@@ -1386,18 +3277,17 @@ class DatabaseManager:
                                  expires_at: str = None) -> int:
         """ایجاد اعلان سیستم"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO system_notifications (user_id, title, message, notification_type, 
-                                                action_url, expires_at)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (user_id, title, message, notification_type, action_url, expires_at))
-            
-            notification_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
+            with self.shard_for_user(user_id).pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    INSERT INTO system_notifications (user_id, title, message, notification_type, 
+                                                    action_url, expires_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (user_id, title, message, notification_type, action_url, expires_at))
+                
+                notification_id = cursor.lastrowid
+                conn.commit()
             
             logger.info(f"System notification created for user {user_id}: {title}")
             return notification_id
@@ -1405,30 +3295,25 @@ class DatabaseManager:
             logger.error(f"Error creating system notification: {e}")
             raise DatabaseError(f"خطا در ایجاد اعلان: {str(e)}")
     
-    def get_user_notifications(self, user_id: int, unread_only: bool = True) -> List[Dict]:
+    def get_user_notifications(self, user_id: int, unread_only: bool = True, limit: int = 50) -> List[Dict]:
         """دریافت اعلان‌های کاربر"""
+        return self.get_user_notifications_page(user_id, unread_only, page_size=limit)['items']
+    
+    def get_user_notifications_page(self, user_id: int, unread_only: bool = True,
+                                    cursor: Optional[Tuple[str, int]] = None, backward: bool = False,
+                                    page_size: int = PAGE_SIZE) -> Dict[str, Any]:
+        """دریافت یک صفحه از اعلان‌ها (صفحه‌بندی keyset روی created_at, id)"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            query = '''
-                SELECT id, title, message, notification_type, is_read, created_at, 
-                       action_url, expires_at
-                FROM system_notifications 
-                WHERE user_id = ?
-            '''
-            
+            shard = self.shard_for_user(user_id)
+            where = 'user_id = ?'
             if unread_only:
-                query += ' AND is_read = 0'
-            
-            query += ' ORDER BY created_at DESC'
+                where += ' AND is_read = 0'
             
-            cursor.execute(query, (user_id,))
-            results = cursor.fetchall()
-            conn.close()
-            
-            return [
-                {
+            return self._keyset_page(
+                self.NOTIFICATIONS_PAGE_SQL,
+                where, (user_id,), 'created_at',
+                cursor, backward, page_size, descending=True,
+                row_mapper=lambda row: {
                     'id': row[0],
                     'title': row[1],
                     'message': row[2],
@@ -1437,106 +3322,726 @@ class DatabaseManager:
                     'created_at': row[5],
                     'action_url': row[6],
                     'expires_at': row[7]
+                },
+                pool=shard.pool
+            )
+        except Exception as e:
+            logger.error(f"Error getting notifications for user {user_id}: {e}")
+            return {'items': [], 'next_cursor': None, 'prev_cursor': None}
+    
+    def mark_notification_read(self, notification_id: int):
+        """علامت‌گذاری اعلان به عنوان خوانده شده"""
+        try:
+            with self.shard_for_id(notification_id).pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    UPDATE system_notifications 
+                    SET is_read = 1
+                    WHERE id = ?
+                ''', (notification_id,))
+                
+                conn.commit()
+            logger.debug(f"Notification {notification_id} marked as read")
+        except Exception as e:
+            logger.error(f"Error marking notification as read: {e}")
+    
+    def get_user_counters(self, user_id: int, top_categories: int = 5) -> Dict[str, Any]:
+        """دریافت شمارنده‌های تجمعی کاربر (یک ردیف) و پرتکرارترین دسته‌بندی‌ها"""
+        try:
+            shard = self.shard_for_user(user_id)
+            shard.write_queue.flush()  # دیدن نوشته‌های در صف
+            with shard.read_pool.connection() as conn:
+                row = conn.execute(self.USER_COUNTERS_SQL, (user_id,)).fetchone()
+                categories = conn.execute(self.USER_CATEGORY_COUNTERS_SQL, (user_id, top_categories)).fetchall()
+            
+            row = row or (0, 0, 0, 0, 0, None, 0, 0, 0)
+            return {
+                'total_requests': row[0],
+                'successful_requests': row[1],
+                'failed_requests': row[2],
+                'avg_processing_time': row[4] / row[3] if row[3] else 0,
+                'last_request_at': row[5],
+                'content_saved': row[6],
+                'favorites': row[7],
+                'public_content': row[8],
+                'popular_categories': categories
+            }
+        except Exception as e:
+            logger.error(f"Error getting counters for user {user_id}: {e}")
+            return {}
+    
+    def get_user_statistics(self, user_id: int) -> Dict[str, Any]:
+        """دریافت آمار جامع کاربر از شمارنده‌های تجمعی"""
+        try:
+            with self.read_pool.connection() as conn:
+                user_stats = conn.execute(self.USER_STATS_SQL, (user_id,)).fetchone()
+            counters = self.get_user_counters(user_id)
+            if not counters:
+                return {}
+            
+            return {
+                'user_info': {
+                    'total_requests': counters['total_requests'],
+                    'total_content_saved': counters['content_saved'],
+                    'daily_requests': user_stats[0] if user_stats else 0,
+                    'join_date': user_stats[1] if user_stats else None,
+                    'last_activity': (user_stats[2] if user_stats else None) or counters['last_request_at'],
+                    'is_premium': bool(user_stats[3]) if user_stats else False
+                },
+                'request_stats': {
+                    'total': counters['total_requests'],
+                    'successful': counters['successful_requests'],
+                    'failed': counters['failed_requests'],
+                    'avg_processing_time': counters['avg_processing_time']
+                },
+                'popular_categories': counters['popular_categories'],
+                'content_stats': {
+                    'total': counters['content_saved'],
+                    'favorites': counters['favorites'],
+                    'public': counters['public_content']
                 }
-                for row in results
-            ]
+            }
+        except Exception as e:
+            logger.error(f"Error getting user statistics: {e}")
+            return {}
+
+class AsyncDatabaseManager:
+    """کلاس دسترسی غیرهمزمان به دیتابیس از طریق threadهای اختصاصی"""
+    
+    def __init__(self, db_manager: DatabaseManager, workers: int = DB_EXECUTOR_WORKERS):
+        self.db = db_manager
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='db')
+        # گزارش‌های آماری صف جدا دارند تا /stats همه threadهای دیتابیس را اشغال نکند
+        self.analytics_executor = ThreadPoolExecutor(max_workers=DB_ANALYTICS_WORKERS,
+                                                     thread_name_prefix='db-analytics')
+    
+    async def run(self, func, *args, **kwargs):
+        """اجرای تابع همزمان دیتابیس بدون مسدود کردن event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+    
+    async def run_analytics(self, func, *args, **kwargs):
+        """اجرای کوئری آماری روی thread جدای گزارش‌ها"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.analytics_executor, functools.partial(func, *args, **kwargs))
+    
+    async def get_user(self, user_id: int) -> Optional[Dict]:
+        """دریافت کاربر؛ در صورت وجود در کش بدون رفتن به thread دیتابیس"""
+        cached = self.db.user_cache.get(user_id)
+        if cached is not None:
+            return dict(cached)
+        return await self.run(self.db.get_user, user_id)
+    
+    async def get_user_settings(self, user_id: int) -> Dict:
+        """دریافت تنظیمات کاربر؛ در صورت وجود در کش بدون رفتن به thread دیتابیس"""
+        cached = self.db.settings_cache.get(user_id)
+        if cached is not None:
+            return dict(cached)
+        return await self.run(self.db.get_user_settings, user_id)
+    
+    def __getattr__(self, name):
+        """نسخه awaitable متدهای DatabaseManager"""
+        attr = getattr(self.db, name)
+        if not callable(attr):
+            return attr
+        
+        async def wrapper(*args, **kwargs):
+            return await self.run(attr, *args, **kwargs)
+        
+        return wrapper
+    
+    def shutdown(self):
+        """توقف threadهای دیتابیس پس از اتمام کارهای در صف"""
+        self.analytics_executor.shutdown(wait=True)
+        self.executor.shutdown(wait=True)
+
+class ResearchCache:
+    """کش دو لایه نتایج تحقیق (حافظه LRU با TTL + جدول research_cache) با کلید موضوع نرمال‌شده"""
+    
+    UPSERT_SQL = '''
+        INSERT INTO research_cache (topic_key, topic, research_content, sources, expires_at)
+        VALUES (?, ?, ?, ?, datetime('now', ?))
+        ON CONFLICT(topic_key) DO UPDATE SET
+            topic = excluded.topic,
+            research_content = excluded.research_content,
+            sources = excluded.sources,
+            created_at = datetime('now'),
+            expires_at = excluded.expires_at
+    '''
+    
+    LOOKUP_SQL = '''
+        SELECT research_content, sources, (julianday(expires_at) - julianday('now')) * 86400
+        FROM research_cache WHERE topic_key = ? AND expires_at > datetime('now')
+    '''
+    
+    def __init__(self, db_manager, max_size: int = RESEARCH_CACHE_SIZE,
+                 ttl_seconds: float = RESEARCH_CACHE_TTL_HOURS * 3600):
+        self.db = db_manager
+        self.ttl_seconds = ttl_seconds
+        self.memory = TTLCache(max_size, ttl_seconds)
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0}
+    
+    @staticmethod
+    def key(topic: str, depth: str = 'basic') -> str:
+        """کلید کش: موضوع نرمال‌شده فارسی بدون علائم نگارشی (+ عمقی که صفحه کامل می‌خواند)"""
+        key = ' '.join(re.findall(r'\w+', normalize_persian_text(topic)))
+        # عمق‌هایی که صفحه کامل نمی‌خوانند نتیجه یکسان دارند و یک کلید مشترک
+        return f'{key}#{depth}' if key and RESEARCH_DEPTH_PAGES.get(depth, 0) > 0 else key
+    
+    def peek(self, topic: str, depth: str = 'basic') -> Optional[Tuple[str, list]]:
+        """جستجو فقط در حافظه (بدون دیتابیس؛ قابل اجرا روی event loop)"""
+        cached = self.memory.get(self.key(topic, depth))
+        if cached is not None:
+            self.stats['memory_hits'] += 1
+            return cached[0], list(cached[1])
+        return None
+    
+    def get(self, topic: str, depth: str = 'basic') -> Optional[Tuple[str, list]]:
+        """جستجو در حافظه و سپس جدول research_cache"""
+        cached = self.peek(topic, depth)
+        if cached is not None:
+            return cached
+        
+        key = self.key(topic, depth)
+        try:
+            with self.db.pool.connection() as conn:
+                row = conn.execute(self.LOOKUP_SQL, (key,)).fetchone()
+        except Exception as e:
+            logger.error(f"Error reading research cache: {e}")
+            row = None
+        
+        if row is None:
+            self.stats['misses'] += 1
+            return None
+        
+        self.stats['disk_hits'] += 1
+        value = (row[0], json.loads(row[1] or '[]'))
+        # اعتبار باقی‌مانده در دیسک برای لایه حافظه هم رعایت می‌شود
+        self.memory.set(key, value, row[2])
+        return value[0], list(value[1])
+    
+    def set(self, topic: str, research_content: str, sources: list, depth: str = 'basic'):
+        """ذخیره نتیجه تحقیق در هر دو لایه (نوشتن دیسک از طریق صف نوشتن تأخیری)"""
+        key = self.key(topic, depth)
+        if not key:
+            return
+        self.memory.set(key, (research_content, list(sources)))
+        self.db.write_queue.enqueue(self.UPSERT_SQL, (
+            key, topic, research_content, json.dumps(sources, ensure_ascii=False),
+            f'+{int(self.ttl_seconds)} seconds'
+        ))
+        self.stats['stores'] += 1
+    
+    def hit_rate(self) -> float:
+        """نسبت hit (حافظه یا دیسک) به کل جستجوها"""
+        hits = self.stats['memory_hits'] + self.stats['disk_hits']
+        total = hits + self.stats['misses']
+        return hits / total if total else 0.0
+
+class SingleFlight:
+    """ادغام درخواست‌های همزمان یکسان: فقط یک اجرای در جریان برای هر کلید، نتیجه بین همه منتظرها مشترک"""
+    
+    def __init__(self):
+        self._inflight: Dict[Any, asyncio.Task] = {}
+        self.stats = {'leaders': 0, 'shared': 0}
+    
+    def in_flight(self, key) -> bool:
+        """آیا برای این کلید اجرایی در جریان است"""
+        return key in self._inflight
+    
+    async def do(self, key, factory: Callable[[], Awaitable]) -> Tuple[Any, bool]:
+        """اجرای factory یا پیوستن به اجرای در جریان؛ خروجی: (نتیجه، مشترک بودن)"""
+        task = self._inflight.get(key)
+        shared = task is not None
+        if shared:
+            self.stats['shared'] += 1
+        else:
+            self.stats['leaders'] += 1
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._inflight.pop(k, None) if self._inflight.get(k) is t else None)
+        # shield: لغو شدن یک منتظر، اجرای مشترک بقیه را لغو نمی‌کند
+        return await asyncio.shield(task), shared
+    
+    def fan_in(self) -> float:
+        """میانگین تعداد درخواست به ازای هر اجرای واقعی"""
+        leaders = self.stats['leaders']
+        return (leaders + self.stats['shared']) / leaders if leaders else 1.0
+
+class HttpSessionManager:
+    """کلاس sessionهای HTTP ماندگار برنامه با pool اتصال جدا برای جستجو و Metis
+    
+    sessionها باید داخل event loop ساخته شوند؛ start در ابتدای run و close هنگام توقف صدا زده می‌شود.
+    """
+    
+    def __init__(self):
+        self.scrape_session: Optional[aiohttp.ClientSession] = None
+        self.api_session: Optional[aiohttp.ClientSession] = None
+    
+    @staticmethod
+    def _connector(limit: int, limit_per_host: int) -> aiohttp.TCPConnector:
+        """connector با محدودیت اتصال، کش DNS و keep-alive"""
+        return aiohttp.TCPConnector(
+            limit=limit,
+            limit_per_host=limit_per_host,
+            ttl_dns_cache=HTTP_DNS_CACHE_SECONDS,
+            keepalive_timeout=HTTP_KEEPALIVE_SECONDS,
+            enable_cleanup_closed=True
+        )
+    
+    async def start(self):
+        """ایجاد sessionها (یک بار برای کل عمر برنامه)"""
+        if self.scrape_session is None or self.scrape_session.closed:
+            # زمان‌بندی هر واکشی در fetch_page تعیین می‌شود
+            self.scrape_session = aiohttp.ClientSession(
+                connector=self._connector(HTTP_SCRAPE_LIMIT, HTTP_SCRAPE_LIMIT_PER_HOST)
+            )
+        if self.api_session is None or self.api_session.closed:
+            self.api_session = aiohttp.ClientSession(
+                connector=self._connector(HTTP_API_LIMIT, HTTP_API_LIMIT_PER_HOST),
+                timeout=aiohttp.ClientTimeout(total=HTTP_API_TIMEOUT_SECONDS)
+            )
+        logger.info("HTTP sessions started")
+    
+    async def close(self):
+        """بستن sessionها و اتصال‌های باز"""
+        for session in (self.scrape_session, self.api_session):
+            if session and not session.closed:
+                try:
+                    await session.close()
+                except Exception as e:
+                    logger.warning(f"Error closing HTTP session: {e}")
+        self.scrape_session = None
+        self.api_session = None
+
+META_CHARSET_PATTERN = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([a-zA-Z0-9_.:-]+)', re.I)
+
+def detect_charset(head: bytes, header_charset: Optional[str] = None) -> str:
+    """تشخیص charset از BOM، هدر HTTP، تگ meta در بایت‌های ابتدایی و در نهایت UTF-8"""
+    for bom, encoding in ((codecs.BOM_UTF8, 'utf-8-sig'), (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16')):
+        if head.startswith(bom):
+            return encoding
+    candidates = [header_charset]
+    match = META_CHARSET_PATTERN.search(head[:HTTP_CHARSET_SNIFF_BYTES])
+    if match:
+        candidates.append(match.group(1).decode('ascii', errors='ignore'))
+    for candidate in candidates:
+        if not candidate:
+            continue
+        try:
+            return codecs.lookup(candidate.strip()).name
+        except LookupError:
+            continue
+    return 'utf-8'
+
+def looks_like_html(head: bytes) -> bool:
+    """بررسی بایت‌های ابتدایی وقتی Content-Type مشخص نیست (رد فایل‌های باینری)"""
+    sample = head[:HTTP_CHARSET_SNIFF_BYTES]
+    return b'\x00' not in sample and b'<' in sample
+
+# ساختار صفحات نتایج: (تگ و کلاس ظرف نتیجه، selector عنوان، selector لینک، selectorهای snippet به ترتیب اولویت)
+SEARCH_RESULT_LAYOUTS = {
+    'duckduckgo': (('div', 'result__body'), 'a.result__a', 'a.result__a', ('a.result__snippet',)),
+    'bing': (('li', 'b_algo'), 'h2', 'h2 a', ('p', 'div.b_caption')),
+}
+
+def resolve_html_parser_backend(preferred: str = HTML_PARSER_BACKEND) -> str:
+    """انتخاب backend parse: سریع‌ترین مورد نصب‌شده یا html.parser به عنوان fallback"""
+    available = ['html.parser']
+    if LXML_AVAILABLE:
+        available.insert(0, 'lxml')
+    if SelectolaxHTMLParser is not None:
+        available.insert(0, 'selectolax')
+    if preferred in available:
+        return preferred
+    if preferred != 'auto':
+        logger.warning(f"HTML parser backend {preferred} is not installed, using {available[0]}")
+    return available[0]
+
+def parse_search_results(engine: str, html: str, backend: str = 'html.parser', limit: int = 5) -> List[Dict[str, str]]:
+    """استخراج عنوان/لینک/snippet خام از صفحه نتایج (تابع سطح ماژول تا در process pool هم قابل اجرا باشد)"""
+    (tag, css_class), title_sel, link_sel, snippet_sels = SEARCH_RESULT_LAYOUTS[engine]
+    results = []
+    
+    if backend == 'selectolax':
+        for node in SelectolaxHTMLParser(html).css(f'{tag}.{css_class}')[:limit]:
+            title_elem = node.css_first(title_sel)
+            link_elem = node.css_first(link_sel)
+            snippet_elem = next((e for e in (node.css_first(sel) for sel in snippet_sels) if e is not None), None)
+            if title_elem is None or link_elem is None:
+                continue
+            results.append({
+                'url': link_elem.attributes.get('href') or '',
+                'title': title_elem.text(),
+                'snippet': snippet_elem.text() if snippet_elem is not None else ''
+            })
+        return results
+    
+    # فقط ظرف‌های نتیجه ساخته می‌شوند، نه کل درخت صفحه
+    # (در زمان parse مقدار class هنوز رشته کامل است، پس تطبیق با regex روی یک کلاس انجام می‌شود)
+    strainer = SoupStrainer(tag, class_=re.compile(rf'(^|\s){re.escape(css_class)}(\s|$)'))
+    soup = BeautifulSoup(html, backend, parse_only=strainer)
+    for node in soup.find_all(tag, class_=css_class)[:limit]:
+        title_elem = node.select_one(title_sel)
+        link_elem = node.select_one(link_sel)
+        snippet_elem = next((e for e in (node.select_one(sel) for sel in snippet_sels) if e is not None), None)
+        if title_elem is None or link_elem is None:
+            continue
+        results.append({
+            'url': link_elem.get('href', ''),
+            'title': title_elem.get_text(),
+            'snippet': snippet_elem.get_text() if snippet_elem is not None else ''
+        })
+    return results
+
+# وزن‌دهی کلاس/id ظرف‌ها در استخراج متن اصلی (مشابه الگوریتم readability)
+ARTICLE_POSITIVE_HINTS = re.compile(r'article|body|content|entry|main|post|story|text', re.I)
+ARTICLE_NEGATIVE_HINTS = re.compile(r'comment|footer|sidebar|nav|menu|share|social|related|promo|banner|widget|\bads?\b|advert|sponsor', re.I)
+ARTICLE_NOISE_TAGS = ['script', 'style', 'noscript', 'nav', 'header', 'footer', 'aside', 'form', 'iframe', 'svg']
+
+def extract_main_text(html: str, backend: str = 'html.parser', max_chars: int = DEEP_RESEARCH_MAX_CHARS_PER_PAGE) -> str:
+    """استخراج متن اصلی مقاله: امتیازدهی ظرف‌ها بر اساس پاراگراف‌ها، ویرگول‌ها، کلاس/id و چگالی لینک"""
+    if backend == 'selectolax':
+        backend = 'lxml' if LXML_AVAILABLE else 'html.parser'
+    soup = BeautifulSoup(html, backend)
+    for node in soup(ARTICLE_NOISE_TAGS):
+        node.decompose()
+    
+    scores = {}
+    for paragraph in soup.find_all('p'):
+        text = paragraph.get_text(' ', strip=True)
+        if len(text) < 25:
+            continue
+        score = 1 + text.count(',') + text.count('،') + min(len(text) // 100, 3)
+        parent = paragraph.parent
+        for container, share in ((parent, 1.0), (parent.parent if parent else None, 0.5)):
+            if container is None or container.name in (None, '[document]'):
+                continue
+            if id(container) not in scores:
+                hints = ' '.join(container.get('class', [])) + ' ' + (container.get('id') or '')
+                base = 25 if ARTICLE_POSITIVE_HINTS.search(hints) else 0
+                base -= 25 if ARTICLE_NEGATIVE_HINTS.search(hints) else 0
+                scores[id(container)] = [container, base]
+            scores[id(container)][1] += score * share
+    
+    if not scores:
+        return ''
+    
+    def final_score(entry):
+        container, score = entry
+        text_length = len(container.get_text(strip=True)) or 1
+        link_length = sum(len(a.get_text(strip=True)) for a in container.find_all('a'))
+        return score * (1 - link_length / text_length)
+    
+    best = max(scores.values(), key=final_score)[0]
+    paragraphs = [p.get_text(' ', strip=True) for p in best.find_all(['p', 'li'])]
+    text = '\n'.join(p for p in paragraphs if len(p) >= 25)
+    return text[:max_chars]
+
+class HttpCache:
+    """کش HTTP روی دیسک برای fetch_page (SQLite با WAL؛ قابل اشتراک بین چند process)
+    
+    کلید: URL + پارامترها. پاسخ تازه بدون شبکه برگردانده می‌شود، پاسخ کهنه با
+    If-None-Match / If-Modified-Since اعتبارسنجی می‌شود و با گذشتن از سقف حجم،
+    کم‌استفاده‌ترین ورودی‌ها حذف می‌شوند.
+    """
+    
+    def __init__(self, db_path: str = HTTP_CACHE_PATH, max_bytes: int = HTTP_CACHE_MAX_BYTES):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.pool = ConnectionPool(db_path)
+        self.stats = {'hits': 0, 'revalidated': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        with self.pool.connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS http_cache (
+                    key TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    codec TEXT NOT NULL,
+                    body BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    max_age REAL NOT NULL,
+                    fresh_until REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_http_cache_last_used ON http_cache(last_used)')
+            conn.commit()
+    
+    @staticmethod
+    def key(url: str, params: Optional[dict] = None) -> str:
+        """کلید کش: hash آدرس به همراه پارامترهای مرتب‌شده"""
+        if params:
+            url = f"{url}{'&' if '?' in url else '?'}{urllib.parse.urlencode(sorted(params.items()))}"
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+    
+    @staticmethod
+    def freshness(headers) -> Optional[float]:
+        """مدت تازگی صریح پاسخ از Cache-Control (بدون max-age صفر)؛ None یعنی نباید ذخیره شود"""
+        directives = {}
+        for part in headers.get('Cache-Control', '').lower().split(','):
+            name, _, value = part.strip().partition('=')
+            directives[name] = value.strip('"')
+        if 'no-store' in directives:
+            return None
+        if 'no-cache' in directives:
+            return 0.0
+        for name in ('s-maxage', 'max-age'):
+            if directives.get(name, '').isdigit():
+                return float(min(int(directives[name]), HTTP_CACHE_MAX_TTL_SECONDS))
+        return 0.0
+    
+    @staticmethod
+    def varies(headers) -> bool:
+        """آیا پاسخ به هدرهای درخواستی غیر از Accept-Encoding وابسته است (Vary)"""
+        names = {name.strip().lower() for name in headers.get('Vary', '').split(',') if name.strip()}
+        return bool(names - HTTP_CACHE_IGNORED_VARY)
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """خواندن ورودی کش و به‌روزرسانی زمان آخرین استفاده (برای LRU)"""
+        try:
+            now = time.time()
+            with self.pool.connection() as conn:
+                row = conn.execute(
+                    'SELECT etag, last_modified, codec, body, fresh_until FROM http_cache WHERE key = ?', (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                conn.execute('UPDATE http_cache SET last_used = ? WHERE key = ?', (now, key))
+                conn.commit()
+            return {
+                'etag': row[0],
+                'last_modified': row[1],
+                'body': inflate_content(row[2], row[3]),
+                'fresh': row[4] > now
+            }
         except Exception as e:
-            logger.error(f"Error getting notifications for user {user_id}: {e}")
-            return []
+            logger.error(f"Error reading HTTP cache: {e}")
+            return None
     
-    def mark_notification_read(self, notification_id: int):
-        """علامت‌گذاری اعلان به عنوان خوانده شده"""
+    def put(self, key: str, url: str, body: str, headers) -> bool:
+        """ذخیره پاسخ 200 (در صورت مجاز بودن) و حذف LRU در همان تراکنش"""
+        ttl = self.freshness(headers)
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        # فقط پاسخ با max-age صریح یا validator ذخیره می‌شود؛ پاسخ وابسته به هدرهای درخواست هم نه
+        if ttl is None or (ttl == 0 and not etag and not last_modified) or self.varies(headers):
+            return False
+        codec, data = compress_content(body)
+        now = time.time()
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                UPDATE system_notifications 
-                SET is_read = 1
-                WHERE id = ?
-            ''', (notification_id,))
-            
-            conn.commit()
-            conn.close()
-            logger.debug(f"Notification {notification_id} marked as read")
+            with self.pool.connection() as conn:
+                conn.execute('''
+                    INSERT OR REPLACE INTO http_cache
+                    (key, url, etag, last_modified, codec, body, size, max_age, fresh_until, last_used)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (key, url, etag, last_modified, codec, data, len(data), ttl, now + ttl, now))
+                self._evict(conn)
+                conn.commit()
+            self.stats['stores'] += 1
+            return True
         except Exception as e:
-            logger.error(f"Error marking notification as read: {e}")
+            logger.error(f"Error writing HTTP cache: {e}")
+            return False
     
-    def get_user_statistics(self, user_id: int) -> Dict[str, Any]:
-        """دریافت آمار جامع کاربر"""
+    def revalidated(self, key: str, headers):
+        """پاسخ 304: تمدید تازگی و به‌روزرسانی validatorها"""
+        # اگر 304 خودش Cache-Control ندارد، سیاست پاسخ ذخیره‌شده معتبر می‌ماند
+        ttl = (self.freshness(headers) or 0.0) if 'Cache-Control' in headers else None
+        now = time.time()
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # آمار کلی
-            cursor.execute('''
-                SELECT total_requests, total_content_saved, daily_requests,
-                       join_date, last_activity, is_premium
-                FROM users WHERE user_id = ?
-            ''', (user_id,))
-            user_stats = cursor.fetchone()
-            
-            # آمار درخواست‌ها
-            cursor.execute('''
-                SELECT COUNT(*) as total,
-                       COUNT(CASE WHEN status = 'completed' THEN 1 END) as successful,
-                       COUNT(CASE WHEN status = 'failed' THEN 1 END) as failed,
-                       AVG(processing_time) as avg_time
-                FROM requests WHERE user_id = ?
-            ''', (user_id,))
-            request_stats = cursor.fetchone()
-            
-            # دسته‌بندی‌های محبوب
-            cursor.execute('''
-                SELECT category, COUNT(*) as count
-                FROM requests 
-                WHERE user_id = ? 
-                GROUP BY category 
-                ORDER BY count DESC 
-                LIMIT 5
-            ''', (user_id,))
-            categories = cursor.fetchall()
-            
-            # آمار محتوای ذخیره شده
-            cursor.execute('''
-                SELECT COUNT(*) as total,
-                       COUNT(CASE WHEN is_favorite = 1 THEN 1 END) as favorites,
-                       COUNT(CASE WHEN is_public = 1 THEN 1 END) as public
-                FROM saved_content WHERE user_id = ?
-            ''', (user_id,))
-            content_stats = cursor.fetchone()
-            
-            conn.close()
-            
-            return {
-                'user_info': {
-                    'total_requests': user_stats[0] if user_stats else 0,
-                    'total_content_saved': user_stats[1] if user_stats else 0,
-                    'daily_requests': user_stats[2] if user_stats else 0,
-                    'join_date': user_stats[3] if user_stats else None,
-                    'last_activity': user_stats[4] if user_stats else None,
-                    'is_premium': bool(user_stats[5]) if user_stats else False
-                },
-                'request_stats': {
-                    'total': request_stats[0] if request_stats else 0,
-                    'successful': request_stats[1] if request_stats else 0,
-                    'failed': request_stats[2] if request_stats else 0,
-                    'avg_processing_time': request_stats[3] if request_stats else 0
-                },
-                'popular_categories': categories,
-                'content_stats': {
-                    'total': content_stats[0] if content_stats else 0,
-                    'favorites': content_stats[1] if content_stats else 0,
-                    'public': content_stats[2] if content_stats else 0
-                }
-            }
+            with self.pool.connection() as conn:
+                conn.execute('''
+                    UPDATE http_cache SET max_age = COALESCE(?, max_age), fresh_until = ? + COALESCE(?, max_age),
+                        last_used = ?, etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified)
+                    WHERE key = ?
+                ''', (ttl, now, ttl, now, headers.get('ETag'), headers.get('Last-Modified'), key))
+                conn.commit()
         except Exception as e:
-            logger.error(f"Error getting user statistics: {e}")
-            return {}
+            logger.error(f"Error updating HTTP cache: {e}")
+    
+    def _evict(self, conn: sqlite3.Connection):
+        """حذف کم‌استفاده‌ترین ورودی‌ها تا رسیدن به ۹۰٪ سقف حجم"""
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM http_cache').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        cursor = conn.execute('''
+            DELETE FROM http_cache WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, SUM(size) OVER (ORDER BY last_used DESC, key) AS running FROM http_cache
+                ) WHERE running > ?
+            )
+        ''', (int(self.max_bytes * 0.9),))
+        self.stats['evictions'] += cursor.rowcount
+    
+    def get_report(self) -> Dict[str, Any]:
+        """تعداد و حجم ورودی‌ها و نرخ پاسخ بدون دانلود کامل"""
+        try:
+            with self.pool.connection() as conn:
+                entries, size = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM http_cache').fetchone()
+        except Exception as e:
+            logger.error(f"Error reading HTTP cache report: {e}")
+            entries, size = 0, 0
+        served = self.stats['hits'] + self.stats['revalidated']
+        total = served + self.stats['misses']
+        return {'entries': entries, 'size_bytes': size, 'hit_rate': served / total if total else 0.0, **self.stats}
+    
+    def close(self):
+        """بستن اتصال‌ها"""
+        self.pool.close_all()
+
+class HostCircuitBreaker:
+    """سلامت یک host: پنجره نرخ خطا و تأخیر، circuit breaker با cool-down نمایی و timeout تطبیقی"""
+    
+    def __init__(self, host: str):
+        self.host = host
+        self.state = BreakerState.CLOSED
+        self.outcomes = deque(maxlen=SCRAPE_BREAKER_WINDOW)  # True/False برای موفقیت هر درخواست
+        self.latencies = deque(maxlen=SCRAPE_BREAKER_WINDOW)  # فقط درخواست‌های موفق
+        self.consecutive_failures = 0
+        self.trips = 0  # تعداد باز شدن‌های پیاپی (برای cool-down نمایی)
+        self.open_until = 0.0
+        self.next_token = 0
+        self.probe_token: Optional[int] = None  # مجوز درخواست آزمایشی در حال اجرا
+        self.stats = {'requests': 0, 'failures': 0, 'short_circuited': 0, 'trips': 0}
+    
+    def available(self) -> bool:
+        """آیا درخواست جدید الان مجاز است (بدون تغییر وضعیت)"""
+        if self.state == BreakerState.OPEN:
+            return time.monotonic() >= self.open_until
+        if self.state == BreakerState.HALF_OPEN:
+            return self.probe_token is None
+        return True
+    
+    def allow(self) -> Optional[int]:
+        """گرفتن مجوز درخواست (None یعنی رد)؛ پس از پایان cool-down فقط یک درخواست آزمایشی عبور می‌کند"""
+        if not self.available():
+            self.stats['short_circuited'] += 1
+            return None
+        self.next_token += 1
+        if self.state != BreakerState.CLOSED:
+            self.state = BreakerState.HALF_OPEN
+            self.probe_token = self.next_token
+        return self.next_token
+    
+    def record(self, token: int, healthy: Optional[bool], latency: float):
+        """ثبت نتیجه درخواست با مجوز allow (None: لغو شده یا نامشخص، فقط آزاد کردن درخواست آزمایشی)"""
+        probe = token == self.probe_token
+        if probe:
+            self.probe_token = None
+        if healthy is None:
+            return
+        
+        self.stats['requests'] += 1
+        if not healthy:
+            self.stats['failures'] += 1
+        # درخواست‌های قدیمی‌تر از باز شدن مدار وضعیت را تغییر نمی‌دهند؛ فقط نتیجه آزمایشی تصمیم می‌گیرد
+        if self.state != BreakerState.CLOSED and not probe:
+            return
+        
+        self.outcomes.append(healthy)
+        if healthy:
+            self.latencies.append(latency)
+            self.consecutive_failures = 0
+            if self.state == BreakerState.HALF_OPEN:
+                logger.info(f"Circuit closed for {self.host}")
+                self.state = BreakerState.CLOSED
+                self.trips = 0
+                self.outcomes.clear()
+            return
+        
+        self.consecutive_failures += 1
+        if probe or self.consecutive_failures >= SCRAPE_BREAKER_CONSECUTIVE_FAILURES or (
+            len(self.outcomes) >= SCRAPE_BREAKER_MIN_REQUESTS and self.error_rate() >= SCRAPE_BREAKER_ERROR_RATE
+        ):
+            self._trip()
+    
+    def _trip(self):
+        """باز کردن مدار با cool-down نمایی"""
+        self.trips += 1
+        self.stats['trips'] += 1
+        cooldown = min(SCRAPE_BREAKER_COOLDOWN_SECONDS * 2 ** (self.trips - 1), SCRAPE_BREAKER_MAX_COOLDOWN_SECONDS)
+        self.state = BreakerState.OPEN
+        self.open_until = time.monotonic() + cooldown
+        logger.warning(f"Circuit opened for {self.host} for {cooldown}s (error rate {self.error_rate():.0%})")
+    
+    def error_rate(self) -> float:
+        """نرخ خطا در پنجره اخیر"""
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+    
+    def latency_p95(self) -> Optional[float]:
+        """صدک ۹۵ تأخیر درخواست‌های موفق اخیر"""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    
+    def adaptive_timeout(self, default: float) -> float:
+        """timeout بر اساس تأخیر واقعی host (هیچ‌وقت بیشتر از default)"""
+        p95 = self.latency_p95()
+        if p95 is None or len(self.latencies) < SCRAPE_BREAKER_MIN_REQUESTS:
+            return default
+        return min(default, max(SCRAPE_MIN_TIMEOUT_SECONDS, p95 * SCRAPE_TIMEOUT_LATENCY_FACTOR))
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """وضعیت فعلی برای نمایش در آمار"""
+        p95 = self.latency_p95()
+        return {
+            'host': self.host,
+            'state': self.state.value,
+            'error_rate': self.error_rate(),
+            'latency_p95': p95,
+            'cooldown_remaining': max(0.0, self.open_until - time.monotonic()) if self.state == BreakerState.OPEN else 0.0,
+            **self.stats
+        }
+
+class HostHealthTracker:
+    """نگه‌داری circuit breaker هر host (حداکثر SCRAPE_HEALTH_MAX_HOSTS مورد، LRU)"""
+    
+    def __init__(self, max_hosts: int = SCRAPE_HEALTH_MAX_HOSTS):
+        self.max_hosts = max_hosts
+        self._breakers: OrderedDict = OrderedDict()
+    
+    def breaker(self, host: str) -> HostCircuitBreaker:
+        """breaker مربوط به host (ساخت در اولین استفاده)"""
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            breaker = self._breakers[host] = HostCircuitBreaker(host)
+            if len(self._breakers) > self.max_hosts:
+                self._breakers.popitem(last=False)
+        else:
+            self._breakers.move_to_end(host)
+        return breaker
+    
+    def available(self, host: str) -> bool:
+        """آیا host در حال حاضر قابل استفاده است"""
+        breaker = self._breakers.get(host)
+        return breaker is None or breaker.available()
+    
+    def snapshot(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """وضعیت hostها: ابتدا مدارهای باز، سپس پرترافیک‌ترین‌ها"""
+        snapshots = [breaker.snapshot() for breaker in self._breakers.values()]
+        snapshots.sort(key=lambda item: (item['state'] == BreakerState.CLOSED.value, -item['requests']))
+        return snapshots[:limit]
 
 class ContentScraper:
-    def __init__(self, session: aiohttp.ClientSession):
+    # host هر موتور جستجو برای رد کردن سریع موتورهای دارای مدار باز
+    PROVIDER_HOSTS = {'duckduckgo': 'duckduckgo.com', 'bing': 'www.bing.com'}
+    
+    def __init__(self, session: aiohttp.ClientSession, http_cache: Optional[HttpCache] = None):
         self.session = session
+        self.http_cache = http_cache
+        self.parser_backend = resolve_html_parser_backend()
+        self.health = HostHealthTracker()
+        if HTML_PARSE_EXECUTOR == 'process':
+            self.parse_executor = ProcessPoolExecutor(max_workers=HTML_PARSE_WORKERS)
+        elif HTML_PARSE_EXECUTOR == 'thread':
+            self.parse_executor = ThreadPoolExecutor(max_workers=HTML_PARSE_WORKERS, thread_name_prefix='html-parse')
+        else:
+            self.parse_executor = None
+        logger.info(f"Search result parser: {self.parser_backend} (executor: {HTML_PARSE_EXECUTOR})")
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
@@ -1549,13 +4054,66 @@ class ContentScraper:
             'Sec-Fetch-Site': 'none',
             'Cache-Control': 'no-cache',
         }
-
-    async def fetch_page(self, url: str, timeout: int = 15, params: dict = None) -> str:
-        """واکشی صفحه وب با headers مناسب و مدیریت خطا"""
+        if self.http_cache is not None:
+            # اعتبارسنجی توسط کش محلی انجام می‌شود؛ CDNها مجازند نسخه تازه خودشان را بدهند
+            self.headers.pop('Cache-Control')
+
+    async def read_html(self, response: aiohttp.ClientResponse, max_bytes: int) -> Tuple[Optional[str], bool]:
+        """خواندن تکه‌تکه بدنه تا سقف max_bytes؛ خروجی: (متن یا None برای محتوای غیر HTML، بریده شدن)"""
+        content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        # نوع‌های مبهم (بدون هدر، text/plain، octet-stream) با بایت‌های ابتدایی بررسی می‌شوند
+        sniff = content_type in HTTP_SNIFFED_CONTENT_TYPES
+        if not sniff and content_type not in HTTP_HTML_CONTENT_TYPES:
+            logger.debug(f"Skipping non-HTML content ({content_type}) from {response.url}")
+            return None, False
+        
+        body = bytearray()
+        truncated = False
+        async for chunk in response.content.iter_chunked(HTTP_FETCH_CHUNK_BYTES):
+            if not body and sniff and not looks_like_html(chunk):
+                logger.debug(f"Skipping binary content from {response.url}")
+                return None, False
+            body.extend(chunk[:max_bytes - len(body)])
+            if len(body) >= max_bytes:
+                # رسیدن به سقف بریده شدن حساب می‌شود (چنین بدنه‌ای در کش ذخیره نمی‌شود)
+                truncated = True
+                logger.debug(f"Truncated {response.url} at {max_bytes} bytes")
+                break
+        
+        text = body.decode(detect_charset(bytes(body[:HTTP_CHARSET_SNIFF_BYTES]), response.charset), errors='replace')
+        return text, truncated
+    
+    async def fetch_page(self, url: str, timeout: int = 15, params: dict = None,
+                         max_bytes: int = HTTP_FETCH_MAX_BYTES) -> str:
+        """واکشی صفحه وب با headers مناسب و مدیریت خطا (حافظه هر واکشی به max_bytes محدود است)"""
+        cache_key = cached = None
+        if self.http_cache is not None:
+            cache_key = HttpCache.key(url, params)
+            cached = await asyncio.to_thread(self.http_cache.get, cache_key)
+            if cached and cached['fresh']:
+                self.http_cache.stats['hits'] += 1
+                return cached['body']
+        
+        # hostهایی که مدارشان باز است بلافاصله رد می‌شوند، نه بعد از انتظار برای timeout
+        breaker = self.health.breaker(urllib.parse.urlsplit(url).hostname or '')
+        token = breaker.allow()
+        if token is None:
+            logger.debug(f"Circuit open for {breaker.host}, skipping {url}")
+            # نسخه کهنه کش بهتر از هیچ است
+            return cached['body'] if cached else ""
+        started = time.monotonic()
+        healthy = None
         try:
+            headers = self.headers
+            if cached:
+                headers = dict(self.headers)
+                if cached['etag']:
+                    headers['If-None-Match'] = cached['etag']
+                if cached['last_modified']:
+                    headers['If-Modified-Since'] = cached['last_modified']
             kwargs = {
-                'headers': self.headers,
-                'timeout': aiohttp.ClientTimeout(total=timeout),
+                'headers': headers,
+                'timeout': aiohttp.ClientTimeout(total=breaker.adaptive_timeout(timeout)),
                 'ssl': False,
                 'allow_redirects': True,
                 'max_redirects': 5
@@ -1565,9 +4123,22 @@ class ContentScraper:
                 kwargs['params'] = params
             
             async with self.session.get(url, **kwargs) as response:
+                # 403/429 (مسدودسازی) و 5xx خطای host حساب می‌شوند؛ 404 مشکل همان صفحه است
+                healthy = response.status not in (403, 429) and response.status < 500
+                if response.status == 304 and cached:
+                    self.http_cache.stats['revalidated'] += 1
+                    await asyncio.to_thread(self.http_cache.revalidated, cache_key, response.headers)
+                    return cached['body']
                 if response.status == 200:
-                    content = await response.text()
+                    content, truncated = await self.read_html(response, max_bytes)
+                    if content is None:
+                        return ""
                     logger.debug(f"Successfully fetched {len(content)} characters from {url}")
+                    if self.http_cache is not None:
+                        self.http_cache.stats['misses'] += 1
+                        # بدنه بریده‌شده برای درخواستی با سقف بزرگ‌تر ناقص است
+                        if not truncated:
+                            await asyncio.to_thread(self.http_cache.put, cache_key, url, content, response.headers)
                     return content
                 elif response.status == 403:
                     logger.warning(f"Access forbidden (403) for {url}")
@@ -1582,14 +4153,61 @@ class ContentScraper:
                     logger.warning(f"HTTP {response.status} for {url}")
                     return ""
         except asyncio.TimeoutError:
+            healthy = False
             logger.error(f"Timeout fetching {url}")
             return ""
         except aiohttp.ClientError as e:
+            healthy = False
             logger.error(f"Client error fetching {url}: {e}")
             return ""
         except Exception as e:
             logger.error(f"Unexpected error fetching {url}: {e}")
             return ""
+        finally:
+            breaker.record(token, healthy, time.monotonic() - started)
+
+    async def _parse(self, func, html: str, *args):
+        """اجرای تابع parse؛ صفحات بزرگ در executor جدا تا event loop مسدود نشود"""
+        if self.parse_executor is None or len(html) < HTML_PARSE_OFFLOAD_MIN_BYTES:
+            return func(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.parse_executor, func, *args)
+    
+    async def parse_results(self, engine: str, html: str) -> List[Dict[str, str]]:
+        """parse صفحه نتایج جستجو"""
+        return await self._parse(parse_search_results, html, engine, html, self.parser_backend)
+    
+    async def fetch_article(self, url: str, semaphore: asyncio.Semaphore) -> str:
+        """واکشی یک صفحه منبع (با سقف حجم) و استخراج متن اصلی آن"""
+        async with semaphore:
+            html = await self.fetch_page(url, DEEP_RESEARCH_PAGE_TIMEOUT_SECONDS, max_bytes=DEEP_RESEARCH_MAX_PAGE_BYTES)
+        if not html:
+            return ""
+        try:
+            return await self._parse(extract_main_text, html, html, self.parser_backend)
+        except Exception as e:
+            logger.warning(f"Error extracting article text from {url}: {e}")
+            return ""
+    
+    async def deep_research(self, results: List[Dict[str, str]], pages: int) -> List[Tuple[Dict[str, str], str]]:
+        """مرحله تحقیق عمیق: خواندن هم‌زمان متن کامل pages نتیجه اول"""
+        semaphore = asyncio.Semaphore(DEEP_RESEARCH_CONCURRENCY)
+        targets = [result for result in results if result.get('url')][:pages]
+        started = time.monotonic()
+        texts = await asyncio.gather(*[
+            self.fetch_article(self._resolve_url(result['url']), semaphore) for result in targets
+        ])
+        articles = [(result, text) for result, text in zip(targets, texts) if text]
+        logger.info(f"Deep research: {len(articles)}/{len(targets)} pages extracted in {time.monotonic() - started:.2f}s")
+        return articles
+    
+    def close(self):
+        """آزادسازی executor پارسر و کش HTTP"""
+        if self.parse_executor is not None:
+            self.parse_executor.shutdown(wait=False, cancel_futures=True)
+            self.parse_executor = None
+        if self.http_cache is not None:
+            self.http_cache.close()
 
     def clean_text(self, text: str) -> str:
         """تمیز کردن و نرمال‌سازی متن"""
@@ -1604,37 +4222,30 @@ class ContentScraper:
         """جستجو با DuckDuckGo"""
         try:
             search_url = f"https://duckduckgo.com/html/?q={urllib.parse.quote(query)}"
-            html = await self.fetch_page(search_url)
+            html = await self.fetch_page(search_url, RESEARCH_FETCH_TIMEOUT_SECONDS)
             
             if not html:
                 return []
             
-            soup = BeautifulSoup(html, 'html.parser')
             results = []
             
-            search_results = soup.find_all('div', class_='result__body')
-            
-            for result in search_results[:5]:
+            for result in await self.parse_results('duckduckgo', html):
                 try:
-                    title_elem = result.find('a', class_='result__a')
-                    snippet_elem = result.find('a', class_='result__snippet')
+                    url = result['url']
+                    title = self.clean_text(result['title'])
+                    snippet = self.clean_text(result['snippet'])
+                    
+                    if url.startswith('//'):
+                        url = 'https:' + url
+                    elif url.startswith('/'):
+                        url = 'https://duckduckgo.com' + url
                     
-                    if title_elem:
-                        url = title_elem.get('href', '')
-                        title = self.clean_text(title_elem.get_text())
-                        snippet = self.clean_text(snippet_elem.get_text()) if snippet_elem else ""
-                        
-                        if url.startswith('//'):
-                            url = 'https:' + url
-                        elif url.startswith('/'):
-                            url = 'https://duckduckgo.com' + url
-                        
-                        if title and len(title) > 10:
-                            results.append({
-                                'url': url,
-                                'title': title,
-                                'snippet': snippet
-                            })
+                    if title and len(title) > 10:
+                        results.append({
+                            'url': url,
+                            'title': title,
+                            'snippet': snippet
+                        })
                 except Exception as e:
                     logger.debug(f"Error parsing DDG result: {e}")
                     continue
@@ -1649,33 +4260,24 @@ class ContentScraper:
         """جستجو با Bing"""
         try:
             search_url = f"https://www.bing.com/search?q={urllib.parse.quote(query)}"
-            html = await self.fetch_page(search_url)
+            html = await self.fetch_page(search_url, RESEARCH_FETCH_TIMEOUT_SECONDS)
             
             if not html:
                 return []
             
-            soup = BeautifulSoup(html, 'html.parser')
             results = []
             
-            search_results = soup.find_all('li', class_='b_algo')
-            
-            for result in search_results[:5]:
+            for result in await self.parse_results('bing', html):
                 try:
-                    title_elem = result.find('h2')
-                    link_elem = title_elem.find('a') if title_elem else None
-                    snippet_elem = result.find('p') or result.find('div', class_='b_caption')
+                    title = self.clean_text(result['title'])
+                    snippet = self.clean_text(result['snippet'])
                     
-                    if link_elem and title_elem:
-                        url = link_elem.get('href', '')
-                        title = self.clean_text(title_elem.get_text())
-                        snippet = self.clean_text(snippet_elem.get_text()) if snippet_elem else ""
-                        
-                        if title and len(title) > 10:
-                            results.append({
-                                'url': url,
-                                'title': title,
-                                'snippet': snippet
-                            })
+                    if title and len(title) > 10:
+                        results.append({
+                            'url': result['url'],
+                            'title': title,
+                            'snippet': snippet
+                        })
                 except Exception as e:
                     logger.debug(f"Error parsing Bing result: {e}")
                     continue
@@ -1686,41 +4288,118 @@ class ContentScraper:
             logger.error(f"Bing search error: {e}")
             return []
 
-    async def comprehensive_research(self, topic: str) -> (str, list):
-        """تحقیق جامع در مورد موضوع"""
-        logger.info(f"Starting comprehensive research for: {topic}")
+    def search_providers(self) -> List[Tuple[str, Any, float]]:
+        """موتورهای جستجو به ترتیب اولویت: (نام، تابع جستجو، تأخیر شروع)"""
+        return [
+            ('duckduckgo', self.search_duckduckgo, 0),
+            ('bing', self.search_bing, RESEARCH_HEDGE_DELAY_SECONDS),
+        ]
+    
+    @staticmethod
+    def _resolve_url(url: str) -> str:
+        """آدرس واقعی منبع (باز کردن لینک‌های redirect داک‌داک‌گو)"""
+        if 'uddg=' in url:
+            url = urllib.parse.unquote(url.split('uddg=')[1].split('&')[0])
+        elif url.startswith('//'):
+            url = 'https:' + url
+        return url
+    
+    @staticmethod
+    def _result_key(result: Dict[str, str]) -> str:
+        """کلید حذف نتایج تکراری بین موتورها (URL بدون پروتکل و / انتهایی)"""
+        url = ContentScraper._resolve_url(result.get('url', ''))
+        url = re.sub(r'^https?://(www\.)?', '', url).rstrip('/').lower()
+        return url or result.get('title', '').lower()
+    
+    async def search_all_providers(self, query: str) -> List[Dict[str, str]]:
+        """جستجوی هم‌زمان در همه موتورها با سقف زمان جدا و بازگشت زودهنگام
+        
+        نتایج به ترتیب رسیدن ادغام می‌شوند؛ به محض رسیدن RESEARCH_MIN_SNIPPETS نتیجه خوب،
+        موتورهای باقی‌مانده لغو می‌شوند (موتوری که هنوز در تأخیر hedge است اصلاً درخواست نمی‌فرستد).
+        موتور پشتیبان با تمام شدن تأخیر hedge یا پایان زودتر موتور قبلی با نتایج ناکافی شروع می‌شود.
+        """
+        started = time.monotonic()
+        
+        async def run_provider(name, search, delay, launch):
+            if delay:
+                try:
+                    await asyncio.wait_for(launch.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+            launch.set()
+            try:
+                results = await asyncio.wait_for(search(query), RESEARCH_PROVIDER_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                logger.warning(f"Search provider {name} timed out after {RESEARCH_PROVIDER_TIMEOUT_SECONDS}s")
+                results = []
+            logger.info(f"Search provider {name}: {len(results)} results in {time.monotonic() - started:.2f}s")
+            return results
+        
+        # موتورهایی که مدارشان باز است کنار گذاشته می‌شوند و تأخیر hedge بقیه به همان اندازه جلو می‌آید
+        providers = [
+            provider for provider in self.search_providers()
+            if self.health.available(self.PROVIDER_HOSTS.get(provider[0], ''))
+        ]
+        if not providers:
+            logger.warning("All search providers have open circuits")
+            return []
+        skipped_delay = providers[0][2]
+        launches = [asyncio.Event() for _ in providers]
+        tasks = [
+            asyncio.create_task(run_provider(name, search, delay - skipped_delay, launch))
+            for (name, search, delay), launch in zip(providers, launches)
+        ]
+        merged = []
+        seen = set()
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                for result in await next_done:
+                    key = self._result_key(result)
+                    if key not in seen:
+                        seen.add(key)
+                        merged.append(result)
+                
+                good = sum(1 for result in merged if len(result['snippet']) >= RESEARCH_MIN_SNIPPET_LENGTH)
+                if good >= RESEARCH_MIN_SNIPPETS:
+                    logger.info(f"Search returned early with {good} good snippets")
+                    break
+                # نتایج کافی نیست: موتور بعدی بدون انتظار برای باقی تأخیر hedge شروع می‌شود
+                pending = next((launch for launch in launches if not launch.is_set()), None)
+                if pending is not None:
+                    pending.set()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        
+        return merged[:RESEARCH_MAX_RESULTS]
+    
+    async def comprehensive_research(self, topic: str, depth: str = 'basic') -> (str, list):
+        """تحقیق جامع در مورد موضوع (depth از user_settings.research_depth تعداد صفحات کامل خوانده‌شده را تعیین می‌کند)"""
+        logger.info(f"Starting comprehensive research for: {topic} (depth: {depth})")
         research_parts = []
         sources = []
         
         try:
-            # جستجو با DuckDuckGo
-            logger.info("Searching with DuckDuckGo...")
-            ddg_results = await self.search_duckduckgo(topic)
-            if ddg_results:
-                ddg_content = []
-                for result in ddg_results:
-                    if result['snippet']:
-                        ddg_content.append(f"• {result['title']}: {result['snippet']}")
-                        if result['url']:
-                            sources.append({'title': result['title'], 'url': result['url']})
-                
-                if ddg_content:
-                    research_parts.append("🔍 نتایج جستجو:\n" + "\n".join(ddg_content))
-            
-            # اگر نتیجه کافی نداریم، Bing را امتحان کنیم
-            if len(research_parts) == 0:
-                logger.info("Trying Bing search...")
-                bing_results = await self.search_bing(topic)
-                if bing_results:
-                    bing_content = []
-                    for result in bing_results:
-                        if result['snippet']:
-                            bing_content.append(f"• {result['title']}: {result['snippet']}")
-                            if result['url']:
-                                sources.append({'title': result['title'], 'url': result['url']})
-                    
-                    if bing_content:
-                        research_parts.append("🔍 نتایج جستجو:\n" + "\n".join(bing_content))
+            # همه موتورها هم‌زمان (با تأخیر hedge برای موتورهای پشتیبان) و ادغام نتایج
+            results = await self.search_all_providers(topic)
+            research_content = []
+            for result in results:
+                if result['snippet']:
+                    research_content.append(f"• {result['title']}: {result['snippet']}")
+                    if result['url']:
+                        sources.append({'title': result['title'], 'url': result['url']})
+            
+            if research_content:
+                research_parts.append("🔍 نتایج جستجو:\n" + "\n".join(research_content))
+            
+            deep_pages = RESEARCH_DEPTH_PAGES.get(depth, 0)
+            if deep_pages and results:
+                articles = await self.deep_research(results, deep_pages)
+                if articles:
+                    research_parts.append("📖 متن منابع:\n" + "\n\n".join(
+                        f"• {result['title']}:\n{text}" for result, text in articles
+                    ))
             
             # اگر هیچ محتوای خارجی پیدا نکردیم، محتوای پایه بسازیم
             if not research_parts:
@@ -2310,17 +4989,22 @@ class AdvancedTelegramBot:
     def __init__(self):
         # مدیران اصلی
         self.db = DatabaseManager()
+        self.db_async = AsyncDatabaseManager(self.db)
+        self.http = HttpSessionManager()
         self.scraper = None
+        self.research_cache = ResearchCache(self.db)
+        self.inflight = SingleFlight()
         self.metis_api = MetisAPI(METIS_API_KEY, METIS_BOT_ID, METIS_MODEL)
         
         # مدیران پیشرفته
         self.rate_limiter = RateLimiter()
         self.security_manager = SecurityManager()
-        self.backup_manager = BackupManager(self.db.db_path)
+        self.backup_manager = BackupManager(self.db.db_path, self.db)
         self.ai_assistant = AIAssistant(self.metis_api)
         
         # مدیران محتوا و آمار
         self.analytics_manager = AnalyticsManager(self.db)
+        self.retention_manager = RetentionManager(self.db)
         self.notification_manager = None
         self.content_scheduler = ContentScheduler()
         self.content_template = ContentTemplate()
@@ -2335,6 +5019,7 @@ class AdvancedTelegramBot:
         self.backup_task = None
         self.cleanup_task = None
         self.reminder_task = None
+        self.rollup_task = None
         
         # آمار سیستم
         self.system_stats = {
@@ -2433,6 +5118,34 @@ class AdvancedTelegramBot:
             [InlineKeyboardButton("🔙 برگشت به منوی اصلی", callback_data='main_menu')]
         ])
     
+    def get_pagination_row(self, screen: str, page: Dict[str, Any]) -> List[InlineKeyboardButton]:
+        """دکمه‌های قبلی/بعدی برای یک صفحه از لیست"""
+        row = []
+        if page['prev_cursor']:
+            row.append(InlineKeyboardButton(
+                "◀️ قبلی", callback_data=f"page_{screen}_p_{page['prev_cursor'][0]}|{page['prev_cursor'][1]}"
+            ))
+        if page['next_cursor']:
+            row.append(InlineKeyboardButton(
+                "بعدی ▶️", callback_data=f"page_{screen}_n_{page['next_cursor'][0]}|{page['next_cursor'][1]}"
+            ))
+        return row
+    
+    def get_paged_back_menu(self, screen: str, page: Dict[str, Any], back_action: str = 'main_menu'):
+        """منوی بازگشت همراه با دکمه‌های صفحه‌بندی"""
+        keyboard = []
+        pagination_row = self.get_pagination_row(screen, page)
+        if pagination_row:
+            keyboard.append(pagination_row)
+        keyboard.append([InlineKeyboardButton("🔙 برگشت", callback_data=back_action)])
+        return InlineKeyboardMarkup(keyboard)
+    
+    def _parse_page_callback(self, action: str) -> Tuple[str, Optional[Tuple[str, int]], bool]:
+        """تجزیه داده دکمه صفحه‌بندی به (صفحه، cursor، جهت)"""
+        _, screen, direction, raw_cursor = action.split('_', 3)
+        sort_key, _, row_id = raw_cursor.rpartition('|')
+        return screen, (sort_key, int(row_id)), direction == 'p'
+    
     def get_category_menu(self):
         """منوی انتخاب دسته‌بندی"""
         return InlineKeyboardMarkup([
@@ -2494,7 +5207,7 @@ class AdvancedTelegramBot:
             return
         
         # ثبت کاربر در دیتابیس
-        self.db.create_user(
+        await self.db_async.create_user(
             user_id=user_id,
             username=user.username or "",
             first_name=user.first_name or "",
@@ -2699,7 +5412,7 @@ class AdvancedTelegramBot:
         user_id = update.effective_user.id
         
         # دریافت اعلان‌های جدید
-        notifications = self.db.get_user_notifications(user_id, unread_only=True)
+        notifications = await self.db_async.get_user_notifications(user_id, unread_only=True)
         
         if notifications:
             notifications_text = "📬 اعلان‌های جدید:\n\n"
@@ -2793,7 +5506,7 @@ class AdvancedTelegramBot:
     async def analytics_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """دستور آمار"""
         user_id = update.effective_user.id
-        analytics = self.analytics_manager.get_user_analytics(user_id)
+        analytics = await self.db_async.run_analytics(self.analytics_manager.get_user_analytics, user_id)
         
         if not analytics:
             await update.message.reply_text("❌ خطا در دریافت آمار", reply_markup=self.get_main_menu())
@@ -2820,7 +5533,7 @@ class AdvancedTelegramBot:
     async def settings_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """دستور تنظیمات"""
         user_id = update.effective_user.id
-        settings = self.db.get_user_settings(user_id)
+        settings = await self.db_async.get_user_settings(user_id)
         
         settings_text = f"""⚙️ تنظیمات شخصی
 
@@ -2829,6 +5542,7 @@ class AdvancedTelegramBot:
 • طول محتوا: {settings.get('content_length', 'medium')}
 • اعلان‌ها: {'فعال' if settings.get('notification_enabled', True) else 'غیرفعال'}
 • ذخیره خودکار: {'فعال' if settings.get('auto_save', True) else 'غیرفعال'}
+• عمق تحقیق: {settings.get('research_depth') or 'comprehensive'} ({RESEARCH_DEPTH_PAGES.get(settings.get('research_depth') or 'comprehensive', 0)} منبع کامل)
 • دسته‌بندی‌های مورد علاقه: {settings.get('preferred_categories', 'general')}
 
 💡 برای تغییر تنظیمات، از منوی زیر استفاده کنید."""
@@ -2838,7 +5552,7 @@ class AdvancedTelegramBot:
     async def saved_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """دستور محتوای ذخیره شده"""
         user_id = update.effective_user.id
-        saved_content = self.db.get_saved_content(user_id, 5)
+        saved_content = await self.db_async.get_saved_content(user_id, 5)
         
         if not saved_content:
             await update.message.reply_text(
@@ -2910,7 +5624,7 @@ class AdvancedTelegramBot:
         try:
             if action == 'new_topic':
                 # بررسی محدودیت روزانه
-                if not self.db.can_make_request(user_id):
+                if not await self.db_async.can_make_request(user_id):
                     await query.edit_message_text(
                         f"⚠️ محدودیت روزانه شما تمام شده است!\n\n📊 شما امروز {MAX_DAILY_REQUESTS} درخواست داشته‌اید.\n\n🕐 محدودیت فردا صبح ریست می‌شود.",
                         reply_markup=self.get_back_menu()
@@ -3083,6 +5797,13 @@ class AdvancedTelegramBot:
             elif action == 'search_history':
                 await self.show_search_history(query, user_id)
             
+            elif action == 'history_search':
+                self.user_states[user_id] = 'waiting_for_history_search'
+                await query.edit_message_text(
+                    "📅 جستجو در تاریخچه\n\nلطفاً عبارت جستجو را بنویسید:",
+                    reply_markup=self.get_back_menu()
+                )
+            
             elif action == 'advanced_filters':
                 await self.show_advanced_filters(query, user_id)
                 
@@ -3209,6 +5930,18 @@ class AdvancedTelegramBot:
                     message, 
                     reply_markup=self.get_back_menu()
                 )
+            
+            # صفحه‌بندی لیست‌ها: page_<screen>_<n|p>_<created_at>|<id>
+            elif action.startswith('page_'):
+                screen, cursor, backward = self._parse_page_callback(action)
+                if screen == 'saved':
+                    await self.show_saved_content(query, user_id, cursor, backward)
+                elif screen == 'notif':
+                    await self.show_all_notifications(query, user_id, cursor, backward)
+                elif screen == 'history':
+                    await self.show_search_history(query, user_id, cursor, backward)
+                elif screen == 'remind':
+                    await self.show_reminders(query, user_id, cursor, backward)
                 
         except Exception as e:
             logger.error(f"Error in button handler: {e}")
@@ -3219,7 +5952,8 @@ class AdvancedTelegramBot:
     
     async def show_analytics(self, query, user_id: int):
         """نمایش آمار کاربر"""
-        user = self.db.get_user(user_id)
+        user = await self.db_async.get_user(user_id)
+        counters = await self.db_async.run_analytics(self.db.get_user_counters, user_id, 1)
         if not user:
             await query.edit_message_text(
                 "❌ اطلاعات کاربر یافت نشد.",
@@ -3237,6 +5971,10 @@ class AdvancedTelegramBot:
 • درخواست‌های امروز: {user['daily_requests']}/{MAX_DAILY_REQUESTS}
 • وضعیت: {'✅ فعال' if user['daily_requests'] < MAX_DAILY_REQUESTS else '⚠️ محدود'}
 
+📊 آمار کلی:
+• کل درخواست‌ها: {counters.get('total_requests', 0)} (✅ {counters.get('successful_requests', 0)} / ❌ {counters.get('failed_requests', 0)})
+• محتوای ذخیره شده: {counters.get('content_saved', 0)} (⭐ {counters.get('favorites', 0)})
+
 🎯 دسته‌بندی مورد علاقه:
 • {user['preferred_category'] or 'تنظیم نشده'}
 
@@ -3249,7 +5987,7 @@ class AdvancedTelegramBot:
     
     async def show_settings(self, query, user_id: int):
         """نمایش تنظیمات"""
-        user = self.db.get_user(user_id)
+        user = await self.db_async.get_user(user_id)
         if not user:
             await query.edit_message_text(
                 "❌ اطلاعات کاربر یافت نشد.",
@@ -3275,9 +6013,11 @@ class AdvancedTelegramBot:
             reply_markup=self.get_settings_menu()
         )
     
-    async def show_saved_content(self, query, user_id: int):
+    async def show_saved_content(self, query, user_id: int, cursor: Optional[Tuple[str, int]] = None,
+                                 backward: bool = False):
         """نمایش محتوای ذخیره شده"""
-        saved_content = self.db.get_saved_content(user_id, 10)
+        page = await self.db_async.get_saved_content_page(user_id, cursor, backward)
+        saved_content = page['items']
         
         if not saved_content:
             await query.edit_message_text(
@@ -3287,20 +6027,17 @@ class AdvancedTelegramBot:
             return
         
         content_text = "💾 محتوای ذخیره شده شما:\n\n"
-        for i, content in enumerate(saved_content[:5], 1):
-            content_text += f"{i}. 📝 {content['topic']}\n"
+        for content in saved_content:
+            content_text += f"📝 {content['topic']}\n"
             content_text += f"   🏷️ {content['category']}\n"
             content_text += f"   📅 {content['created_at'][:10]}\n"
             if content['is_favorite']:
                 content_text += f"   ⭐ مورد علاقه\n"
             content_text += "\n"
         
-        if len(saved_content) > 5:
-            content_text += f"... و {len(saved_content) - 5} مورد دیگر"
-        
         await query.edit_message_text(
             content_text,
-            reply_markup=self.get_back_menu()
+            reply_markup=self.get_paged_back_menu('saved', page)
         )
     
     async def show_feedback_menu(self, query, user_id: int):
@@ -3321,10 +6058,13 @@ class AdvancedTelegramBot:
             reply_markup=self.get_feedback_menu()
         )
     
-    async def show_reminders(self, query, user_id: int):
+    async def show_reminders(self, query, user_id: int, cursor: Optional[Tuple[str, int]] = None,
+                             backward: bool = False):
         """نمایش یادآوری‌ها"""
-        # اینجا می‌توانید یادآوری‌های کاربر را نمایش دهید
-        reminders_text = """📅 یادآوری‌ها
+        page = await self.db_async.get_user_reminders_page(user_id, True, cursor, backward)
+        
+        if not page['items']:
+            reminders_text = """📅 یادآوری‌ها
 
 قابلیت‌های یادآوری:
 • ⏰ یادآوری روزانه
@@ -3333,12 +6073,70 @@ class AdvancedTelegramBot:
 • 📊 گزارش‌های دوره‌ای
 
 💡 برای تنظیم یادآوری، از منوی تنظیمات استفاده کنید."""
+            
+            await query.edit_message_text(
+                reminders_text,
+                reply_markup=self.get_back_menu()
+            )
+            return
+        
+        reminders_text = "📅 یادآوری‌های فعال شما:\n\n"
+        for reminder in page['items']:
+            reminders_text += f"⏰ {reminder['title']}\n"
+            reminders_text += f"   📅 {reminder['scheduled_time'][:16]}\n"
+            if reminder['topic']:
+                reminders_text += f"   🎯 {reminder['topic']}\n"
+            reminders_text += "\n"
         
         await query.edit_message_text(
             reminders_text,
-            reply_markup=self.get_back_menu()
+            reply_markup=self.get_paged_back_menu('remind', page)
         )
 
+    async def _research(self, topic: str, depth: str) -> Tuple[str, List[Dict], float]:
+        """مرحله تحقیق (مشترک بین درخواست‌های همزمان یکسان؛ بدون دسترسی به پیام کاربران)"""
+        research_start = time.time()
+        # موضوع‌های تکراری بدون رفتن به شبکه از کش پاسخ داده می‌شوند
+        cached = self.research_cache.peek(topic, depth) or await self.db_async.run(self.research_cache.get, topic, depth)
+        if cached:
+            research_content, sources = cached
+            logger.info(f"Research cache hit for topic: {topic}")
+        else:
+            research_content, sources = await self.scraper.comprehensive_research(topic, depth)
+            if sources:
+                # فقط نتایج واقعی جستجو ذخیره می‌شوند، نه متن جایگزین
+                await self.db_async.run(self.research_cache.set, topic, research_content, sources, depth)
+        return research_content, sources, time.time() - research_start
+    
+    async def _generate_posts(self, topic: str, category: str, research_content: str) -> List[str]:
+        """مرحله تولید محتوا (مشترک بین درخواست‌های همزمان یکسان؛ بدون دسترسی به پیام کاربران)"""
+        # sessionهای مشترک برنامه (اتصال‌های keep-alive بین پیام‌ها دوباره استفاده می‌شوند)
+        session = self.http.api_session
+        
+        # تولید محتوای پیشرفته با Metis API
+        posts = []
+        try:
+            logger.info("Attempting to use Metis API for content generation...")
+            posts = await self.content_generator.create_metis_posts(
+                self.metis_api, session, topic, research_content
+            )
+            logger.info(f"Successfully generated {len(posts)} posts with Metis API")
+        except Exception as e:
+            logger.warning(f"Metis API failed: {e}")
+            logger.info("Falling back to local content generation...")
+            try:
+                posts = self.content_generator.create_advanced_posts(topic, research_content, category)
+                if not posts or len(posts) < 2:
+                    posts = self.content_generator.create_advanced_posts(topic, research_content, 'general')
+            except Exception as e2:
+                logger.error(f"Local content generation also failed: {e2}")
+                posts = [
+                    f"📚 {topic}\n\nاین موضوع شامل مباحث مهمی در حوزه مربوطه است که نیاز به بررسی دقیق دارد.",
+                    f"💡 کاربردهای عملی {topic}:\n\n• اهمیت در صنعت\n• روش‌های پیاده‌سازی\n• مزایای استفاده\n\nبرای اطلاعات بیشتر، منابع معتبر را بررسی کنید."
+                ]
+        
+        return posts
+    
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """مدیریت پیام‌های کاربر پیشرفته"""
         user_id = update.effective_user.id
@@ -3346,6 +6144,11 @@ class AdvancedTelegramBot:
         
         # بررسی وضعیت کاربر
         user_state = self.user_states.get(user_id, '')
+        if user_state in ('waiting_for_search_query', 'waiting_for_content_search', 'waiting_for_history_search'):
+            self.user_states.pop(user_id, None)
+            await self.handle_search_query(update, user_id, topic, user_state)
+            return
+        
         if not user_state.startswith('waiting_for_topic'):
             await update.message.reply_text(
                 "👋 سلام! برای شروع، از منوی زیر استفاده کنید:",
@@ -3353,8 +6156,18 @@ class AdvancedTelegramBot:
             )
             return
         
-        # بررسی محدودیت روزانه
-        if not self.db.can_make_request(user_id):
+        # بررسی طول موضوع
+        if len(topic) < 3:
+            self.user_states.pop(user_id, None)
+            await update.message.reply_text(
+                "⚠️ لطفاً موضوع دقیق‌تری وارد کنید (حداقل 3 کاراکتر)",
+                reply_markup=self.get_main_menu()
+            )
+            return
+        
+        # رزرو سهمیه روزانه (در صورت شکست تولید، بازگردانده می‌شود)
+        reservation = await self.db_async.reserve_request(user_id)
+        if reservation is None:
             await update.message.reply_text(
                 f"⚠️ محدودیت روزانه شما تمام شده است!\n\n📊 شما امروز {MAX_DAILY_REQUESTS} درخواست داشته‌اید.\n\n🕐 محدودیت فردا صبح ریست می‌شود.",
                 reply_markup=self.get_main_menu()
@@ -3366,14 +6179,6 @@ class AdvancedTelegramBot:
         
         logger.info(f"User {user_id} requested topic: {topic}")
         
-        # بررسی طول موضوع
-        if len(topic) < 3:
-            await update.message.reply_text(
-                "⚠️ لطفاً موضوع دقیق‌تری وارد کنید (حداقل 3 کاراکتر)",
-                reply_markup=self.get_main_menu()
-            )
-            return
-        
         # تشخیص دسته‌بندی
         if user_state == 'waiting_for_topic':
             category = self.content_generator.detect_category(topic)
@@ -3383,103 +6188,129 @@ class AdvancedTelegramBot:
             if category not in ['ai', 'marketing', 'management', 'programming', 'business', 'general']:
                 category = 'general'
         
-        # ثبت درخواست در دیتابیس
-        self.db.log_request(user_id, topic, category)
-        
         # ارسال پیام وضعیت
         status_message = await update.message.reply_text("🔍 شروع تحقیق... لطفاً صبر کنید")
+        request_start = time.time()
         
         try:
             # نمایش typing
             await update.message.chat.send_action(ChatAction.TYPING)
             
-            # ایجاد session
-            timeout = aiohttp.ClientTimeout(total=90)
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                self.scraper = ContentScraper(session)
-                
-                # مرحله 1: جستجو و تحقیق
+            # درخواست‌های همزمان با موضوع (و دسته‌بندی) یکسان تحقیق و تولید مشترک دارند؛
+            # هر درخواست فقط پیام وضعیت خودش را ویرایش می‌کند
+            user_settings = await self.db_async.get_user_settings(user_id)
+            depth = user_settings.get('research_depth') or 'comprehensive'
+            research_key = ResearchCache.key(topic, depth)
+            
+            # مرحله 1: جستجو و تحقیق
+            if self.inflight.in_flight(('research', research_key)):
+                await status_message.edit_text("🔁 این موضوع همین حالا در حال آماده‌سازی است، نتیجه مشترک ارسال می‌شود...")
+            else:
                 await status_message.edit_text("🔍 در حال جستجو در اینترنت...")
-                research_content, sources = await self.scraper.comprehensive_research(topic)
-                
-                if not research_content:
-                    await status_message.edit_text(
-                        "❌ متاسفانه نتوانستم اطلاعات کافی پیدا کنم. لطفاً موضوع دیگری امتحان کنید.",
-                        reply_markup=self.get_main_menu()
-                    )
-                    return
-                
-                # مرحله 2: تولید محتوا
-                await status_message.edit_text("🤖 در حال تولید محتوا...")
-                
-                # تولید محتوای پیشرفته با Metis API
-                posts = []
-                try:
-                    logger.info("Attempting to use Metis API for content generation...")
-                    posts = await self.content_generator.create_metis_posts(
-                        self.metis_api, session, topic, research_content
-                    )
-                    logger.info(f"Successfully generated {len(posts)} posts with Metis API")
-                except Exception as e:
-                    logger.warning(f"Metis API failed: {e}")
-                    logger.info("Falling back to local content generation...")
-                    try:
-                        posts = self.content_generator.create_advanced_posts(topic, research_content, category)
-                        if not posts or len(posts) < 2:
-                            posts = self.content_generator.create_advanced_posts(topic, research_content, 'general')
-                    except Exception as e2:
-                        logger.error(f"Local content generation also failed: {e2}")
-                        posts = [
-                            f"📚 {topic}\n\nاین موضوع شامل مباحث مهمی در حوزه مربوطه است که نیاز به بررسی دقیق دارد.",
-                            f"💡 کاربردهای عملی {topic}:\n\n• اهمیت در صنعت\n• روش‌های پیاده‌سازی\n• مزایای استفاده\n\nبرای اطلاعات بیشتر، منابع معتبر را بررسی کنید."
-                        ]
-                
-                # اطلاع به کاربر
-                await update.message.reply_text(
-                    f"✅ محتوای آموزشی در دسته‌بندی {self._get_category_name(category)} آماده شده است!"
+            (research_content, sources, research_seconds), shared = await self.inflight.do(
+                ('research', research_key), lambda: self._research(topic, depth)
+            )
+            if shared:
+                logger.info(f"Coalesced research for topic {topic} with an in-flight request")
+            await self.db_async.save_search_history(
+                user_id, topic, category, len(sources), research_seconds, bool(sources)
+            )
+            
+            if not research_content:
+                await self.db_async.refund_request(reservation)
+                await self.db_async.log_request(
+                    user_id, topic, category, 'failed', time.time() - request_start
                 )
+                await status_message.edit_text(
+                    "❌ متاسفانه نتوانستم اطلاعات کافی پیدا کنم. لطفاً موضوع دیگری امتحان کنید.",
+                    reply_markup=self.get_main_menu()
+                )
+                return
+            
+            # مرحله 2: تولید محتوا
+            await status_message.edit_text("🤖 در حال تولید محتوا...")
+            posts, shared = await self.inflight.do(
+                ('generate', research_key, category),
+                lambda: self._generate_posts(topic, category, research_content)
+            )
+            if shared:
+                logger.info(f"Coalesced generation for topic {topic} with an in-flight request")
+            posts = list(posts)
+            
+            await self.db_async.commit_request(reservation)
+            await self.db_async.log_request(
+                user_id, topic, category, 'completed', time.time() - request_start,
+                content_length=sum(len(post) for post in posts)
+            )
+            
+            # اطلاع به کاربر
+            await update.message.reply_text(
+                f"✅ محتوای آموزشی در دسته‌بندی {self._get_category_name(category)} آماده شده است!"
+            )
+            
+            # حذف پیام وضعیت
+            await status_message.delete()
+            
+            # ذخیره محتوا در دیتابیس (همه پست‌ها در یک commit گروهی)
+            if user_settings.get('auto_save', True):
+                for i, post in enumerate(posts, 1):
+                    await self.db_async.save_content(user_id, topic, category, post)
+            
+            # ارسال پست‌ها
+            for i, post in enumerate(posts, 1):
+                await update.message.chat.send_action(ChatAction.TYPING)
+                await asyncio.sleep(1)
                 
-                # حذف پیام وضعیت
-                await status_message.delete()
-                
-                # ذخیره محتوا در دیتابیس
-                user_settings = self.db.get_user_settings(user_id)
-                if user_settings.get('auto_save', True):
-                    for i, post in enumerate(posts, 1):
-                        self.db.save_content(user_id, topic, category, post)
+                # اضافه کردن دکمه‌های عملیات
+                action_buttons = [
+                    [InlineKeyboardButton("💾 ذخیره", callback_data=f'save_post_{i}'),
+                     InlineKeyboardButton("⭐ مورد علاقه", callback_data=f'favorite_post_{i}')],
+                    [InlineKeyboardButton("📤 اشتراک‌گذاری", callback_data=f'share_post_{i}'),
+                     InlineKeyboardButton("📅 یادآوری", callback_data=f'remind_post_{i}')]
+                ]
                 
-                # ارسال پست‌ها
-                for i, post in enumerate(posts, 1):
-                    await update.message.chat.send_action(ChatAction.TYPING)
-                    await asyncio.sleep(1)
-                    
-                    # اضافه کردن دکمه‌های عملیات
-                    action_buttons = [
-                        [InlineKeyboardButton("💾 ذخیره", callback_data=f'save_post_{i}'),
-                         InlineKeyboardButton("⭐ مورد علاقه", callback_data=f'favorite_post_{i}')],
-                        [InlineKeyboardButton("📤 اشتراک‌گذاری", callback_data=f'share_post_{i}'),
-                         InlineKeyboardButton("📅 یادآوری", callback_data=f'remind_post_{i}')]
-                    ]
-                    
-                    # تقسیم پست اگر خیلی طولانی باشد
-                    if len(post) > 4000:
-                        chunks = self.split_text(post, 4000)
-                        for j, chunk in enumerate(chunks, 1):
-                            await update.message.reply_text(
-                                f"📝 پست {i} (قسمت {j}/{len(chunks)}):\n\n{chunk}",
-                                reply_markup=InlineKeyboardMarkup(action_buttons) if j == len(chunks) else None
-                            )
-                    else:
+                # تقسیم پست اگر خیلی طولانی باشد
+                if len(post) > 4000:
+                    chunks = self.split_text(post, 4000)
+                    for j, chunk in enumerate(chunks, 1):
                         await update.message.reply_text(
-                            f"📝 پست {i}:\n\n{post}",
-                            reply_markup=InlineKeyboardMarkup(action_buttons)
+                            f"📝 پست {i} (قسمت {j}/{len(chunks)}):\n\n{chunk}",
+                            reply_markup=InlineKeyboardMarkup(action_buttons) if j == len(chunks) else None
                         )
+                else:
+                    await update.message.reply_text(
+                        f"📝 پست {i}:\n\n{post}",
+                        reply_markup=InlineKeyboardMarkup(action_buttons)
+                    )
+            
+            # ارسال منابع
+            if sources:
+                sources_text = "📚 منابع مفید:\n\n"
+                for i, source in enumerate(sources[:5], 1):
+                    # تمیز کردن URL
+                    clean_url = source['url']
+                    if clean_url.startswith('https://duckduckgo.com/l/?uddg='):
+                        try:
+                            import urllib.parse
+                            decoded_url = urllib.parse.unquote(clean_url.split('uddg=')[1].split('&')[0])
+                            clean_url = decoded_url
+                        except:
+                            pass
+                    
+                    sources_text += f"{i}. [{source['title']}]({clean_url})\n\n"
                 
-                # ارسال منابع
-                if sources:
-                    sources_text = "📚 منابع مفید:\n\n"
+                # ارسال با Markdown برای هایپرلینک
+                try:
+                    await update.message.reply_text(
+                        sources_text,
+                        parse_mode='Markdown',
+                        disable_web_page_preview=True,
+                        reply_markup=self.get_main_menu()
+                    )
+                except:
+                    # اگر Markdown کار نکرد، بدون هایپرلینک
+                    sources_text_plain = "📚 منابع مفید:\n\n"
                     for i, source in enumerate(sources[:5], 1):
-                        # تمیز کردن URL
                         clean_url = source['url']
                         if clean_url.startswith('https://duckduckgo.com/l/?uddg='):
                             try:
@@ -3488,48 +6319,65 @@ class AdvancedTelegramBot:
                                 clean_url = decoded_url
                             except:
                                 pass
-                        
-                        sources_text += f"{i}. [{source['title']}]({clean_url})\n\n"
+                        sources_text_plain += f"{i}. {source['title']}\n{clean_url}\n\n"
                     
-                    # ارسال با Markdown برای هایپرلینک
-                    try:
-                        await update.message.reply_text(
-                            sources_text,
-                            parse_mode='Markdown',
-                            disable_web_page_preview=True,
-                            reply_markup=self.get_main_menu()
-                        )
-                    except:
-                        # اگر Markdown کار نکرد، بدون هایپرلینک
-                        sources_text_plain = "📚 منابع مفید:\n\n"
-                        for i, source in enumerate(sources[:5], 1):
-                            clean_url = source['url']
-                            if clean_url.startswith('https://duckduckgo.com/l/?uddg='):
-                                try:
-                                    import urllib.parse
-                                    decoded_url = urllib.parse.unquote(clean_url.split('uddg=')[1].split('&')[0])
-                                    clean_url = decoded_url
-                                except:
-                                    pass
-                            sources_text_plain += f"{i}. {source['title']}\n{clean_url}\n\n"
-                        
-                        await update.message.reply_text(
-                            sources_text_plain,
-                            reply_markup=self.get_main_menu()
-                        )
-                else:
                     await update.message.reply_text(
-                        "✅ پست‌های شما آماده شد!",
+                        sources_text_plain,
                         reply_markup=self.get_main_menu()
                     )
-                    
+            else:
+                await update.message.reply_text(
+                    "✅ پست‌های شما آماده شد!",
+                    reply_markup=self.get_main_menu()
+                )
+                
         except Exception as e:
             logger.error(f"Error in handle_message: {e}")
+            await self.db_async.refund_request(reservation)
+            await self.db_async.log_request(
+                user_id, topic, category, 'failed', time.time() - request_start, str(e)
+            )
             await status_message.edit_text(
                 "❌ خطایی رخ داد. لطفاً مجدداً تلاش کنید.",
                 reply_markup=self.get_main_menu()
             )
     
+    async def handle_search_query(self, update: Update, user_id: int, search_text: str, user_state: str):
+        """جستجوی تمام‌متن در محتوای ذخیره شده یا تاریخچه جستجو"""
+        try:
+            if user_state == 'waiting_for_history_search':
+                results = await self.db_async.search_search_history(user_id, search_text, 10)
+                results_text = f"📅 نتایج جستجو در تاریخچه برای «{search_text}»:\n\n"
+                for i, item in enumerate(results, 1):
+                    status = "✅" if item['is_successful'] else "❌"
+                    results_text += f"{i}. {status} {item['snippet']}\n"
+                    results_text += f"   🏷️ {item['category']}\n"
+                    results_text += f"   📅 {item['created_at'][:16]}\n\n"
+            else:
+                results = await self.db_async.search_saved_content(user_id, search_text, 10)
+                results_text = f"📚 نتایج جستجو در محتوا برای «{search_text}»:\n\n"
+                for i, item in enumerate(results, 1):
+                    results_text += f"{i}. 📝 {item['topic']}\n"
+                    results_text += f"   🏷️ {item['category']}\n"
+                    results_text += f"   📅 {item['created_at'][:10]}\n"
+                    if item['snippet']:
+                        results_text += f"   💬 {item['snippet']}\n"
+                    results_text += "\n"
+            
+            if not results:
+                results_text = f"🔍 نتیجه‌ای برای «{search_text}» یافت نشد.\n\n💡 از کلمات کلیدی دیگری استفاده کنید."
+            
+            await update.message.reply_text(
+                results_text[:MAX_MESSAGE_LENGTH],
+                reply_markup=self.get_advanced_search_menu()
+            )
+        except Exception as e:
+            logger.error(f"Error handling search query: {e}")
+            await update.message.reply_text(
+                "❌ خطا در جستجو",
+                reply_markup=self.get_main_menu()
+            )
+    
     def _get_category_name(self, category: str) -> str:
         """دریافت نام فارسی دسته‌بندی"""
         names = {
@@ -3598,7 +6446,7 @@ class AdvancedTelegramBot:
         """نمایش پیشنهادات هوشمند"""
         try:
             # دریافت آمار کاربر برای پیشنهادات شخصی‌سازی شده
-            user_stats = self.db.get_user_statistics(user_id)
+            user_stats = await self.db_async.run_analytics(self.db.get_user_statistics, user_id)
             popular_categories = user_stats.get('popular_categories', [])
             
             suggestions_text = "💡 پیشنهادات هوشمند برای شما:\n\n"
@@ -3638,7 +6486,7 @@ class AdvancedTelegramBot:
     async def show_shareable_content(self, query, user_id: int):
         """نمایش محتوای قابل اشتراک‌گذاری"""
         try:
-            saved_content = self.db.get_saved_content(user_id, 10)
+            saved_content = await self.db_async.get_saved_content(user_id, 10)
             
             if not saved_content:
                 await query.edit_message_text(
@@ -3748,7 +6596,7 @@ class AdvancedTelegramBot:
     async def show_manage_categories(self, query, user_id: int):
         """نمایش مدیریت دسته‌بندی‌ها"""
         try:
-            custom_categories = self.db.get_custom_categories(user_id)
+            custom_categories = await self.db_async.get_custom_categories(user_id)
             
             if not custom_categories:
                 await query.edit_message_text(
@@ -3908,7 +6756,7 @@ class AdvancedTelegramBot:
     async def show_new_notifications(self, query, user_id: int):
         """نمایش اعلان‌های جدید"""
         try:
-            notifications = self.db.get_user_notifications(user_id, unread_only=True)
+            notifications = await self.db_async.get_user_notifications(user_id, unread_only=True)
             
             if not notifications:
                 await query.edit_message_text(
@@ -3943,10 +6791,12 @@ class AdvancedTelegramBot:
                 reply_markup=self.get_back_menu()
             )
     
-    async def show_all_notifications(self, query, user_id: int):
+    async def show_all_notifications(self, query, user_id: int, cursor: Optional[Tuple[str, int]] = None,
+                                     backward: bool = False):
         """نمایش همه اعلان‌ها"""
         try:
-            notifications = self.db.get_user_notifications(user_id, unread_only=False)
+            page = await self.db_async.get_user_notifications_page(user_id, False, cursor, backward)
+            notifications = page['items']
             
             if not notifications:
                 await query.edit_message_text(
@@ -3957,18 +6807,15 @@ class AdvancedTelegramBot:
             
             notifications_text = "📋 همه اعلان‌ها:\n\n"
             
-            for i, notif in enumerate(notifications[:10], 1):
+            for notif in notifications:
                 status = "📬" if not notif['is_read'] else "📭"
-                notifications_text += f"{i}. {status} {notif['title']}\n"
+                notifications_text += f"{status} {notif['title']}\n"
                 notifications_text += f"   📅 {notif['created_at'][:16]}\n"
                 notifications_text += f"   {notif['message'][:50]}...\n\n"
             
-            if len(notifications) > 10:
-                notifications_text += f"... و {len(notifications) - 10} اعلان دیگر"
-            
             await query.edit_message_text(
                 notifications_text,
-                reply_markup=self.get_back_menu()
+                reply_markup=self.get_paged_back_menu('notif', page, 'notifications')
             )
         except Exception as e:
             logger.error(f"Error showing all notifications: {e}")
@@ -4032,7 +6879,7 @@ class AdvancedTelegramBot:
     async def show_search_analytics(self, query, user_id: int):
         """نمایش آمار جستجو"""
         try:
-            search_history = self.db.get_search_history(user_id, 10)
+            search_history = await self.db_async.get_search_history(user_id, 10)
             
             analytics_text = "📊 آمار جستجو:\n\n"
             analytics_text += "📈 آمار کلی:\n"
@@ -4064,10 +6911,12 @@ class AdvancedTelegramBot:
                 reply_markup=self.get_back_menu()
             )
     
-    async def show_search_history(self, query, user_id: int):
+    async def show_search_history(self, query, user_id: int, cursor: Optional[Tuple[str, int]] = None,
+                                  backward: bool = False):
         """نمایش تاریخچه جستجو"""
         try:
-            search_history = self.db.get_search_history(user_id, 20)
+            page = await self.db_async.get_search_history_page(user_id, cursor, backward)
+            search_history = page['items']
             
             if not search_history:
                 await query.edit_message_text(
@@ -4078,16 +6927,23 @@ class AdvancedTelegramBot:
             
             history_text = "📅 تاریخچه جستجو:\n\n"
             
-            for i, search in enumerate(search_history, 1):
+            for search in search_history:
                 status = "✅" if search['is_successful'] else "❌"
-                history_text += f"{i}. {status} {search['query']}\n"
+                history_text += f"{status} {search['query']}\n"
                 history_text += f"   🏷️ {search['category']}\n"
                 history_text += f"   📅 {search['created_at'][:16]}\n"
                 history_text += f"   📊 {search['results_count']} نتیجه\n\n"
             
+            keyboard = []
+            pagination_row = self.get_pagination_row('history', page)
+            if pagination_row:
+                keyboard.append(pagination_row)
+            keyboard.append([InlineKeyboardButton("🔎 جستجو در تاریخچه", callback_data='history_search')])
+            keyboard.append([InlineKeyboardButton("🔙 برگشت", callback_data='advanced_search')])
+            
             await query.edit_message_text(
                 history_text,
-                reply_markup=self.get_back_menu()
+                reply_markup=InlineKeyboardMarkup(keyboard)
             )
         except Exception as e:
             logger.error(f"Error showing search history: {e}")
@@ -4188,6 +7044,12 @@ class AdvancedTelegramBot:
             application.add_handler(CallbackQueryHandler(self.button_handler))
             application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
             
+            # sessionهای HTTP مشترک برای همه پیام‌ها
+            await self.http.start()
+            self.scraper = ContentScraper(
+                self.http.scrape_session, http_cache=HttpCache() if HTTP_CACHE_ENABLED else None
+            )
+            
             # شروع وظایف پس‌زمینه
             self.start_background_tasks(application)
             
@@ -4217,6 +7079,14 @@ class AdvancedTelegramBot:
                 await application.updater.stop()
                 await application.stop()
                 await application.shutdown()
+                for task in (self.rollup_task, self.backup_task, self.cleanup_task):
+                    if task:
+                        task.cancel()
+                await self.http.close()
+                if self.scraper:
+                    self.scraper.close()
+                self.db_async.shutdown()
+                self.db.close()
         except Exception as e:
             logger.error(f"Error starting bot: {e}")
             raise
@@ -4229,10 +7099,10 @@ class AdvancedTelegramBot:
                 while True:
                     try:
                         await asyncio.sleep(BACKUP_INTERVAL_HOURS * 3600)  # تبدیل به ثانیه
-                        backup_path = self.backup_manager.create_backup()
+                        backup_path = await self.run_backup()
                         if backup_path:
                             logger.info(f"Auto backup created: {backup_path}")
-                        self.backup_manager.cleanup_old_backups()
+                        await asyncio.to_thread(self.backup_manager.cleanup_old_backups)
                     except Exception as e:
                         logger.error(f"Auto backup error: {e}")
             
@@ -4241,8 +7111,10 @@ class AdvancedTelegramBot:
                 while True:
                     try:
                         await asyncio.sleep(24 * 3600)  # روزانه
-                        # پاک‌سازی اعلان‌های قدیمی
-                        # پاک‌سازی تاریخچه جستجوی قدیمی
+                        # حذف تدریجی داده‌های منقضی در thread جدا (بدون اشغال threadهای دیتابیس)
+                        await asyncio.to_thread(self.retention_manager.run)
+                        # آموزش دیکشنری فشرده‌سازی وقتی پست‌های کافی جمع شد
+                        await asyncio.to_thread(self.db.train_content_dictionaries)
                         logger.info("Old data cleanup completed")
                     except Exception as e:
                         logger.error(f"Cleanup error: {e}")
@@ -4258,8 +7130,20 @@ class AdvancedTelegramBot:
                     except Exception as e:
                         logger.error(f"Reminder error: {e}")
             
+            # وظیفه به‌روزرسانی جداول تجمیعی آمار
+            async def refresh_rollups():
+                while True:
+                    try:
+                        await self.db_async.run(self.analytics_manager.refresh_rollups)
+                    except Exception as e:
+                        logger.error(f"Rollup error: {e}")
+                    await asyncio.sleep(ANALYTICS_ROLLUP_INTERVAL_MINUTES * 60)
+            
             # شروع وظایف - این‌ها در run_polling اجرا خواهند شد
             logger.info("Background tasks defined successfully")
+            self.rollup_task = asyncio.create_task(refresh_rollups())
+            self.backup_task = asyncio.create_task(auto_backup())
+            self.cleanup_task = asyncio.create_task(cleanup_old_data())
             
             logger.info("Background tasks started successfully")
         except Exception as e:
@@ -4274,14 +7158,36 @@ class AdvancedTelegramBot:
             return
         
         # بررسی نقش کاربر (فقط ادمین‌ها)
-        user = self.db.get_user(user_id)
+        user = await self.db_async.get_user(user_id)
         if not user or user.get('role', 'user') not in ['admin', 'moderator']:
             await update.message.reply_text("❌ شما مجوز مشاهده آمار سیستم را ندارید.")
             return
         
         uptime = datetime.now() - self.system_stats['start_time']
+        global_stats = await self.db_async.run_analytics(self.analytics_manager.get_global_analytics)
+        storage = await self.db_async.run_analytics(self.db.get_content_storage_report)
         uptime_str = f"{uptime.days} روز, {uptime.seconds // 3600} ساعت, {(uptime.seconds % 3600) // 60} دقیقه"
         
+        # وضعیت circuit breaker هر host (ابتدا مدارهای باز)
+        state_icons = {'closed': '🟢', 'half_open': '🟡', 'open': '🔴'}
+        health_lines = []
+        for host in (self.scraper.health.snapshot() if self.scraper else []):
+            line = f"• {state_icons[host['state']]} {host['host']}: خطا {host['error_rate']:.0%}"
+            if host['latency_p95'] is not None:
+                line += f"، p95 {host['latency_p95']:.1f}s"
+            if host['cooldown_remaining']:
+                line += f"، باز تا {host['cooldown_remaining']:.0f}s دیگر"
+            line += f" ({host['requests']} درخواست، {host['short_circuited']} رد سریع)"
+            health_lines.append(line)
+        health_text = "\n".join(health_lines) or "• هنوز درخواستی ارسال نشده"
+        if self.scraper and self.scraper.http_cache is not None:
+            http_cache = await asyncio.to_thread(self.scraper.http_cache.get_report)
+            health_text += (
+                f"\n• کش HTTP: {http_cache['entries']} صفحه، {http_cache['size_bytes'] / 1024 / 1024:.1f} MB، "
+                f"بدون دانلود {http_cache['hit_rate']:.0%} (محلی {http_cache['hits']} / 304 {http_cache['revalidated']} / "
+                f"دانلود {http_cache['misses']})"
+            )
+        
         stats_text = f"""📊 آمار سیستم:
 
 ⏰ زمان کارکرد: {uptime_str}
@@ -4290,13 +7196,29 @@ class AdvancedTelegramBot:
 ❌ درخواست‌های ناموفق: {self.system_stats['failed_requests']}
 👥 کاربران فعال: {self.system_stats['active_users']}
 
+📅 آمار تجمیعی:
+• کل کاربران: {global_stats.get('total_users', 0)}
+• کاربران جدید این هفته: {global_stats.get('new_users_week', 0)}
+• درخواست‌های امروز: {global_stats.get('requests_today', 0)} ({global_stats.get('active_users_today', 0)} کاربر فعال)
+• درخواست‌های این هفته: {global_stats.get('requests_week', 0)}
+• کل درخواست‌ها: {global_stats.get('total_requests', 0)} (✅ {global_stats.get('successful_requests', 0)} / ❌ {global_stats.get('failed_requests', 0)})
+
 🔒 امنیت:
 • کاربران مسدود شده: {len(self.security_manager.blocked_users)}
 • محدودیت‌های نرخ: فعال
 
 💾 دیتابیس:
-• مسیر: {self.db.db_path}
+• مسیر: {self.db.db_path} ({len(self.db.shards)} shard)
 • اندازه: {self.get_database_size()} MB
+• صف نوشتن: {self.db.write_backlog()} ردیف
+• کش کاربران: {len(self.db.user_cache)} مورد، hit {self.db.user_cache.hit_rate():.0%} ({self.db.user_cache.stats['hits']}/{self.db.user_cache.stats['misses']})
+• کش تنظیمات: {len(self.db.settings_cache)} مورد، hit {self.db.settings_cache.hit_rate():.0%} ({self.db.settings_cache.stats['hits']}/{self.db.settings_cache.stats['misses']})
+• کش تحقیق: {len(self.research_cache.memory)} مورد در حافظه، hit {self.research_cache.hit_rate():.0%} (حافظه {self.research_cache.stats['memory_hits']} / دیسک {self.research_cache.stats['disk_hits']} / miss {self.research_cache.stats['misses']})
+• ادغام درخواست‌های همزمان: {self.inflight.stats['shared']} درخواست مشترک، ضریب {self.inflight.fan_in():.2f}
+• بدنه محتوا: {storage.get('unique_blobs', 0)} blob یکتا برای {storage.get('blob_rows', 0)} پست (تکرار ×{storage.get('dedup_ratio', 1.0):.1f}، فشرده‌سازی ×{storage.get('compression_ratio', 1.0):.1f}، صرفه‌جویی {storage.get('bytes_saved', 0) / 1024:.0f} KB)
+
+🌐 سلامت منابع جستجو:
+{health_text}
 
 🤖 AI Assistant:
 • وضعیت: فعال
@@ -4320,30 +7242,49 @@ class AdvancedTelegramBot:
             return
         
         # بررسی نقش کاربر
-        user = self.db.get_user(user_id)
+        user = await self.db_async.get_user(user_id)
         if not user or user.get('role', 'user') not in ['admin', 'moderator']:
             await update.message.reply_text("❌ شما مجوز پشتیبان‌گیری را ندارید.")
             return
         
+        status_message = await update.message.reply_text("💾 پشتیبان‌گیری آغاز شد... 0%")
         try:
-            backup_path = self.backup_manager.create_backup()
+            backup_path = await self.run_backup(status_message)
             if backup_path:
-                await update.message.reply_text(
+                await status_message.edit_text(
                     f"✅ پشتیبان‌گیری با موفقیت انجام شد!\n\n📁 مسیر: {backup_path}\n📅 تاریخ: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
                     reply_markup=self.get_main_menu()
                 )
             else:
-                await update.message.reply_text(
+                await status_message.edit_text(
                     "❌ خطا در ایجاد پشتیبان",
                     reply_markup=self.get_main_menu()
                 )
         except Exception as e:
             logger.error(f"Backup command error: {e}")
-            await update.message.reply_text(
+            await status_message.edit_text(
                 "❌ خطا در پشتیبان‌گیری",
                 reply_markup=self.get_main_menu()
             )
     
+    async def run_backup(self, status_message=None) -> str:
+        """اجرای پشتیبان‌گیری آنلاین در thread جدا با گزارش پیشرفت"""
+        loop = asyncio.get_running_loop()
+        last_reported = {'percent': 0}
+        
+        def report_progress(copied: int, total: int):
+            # به‌روزرسانی پیام فقط در گام‌های ۱۰ درصدی (محدودیت ویرایش پیام تلگرام)
+            percent = int(copied * 100 / total) if total else 100
+            if status_message and percent - last_reported['percent'] >= 10:
+                last_reported['percent'] = percent
+                asyncio.run_coroutine_threadsafe(
+                    status_message.edit_text(f"💾 پشتیبان‌گیری در حال انجام... {percent}%"), loop
+                )
+        
+        # نوشته‌های در صف قبل از snapshot در دیتابیس ثبت شوند
+        await self.db_async.run(self.db.flush_writes)
+        return await asyncio.to_thread(self.backup_manager.create_backup, report_progress)
+    
     async def exit_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """دستور خروج از حالت چت"""
         user_id = update.effective_user.id
@@ -4358,12 +7299,12 @@ class AdvancedTelegramBot:
         )
     
     def get_database_size(self) -> float:
-        """دریافت اندازه دیتابیس"""
+        """دریافت اندازه دیتابیس (مجموع همه shardها)"""
         try:
-            if os.path.exists(self.db.db_path):
-                size_bytes = os.path.getsize(self.db.db_path)
-                return round(size_bytes / (1024 * 1024), 2)  # تبدیل به مگابایت
-            return 0.0
+            size_bytes = sum(
+                os.path.getsize(shard.db_path) for shard in self.db.shards if os.path.exists(shard.db_path)
+            )
+            return round(size_bytes / (1024 * 1024), 2)  # تبدیل به مگابایت
         except Exception as e:
             logger.error(f"Error getting database size: {e}")
             return 0.0
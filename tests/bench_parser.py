@@ -0,0 +1,81 @@
+"""بنچمارک parse صفحات نتایج: درخت کامل BeautifulSoup در برابر parse_search_results
+
+اجرا: python tests/bench_parser.py [--backend html.parser|lxml|selectolax] [--rounds 20]
+"""
+import argparse
+import os
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import telegram_bot as tb  # noqa: E402
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+FIXTURES = {
+    'duckduckgo': 'duckduckgo_results.html',
+    'bing': 'bing_results.html',
+}
+
+
+def load_fixture(engine):
+    with open(os.path.join(FIXTURES_DIR, FIXTURES[engine]), encoding='utf-8') as f:
+        return f.read()
+
+
+def full_tree_parse(engine, html, backend='html.parser', limit=5):
+    """روش قبلی: ساخت کل درخت صفحه و جستجو در آن"""
+    soup = BeautifulSoup(html, backend)
+    results = []
+    if engine == 'duckduckgo':
+        for result in soup.find_all('div', class_='result__body')[:limit]:
+            title = result.find('a', class_='result__a')
+            snippet = result.find('a', class_='result__snippet')
+            results.append({
+                'url': title.get('href', ''),
+                'title': title.get_text(),
+                'snippet': snippet.get_text() if snippet else ''
+            })
+    else:
+        for result in soup.find_all('li', class_='b_algo')[:limit]:
+            title = result.find('h2')
+            link = title.find('a')
+            snippet = result.find('p') or result.find('div', class_='b_caption')
+            results.append({
+                'url': link.get('href', ''),
+                'title': title.get_text(),
+                'snippet': snippet.get_text() if snippet else ''
+            })
+    return results
+
+
+def bench(func, *args, rounds=20):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func(*args)
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', default=tb.resolve_html_parser_backend())
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    # درخت کامل با selectolax ساخته نمی‌شود؛ مرجع مقایسه روی BeautifulSoup می‌ماند
+    reference_backend = 'html.parser' if args.backend == 'selectolax' else args.backend
+    print(f"backend: {args.backend}, rounds: {args.rounds}")
+    for engine in FIXTURES:
+        html = load_fixture(engine)
+        expected = full_tree_parse(engine, html, reference_backend)
+        assert tb.parse_search_results(engine, html, args.backend) == expected, engine
+        full_ms = bench(full_tree_parse, engine, html, reference_backend, rounds=args.rounds)
+        strained_ms = bench(tb.parse_search_results, engine, html, args.backend, rounds=args.rounds)
+        print(f"{engine:<11} {len(html) // 1024:>4}KB  full tree {full_ms:7.1f}ms  "
+              f"parse_search_results {strained_ms:7.1f}ms  ({full_ms / strained_ms:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
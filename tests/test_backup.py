@@ -0,0 +1,158 @@
+import json
+import os
+
+import pytest
+
+import telegram_bot as tb
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    # پوشه backups نسبت به مسیر جاری ساخته می‌شود
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(tb, 'BACKUP_STEP_PAUSE_SECONDS', 0)
+    db = tb.DatabaseManager(str(tmp_path / 'bot.db'))
+    yield db
+    db.close()
+
+
+def _add_users(db, user_ids):
+    for user_id in user_ids:
+        db.create_user(user_id, f'user{user_id}', 'name', '')
+
+
+def _read_manifest(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_manifest(path, manifest):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+
+
+def _user_ids(db):
+    with db.pool.connection() as conn:
+        return [row[0] for row in conn.execute('SELECT user_id FROM users ORDER BY user_id')]
+
+
+def test_backup_restore_round_trip(db):
+    _add_users(db, range(1, 51))
+    manager = tb.BackupManager(db.db_path, db)
+    progress = []
+    backup_path = manager.create_backup(lambda copied, total: progress.append((copied, total)))
+    assert backup_path and os.path.exists(backup_path)
+    assert progress and progress[-1][0] == progress[-1][1]
+
+    with db.pool.connection() as conn:
+        conn.execute('DELETE FROM users WHERE user_id > 10')
+        conn.commit()
+    _add_users(db, [999])
+    assert db.get_user(999) is not None
+
+    assert manager.restore_backup(backup_path)
+    # اتصال‌های باز pool و کش‌ها داده بازیابی شده را می‌بینند
+    assert _user_ids(db) == list(range(1, 51))
+    assert db.get_user(999) is None
+
+
+def test_restore_rejects_checksum_mismatch(db):
+    _add_users(db, [1, 2])
+    manager = tb.BackupManager(db.db_path, db)
+    backup_path = manager.create_backup()
+    manifest = _read_manifest(backup_path)
+    manifest['sha256'] = '0' * 64
+    _write_manifest(backup_path, manifest)
+
+    _add_users(db, [3])
+    assert not manager.restore_backup(backup_path)
+    assert _user_ids(db) == [1, 2, 3]
+    assert not os.path.exists(db.db_path + '.restore')
+
+
+def test_restore_rejects_missing_backup_and_shard_mismatch(db, tmp_path):
+    manager = tb.BackupManager(db.db_path, db)
+    assert not manager.restore_backup(str(tmp_path / 'backups' / 'missing.json'))
+
+    backup_path = manager.create_backup()
+    manifest = _read_manifest(backup_path)
+    manifest['shards'] = [dict(manifest)]
+    _write_manifest(backup_path, manifest)
+    assert manager.backup_file_count(backup_path) == 2
+    assert not manager.restore_backup(backup_path)
+
+
+def test_restore_runs_integrity_check(db, tmp_path):
+    _add_users(db, range(1, 200))
+    manager = tb.BackupManager(db.db_path, db)
+    backup_path = manager.create_backup()
+    manifest = _read_manifest(backup_path)
+
+    # پشتیبانی با checksum درست ولی صفحه‌های b-tree خراب
+    corrupted = str(tmp_path / 'corrupted.db')
+    manager.rebuild_snapshot(backup_path, corrupted)
+    with open(corrupted, 'r+b') as f:
+        f.seek(manifest['page_size'] * 2 + 8)
+        f.write(b'\xff' * 64)
+    entry = manager._store_snapshot(corrupted, db.db_path, manifest['page_size'], manifest['page_count'])
+    _write_manifest(backup_path, {**manifest, **entry})
+
+    assert not manager.restore_backup(backup_path)
+    assert _user_ids(db) == list(range(1, 200))
+
+
+def _chunk_files(manager):
+    return {name for prefix in os.listdir(manager.chunk_dir) for name in os.listdir(os.path.join(manager.chunk_dir, prefix))}
+
+
+def test_incremental_backup_stores_only_changed_chunks(db, monkeypatch):
+    monkeypatch.setattr(tb, 'BACKUP_CHUNK_SIZE', 4096)
+    _add_users(db, range(1, 500))
+    manager = tb.BackupManager(db.db_path, db)
+    first = _read_manifest(manager.create_backup())
+    assert first['new_chunks'] == len(set(first['chunks'])) > 1
+
+    _add_users(db, [1000])
+    second = _read_manifest(manager.create_backup())
+    assert 0 < second['new_chunks'] < len(second['chunks']) // 2
+    assert _chunk_files(manager) == set(first['chunks']) | set(second['chunks'])
+
+
+def test_restore_detects_corrupted_chunk(db):
+    _add_users(db, [1, 2])
+    manager = tb.BackupManager(db.db_path, db)
+    backup_path = manager.create_backup()
+    chunk_path = manager._chunk_path(_read_manifest(backup_path)['chunks'][0])
+    with open(chunk_path, 'wb') as f:
+        f.write(tb.zlib.compress(b'not the original chunk'))
+
+    _add_users(db, [3])
+    assert not manager.restore_backup(backup_path)
+    assert _user_ids(db) == [1, 2, 3]
+
+
+def test_cleanup_removes_expired_manifests_and_unreferenced_chunks(db):
+    _add_users(db, [1])
+    manager = tb.BackupManager(db.db_path, db)
+    old_path = manager.create_backup()
+    old = _read_manifest(old_path)
+    old['created_at'] = '2000-01-01T00:00:00'
+    _write_manifest(old_path, old)
+    os.rename(old_path, os.path.join(manager.backup_dir, 'backup_20000101_000000.json'))
+
+    _add_users(db, range(2, 300))
+    new_path = manager.create_backup()
+    orphan = 'ab' + '0' * 62
+    manager._store_chunk(orphan, b'orphan')
+
+    manager.cleanup_old_backups(keep_days=7)
+    assert set(os.listdir(manager.backup_dir)) == {'chunks', os.path.basename(new_path)}
+    assert _chunk_files(manager) == set(_read_manifest(new_path)['chunks'])
+
+    # جدیدترین پشتیبان حتی اگر قدیمی باشد نگه داشته می‌شود
+    new = _read_manifest(new_path)
+    new['created_at'] = '2000-01-01T00:00:00'
+    _write_manifest(new_path, new)
+    manager.cleanup_old_backups(keep_days=7)
+    assert os.path.exists(new_path)
+    assert manager.restore_backup(new_path)
@@ -0,0 +1,107 @@
+import asyncio
+from types import SimpleNamespace
+
+import telegram_bot as tb
+
+
+class StubScraper:
+    def __init__(self):
+        self.calls = 0
+
+    async def comprehensive_research(self, topic, depth):
+        self.calls += 1
+        await asyncio.sleep(0.3)
+        return f"content about {topic}", [{'title': 'Example', 'url': 'https://example.com'}]
+
+
+class StubContentGenerator(tb.ContentGenerator):
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    async def create_metis_posts(self, metis_api, session, topic, research_content):
+        self.calls += 1
+        await asyncio.sleep(0.1)
+        return [f"post about {topic}"]
+
+
+class StatusMessage:
+    """پیام وضعیت؛ ویرایش‌هایی که با fail_prefix شروع می‌شوند شکست می‌خورند (مثلاً پیام حذف شده)"""
+
+    def __init__(self, fail_prefix=None):
+        self.fail_prefix = fail_prefix
+        self.texts = []
+        self.deleted = False
+
+    async def edit_text(self, text, **kwargs):
+        if self.fail_prefix and text.startswith(self.fail_prefix):
+            raise RuntimeError("Message to edit not found")
+        self.texts.append(text)
+
+    async def delete(self):
+        self.deleted = True
+
+
+def make_update(user_id, topic, status_message):
+    replies = []
+
+    async def reply_text(text, **kwargs):
+        replies.append(text)
+        return status_message if len(replies) == 1 else SimpleNamespace()
+
+    async def send_action(action):
+        pass
+
+    message = SimpleNamespace(text=topic, reply_text=reply_text, chat=SimpleNamespace(send_action=send_action))
+    return SimpleNamespace(effective_user=SimpleNamespace(id=user_id), message=message), replies
+
+
+def make_bot(tmp_path):
+    bot = object.__new__(tb.AdvancedTelegramBot)
+    bot.db = tb.DatabaseManager(str(tmp_path / 'bot.db'))
+    bot.db_async = tb.AsyncDatabaseManager(bot.db)
+    bot.research_cache = tb.ResearchCache(bot.db)
+    bot.inflight = tb.SingleFlight()
+    bot.scraper = StubScraper()
+    bot.content_generator = StubContentGenerator()
+    bot.metis_api = None
+    bot.http = SimpleNamespace(api_session=None)
+    bot.user_states = {}
+    return bot
+
+
+def test_concurrent_identical_requests_share_one_pipeline(tmp_path):
+    bot = make_bot(tmp_path)
+    # کاربر اول رهبر تحقیق است و ویرایش «در حال تولید» پیامش شکست می‌خورد
+    messages = {1: StatusMessage(fail_prefix="🤖"), 2: StatusMessage(), 3: StatusMessage()}
+    updates = {}
+    for user_id, status_message in messages.items():
+        bot.user_states[user_id] = 'waiting_for_topic_ai'
+        updates[user_id] = make_update(user_id, 'یادگیری ماشین', status_message)
+
+    async def main():
+        # رهبری تحقیق با کاربر اول قطعی می‌شود؛ بقیه وقتی می‌رسند که تحقیق در جریان است
+        leader = asyncio.create_task(bot.handle_message(updates[1][0], None))
+        while not bot.scraper.calls:
+            await asyncio.sleep(0.01)
+        await asyncio.gather(leader, *(bot.handle_message(updates[user_id][0], None) for user_id in (2, 3)))
+
+    try:
+        asyncio.run(main())
+        assert bot.scraper.calls == 1
+        assert bot.content_generator.calls == 1
+        assert bot.inflight.stats == {'leaders': 2, 'shared': 3}
+
+        # خطای پیام کاربر اول فقط به خود او می‌رسد
+        assert messages[1].texts[-1].startswith("❌")
+        assert not messages[1].deleted
+        assert bot.db.quota.remaining(1) == tb.MAX_DAILY_REQUESTS
+        for user_id in (2, 3):
+            assert messages[user_id].deleted
+            assert "🔁" in messages[user_id].texts[0] and "🤖" in messages[user_id].texts[-1]
+            assert "post about یادگیری ماشین" in "\n".join(updates[user_id][1])
+            assert bot.db.quota.remaining(user_id) == tb.MAX_DAILY_REQUESTS - 1
+    finally:
+        bot.db_async.executor.shutdown()
+        bot.db_async.analytics_executor.shutdown()
+        bot.db.close()
@@ -0,0 +1,648 @@
+import sqlite3
+import time
+
+import pytest
+
+import telegram_bot as tb
+
+
+def make_db(tmp_path):
+    return tb.DatabaseManager(str(tmp_path / 'bot.db'))
+
+
+def test_hot_queries_use_indexes(tmp_path):
+    db = make_db(tmp_path)
+    try:
+        assert db.check_query_plans() == []
+    finally:
+        db.close()
+
+
+def test_check_query_plans_reports_full_scans(tmp_path):
+    db = make_db(tmp_path)
+    try:
+        with db.pool.connection() as conn:
+            conn.execute('DROP INDEX idx_users_join_date')
+            conn.commit()
+        assert ('new_users_today', 'SCAN users') in db.check_query_plans()
+    finally:
+        db.close()
+
+
+class FailingCommitConnection:
+    """اتصالی که commit آن مثل دیسک پر شکست می‌خورد"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def commit(self):
+        raise sqlite3.OperationalError('database or disk is full')
+
+
+def test_write_behind_survives_commit_failure(tmp_path):
+    db = make_db(tmp_path)
+    queue = db.write_queue
+    real_get_connection = queue.pool.get_connection
+    try:
+        queue.pool.get_connection = lambda: FailingCommitConnection(real_get_connection())
+        queue.enqueue('INSERT INTO feedback (user_id, topic, rating, comment) VALUES (?, ?, ?, ?)', (1, 't', 5, ''))
+        queue.wakeup.set()
+        time.sleep(queue.flush_interval * 3)
+        assert queue.thread.is_alive()
+        assert queue.backlog_size() == 1
+
+        queue.pool.get_connection = real_get_connection
+        assert queue.flush() == 1
+        with db.pool.connection() as conn:
+            assert conn.execute('SELECT COUNT(*) FROM feedback').fetchone()[0] == 1
+    finally:
+        queue.pool.get_connection = real_get_connection
+        db.close()
+
+
+def test_saved_content_survives_gc_before_flush(tmp_path):
+    db = make_db(tmp_path)
+    try:
+        shard = db.shard_for_user(1)
+        content = 'متن ذخیره شده برای بررسی GC'
+        shard.write_queue.enqueue(tb.ContentBlobStore.INSERT_BLOB_SQL, shard.blobs.encode(content))
+        shard.write_queue.flush()
+
+        # blob بدون ارجاع است و GC بین صف شدن ردیف و flush آن اجرا می‌شود
+        db.save_content(1, 'topic', 'general', content)
+        shard.blobs.delete_unreferenced()
+        shard.write_queue.flush()
+
+        assert [item['content'] for item in db.get_saved_content(1)] == [content]
+    finally:
+        db.close()
+
+
+def test_new_user_gets_default_settings(tmp_path):
+    db = make_db(tmp_path)
+    try:
+        settings = db.get_user_settings(4242)
+        assert settings['user_id'] == 4242
+        assert settings['research_depth'] == 'comprehensive'
+        assert settings['notification_enabled'] is True
+    finally:
+        db.close()
+
+
+def test_persian_search_matches_zwnj_and_arabic_letters(tmp_path):
+    db = make_db(tmp_path)
+    try:
+        db.save_content(1, 'هوش‌مصنوعی', 'general', 'کاربردهای هوش‌مصنوعی در پزشكي')
+        db.save_content(2, 'هوش مصنوعی', 'general', 'متن کاربر دیگر')
+        for query in ('هوش مصنوعی', 'هوش‌مصنوعی', 'مصنوعی', 'پزشکی', 'پزشكي'):
+            assert [item['topic'] for item in db.search_saved_content(1, query)] == ['هوش‌مصنوعی'], query
+
+        db.save_search_history(1, 'يادگيري ماشين', 'general', 3, 1.0, True)
+        for query in ('یادگیری ماشین', 'يادگيري‌ماشين', 'ماشین'):
+            assert len(db.search_search_history(1, query)) == 1, query
+    finally:
+        db.close()
+
+
+def test_fulltext_index_rebuilt_for_zwnj_boundaries(tmp_path):
+    db = make_db(tmp_path)
+    try:
+        db.save_content(1, 'هوش‌مصنوعی', 'general', 'متن')
+        db.write_queue.flush()
+        # شبیه‌سازی ایندکس ساخته‌شده با نرمال‌سازی قدیمی (حذف نیم‌فاصله)
+        with db.pool.connection() as conn:
+            conn.execute("UPDATE saved_content_fts SET topic = 'هوشمصنوعی'")
+            conn.execute('DELETE FROM schema_version WHERE version >= 7')
+            conn.commit()
+        assert db.search_saved_content(1, 'مصنوعی') == []
+    finally:
+        db.close()
+
+    db = make_db(tmp_path)
+    try:
+        assert db.get_schema_version() == 7
+        assert len(db.search_saved_content(1, 'مصنوعی')) == 1
+    finally:
+        db.close()
+
+
+def test_research_cache_key_shares_depths_without_deep_pages():
+    key = tb.ResearchCache.key
+    assert key('هوش مصنوعی!', 'basic') == key('هوش‌مصنوعی', 'comprehensive') == 'هوش مصنوعی'
+    assert key('هوش مصنوعی', 'deep') == 'هوش مصنوعی#deep'
+    assert key('؟!', 'deep') == ''
+
+
+def test_research_cache_hits_and_misses(tmp_path):
+    db = make_db(tmp_path)
+    try:
+        cache = tb.ResearchCache(db)
+        assert cache.get('python', 'comprehensive') is None
+        cache.set('Python', 'content', [{'url': 'https://example.com'}], 'comprehensive')
+        assert cache.peek('python', 'basic') == ('content', [{'url': 'https://example.com'}])
+        assert cache.get('python', 'deep') is None
+        db.write_queue.flush()
+
+        # نمونه جدید (بدون لایه حافظه) از جدول research_cache می‌خواند
+        fresh = tb.ResearchCache(db)
+        assert fresh.peek('python', 'comprehensive') is None
+        assert fresh.get('python', 'comprehensive') == ('content', [{'url': 'https://example.com'}])
+        assert fresh.peek('python', 'comprehensive') is not None
+        assert fresh.stats == {'memory_hits': 1, 'disk_hits': 1, 'misses': 0, 'stores': 0}
+
+        with db.pool.connection() as conn:
+            conn.execute("UPDATE research_cache SET expires_at = datetime('now', '-1 hours')")
+            conn.commit()
+        assert tb.ResearchCache(db).get('python', 'basic') is None
+        assert cache.stats['misses'] == 2 and cache.stats['memory_hits'] == 1
+        assert cache.hit_rate() == 1 / 3
+    finally:
+        db.close()
+
+
+def test_quota_reserve_until_exceeded_and_refund(tmp_path):
+    db = make_db(tmp_path)
+    try:
+        quota = tb.QuotaManager(db.pool, daily_limit=3)
+        reservations = [quota.reserve(7) for _ in range(3)]
+        assert [r.count for r in reservations] == [1, 2, 3]
+        assert quota.reserve(7) is None
+        assert quota.remaining(7) == 0
+
+        # پاسخ سهمیه تمام‌شده از کش می‌آید، حتی اگر دیتابیس کاهش یافته باشد
+        with db.pool.connection() as conn:
+            conn.execute('UPDATE users SET daily_requests = 0 WHERE user_id = 7')
+            conn.commit()
+        assert quota.reserve(7) is None
+        quota.cache.clear()
+        with db.pool.connection() as conn:
+            conn.execute('UPDATE users SET daily_requests = 3 WHERE user_id = 7')
+            conn.commit()
+
+        quota.commit(reservations[0])
+        quota.refund(reservations[0])  # رزرو قطعی‌شده بازگردانده نمی‌شود
+        quota.refund(reservations[2])
+        quota.refund(reservations[2])  # بازگرداندن دوباره بی‌اثر است
+        assert quota.remaining(7) == 1
+        assert quota.reserve(7).count == 3
+        assert quota.reserve(7) is None
+    finally:
+        db.close()
+
+
+def test_quota_resets_on_a_new_day(tmp_path):
+    db = make_db(tmp_path)
+    try:
+        quota = tb.QuotaManager(db.pool, daily_limit=1)
+        reservation = quota.reserve(7)
+        assert quota.reserve(7) is None
+        with db.pool.connection() as conn:
+            conn.execute("UPDATE users SET last_request_date = '2000-01-01' WHERE user_id = 7")
+            conn.commit()
+        quota.cache.clear()
+        assert quota.reserve(7).count == 1
+        # رزرو دیروز روی شمارنده امروز اثری ندارد
+        quota.refund(tb.QuotaReservation(7, '2000-01-01', reservation.count))
+        assert quota.remaining(7) == 0
+    finally:
+        db.close()
+
+
+def test_quota_cache_is_bounded(tmp_path):
+    db = make_db(tmp_path)
+    try:
+        quota = tb.QuotaManager(db.pool, daily_limit=5)
+        quota.cache = tb.TTLCache(max_size=10)
+        for user_id in range(50):
+            quota.reserve(user_id)
+        assert len(quota.cache) == 10
+        assert quota.remaining(0) == 4
+    finally:
+        db.close()
+
+
+def test_reserve_request_allows_on_database_error(tmp_path):
+    db = make_db(tmp_path)
+    try:
+        db.quota.pool = tb.ConnectionPool(str(tmp_path / 'missing' / 'x.db'))
+        reservation = db.reserve_request(7)
+        assert reservation is not None and reservation.count == 0
+        db.refund_request(reservation)
+    finally:
+        db.close()
+
+
+def _insert_history(db, days_ago, user_id, requests=1, status='completed'):
+    """کاربر و درخواست‌هایی با تاریخ گذشته (مستقیم در دیتابیس)"""
+    with db.pool.connection() as conn:
+        conn.execute(
+            "INSERT OR IGNORE INTO users (user_id, first_name, join_date) VALUES (?, 'u', datetime('now', ?))",
+            (user_id, f'-{days_ago} days')
+        )
+        conn.commit()
+    with db.shard_for_user(user_id).pool.connection() as conn:
+        conn.executemany(
+            "INSERT INTO requests (user_id, topic, category, status, processing_time, created_at) "
+            "VALUES (?, 't', 'general', ?, 1.0, datetime('now', ?))",
+            [(user_id, status, f'-{days_ago} days')] * requests
+        )
+        conn.commit()
+
+
+def test_global_analytics_week_and_month_windows(tmp_path):
+    db = make_db(tmp_path)
+    try:
+        for days_ago, user_id in ((0, 1), (6, 2), (7, 3), (29, 4), (30, 5)):
+            _insert_history(db, days_ago, user_id)
+        analytics = tb.AnalyticsManager(db)
+        analytics.refresh_rollups()
+        stats = analytics.get_global_analytics()
+        # هفته: امروز و ۶ روز قبل؛ ماه: امروز و ۲۹ روز قبل
+        assert stats['requests_week'] == 2
+        assert stats['new_users_week'] == 2
+        assert stats['new_users_month'] == 4
+        assert stats['total_users'] == 5 and stats['total_requests'] == 5
+    finally:
+        db.close()
+
+
+def _raw_daily_counts(db):
+    daily = {}
+    for shard in db.shards:
+        with shard.pool.connection() as conn:
+            for row in conn.execute('''
+                SELECT date(created_at), COUNT(*), COUNT(CASE WHEN status = 'completed' THEN 1 END),
+                       COUNT(CASE WHEN status = 'failed' THEN 1 END), COUNT(DISTINCT user_id)
+                FROM requests GROUP BY date(created_at)
+            '''):
+                previous = daily.get(row[0], (0, 0, 0, 0))
+                daily[row[0]] = tuple(a + b for a, b in zip(previous, row[1:]))
+    return daily
+
+
+def _rollup_counts(db):
+    with db.pool.connection() as conn:
+        return {
+            row[0]: row[1:] for row in conn.execute('''
+                SELECT date, total_requests, successful_requests, failed_requests, active_users
+                FROM analytics WHERE total_requests > 0
+            ''')
+        }
+
+
+def _user_daily_totals(db):
+    totals = {}
+    for shard in db.shards:
+        with shard.pool.connection() as conn:
+            for user_id, total in conn.execute('SELECT user_id, SUM(total_requests) FROM user_daily_stats GROUP BY user_id'):
+                totals[user_id] = total
+    return totals
+
+
+def test_rollup_refresh_matches_raw_counts(tmp_path):
+    db = tb.DatabaseManager(str(tmp_path / 'bot.db'), shard_count=2)
+    try:
+        for days_ago, user_id, requests, status in (
+            (0, 1, 2, 'completed'), (1, 2, 1, 'failed'), (1, 3, 3, 'completed'),
+            (3, 4, 2, 'completed'), (3, 1, 1, 'failed'), (10, 5, 4, 'completed'),
+        ):
+            _insert_history(db, days_ago, user_id, requests, status)
+        assert len({db.shard_for_user(user_id).index for user_id in range(1, 6)}) == 2
+
+        analytics = tb.AnalyticsManager(db)
+        assert analytics.refresh_rollups() == 11
+        assert _rollup_counts(db) == _raw_daily_counts(db)
+        assert _user_daily_totals(db) == {1: 3, 2: 1, 3: 3, 4: 2, 5: 4}
+        with db.pool.connection() as conn:
+            assert conn.execute('SELECT total_users FROM analytics ORDER BY date DESC LIMIT 1').fetchone() == (5,)
+
+        # اجرای دوباره چیزی را دوبار نمی‌شمارد
+        analytics.refresh_rollups()
+        assert _rollup_counts(db) == _raw_daily_counts(db)
+        assert _user_daily_totals(db) == {1: 3, 2: 1, 3: 3, 4: 2, 5: 4}
+
+        # درخواست دیررس روز قبل از watermark در اجرای بعدی دیده می‌شود
+        _insert_history(db, 1, 6, 2, 'completed')
+        analytics.refresh_rollups()
+        assert _rollup_counts(db) == _raw_daily_counts(db)
+        assert _user_daily_totals(db)[6] == 2
+        assert analytics.get_global_analytics()['total_requests'] == 15
+    finally:
+        db.close()
+
+
+def _walk_pages(fetch):
+    """پیمایش همه صفحات با next_cursor و برگشت با prev_cursor"""
+    pages = [fetch(None, False)]
+    while pages[-1]['next_cursor']:
+        pages.append(fetch(pages[-1]['next_cursor'], False))
+    back = [pages[-1]]
+    while back[-1]['prev_cursor']:
+        back.append(fetch(back[-1]['prev_cursor'], True))
+    return pages, back
+
+
+def test_saved_content_keyset_pages_are_stable_with_tied_timestamps(tmp_path):
+    db = make_db(tmp_path)
+    try:
+        times = ['2024-01-01 10:00:00'] * 3 + ['2024-01-02 10:00:00'] * 2 + ['2024-01-03 10:00:00'] * 2
+        with db.pool.connection() as conn:
+            for i, created_at in enumerate(times):
+                conn.execute(
+                    "INSERT INTO saved_content (user_id, topic, category, content, created_at) VALUES (1, ?, 'general', 'x', ?)",
+                    (f't{i}', created_at)
+                )
+            conn.execute("INSERT INTO saved_content (user_id, topic, category, content) VALUES (2, 'other', 'general', 'x')")
+            conn.commit()
+            ids = [row[0] for row in conn.execute(
+                'SELECT id FROM saved_content WHERE user_id = 1 ORDER BY created_at DESC, id DESC'
+            )]
+
+        def fetch(cursor, backward):
+            return db.get_saved_content_page(1, cursor, backward, page_size=3)
+
+        pages, back = _walk_pages(fetch)
+        assert [[item['id'] for item in page['items']] for page in pages] == [ids[0:3], ids[3:6], ids[6:7]]
+        assert pages[0]['prev_cursor'] is None and pages[-1]['next_cursor'] is None
+        assert [[item['id'] for item in page['items']] for page in back] == [ids[6:7], ids[3:6], ids[0:3]]
+
+        # صفحه برگشتی از ابتدای لیست همان صفحه اول است و prev ندارد
+        assert back[-1]['prev_cursor'] is None and back[-1]['next_cursor'] == pages[0]['next_cursor']
+
+        # درج ردیف جدید بین پیمایش، صفحه بعدی را جابه‌جا نمی‌کند
+        with db.pool.connection() as conn:
+            conn.execute("INSERT INTO saved_content (user_id, topic, category, content) VALUES (1, 'new', 'general', 'x')")
+            conn.commit()
+        assert [item['id'] for item in fetch(pages[0]['next_cursor'], False)['items']] == ids[3:6]
+
+        exact = db.get_saved_content_page(2, page_size=1)
+        assert len(exact['items']) == 1 and exact['next_cursor'] is None
+        assert db.get_saved_content_page(3)['items'] == []
+    finally:
+        db.close()
+
+
+def test_reminder_keyset_pages_ascending_and_active_filter(tmp_path):
+    db = make_db(tmp_path)
+    try:
+        with db.pool.connection() as conn:
+            for i in range(5):
+                conn.execute(
+                    'INSERT INTO reminders (user_id, title, scheduled_time, is_active) VALUES (1, ?, ?, ?)',
+                    (f'r{i}', f'2030-01-0{5 - i} 09:00', 0 if i == 2 else 1)
+                )
+            conn.commit()
+
+        def fetch(cursor, backward):
+            return db.get_user_reminders_page(1, True, cursor, backward, page_size=2)
+
+        pages, back = _walk_pages(fetch)
+        titles = [[item['title'] for item in page['items']] for page in pages]
+        assert titles == [['r4', 'r3'], ['r1', 'r0']]
+        assert [[item['title'] for item in page['items']] for page in back] == [['r1', 'r0'], ['r4', 'r3']]
+        all_titles = [item['title'] for item in db.get_user_reminders_page(1, False, page_size=10)['items']]
+        assert all_titles == ['r4', 'r3', 'r2', 'r1', 'r0']
+    finally:
+        db.close()
+
+
+def test_ttl_cache_expiry_eviction_and_counters():
+    cache = tb.TTLCache(max_size=2, ttl_seconds=60)
+    assert cache.get('a') is None
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1  # a تازه‌ترین می‌شود
+    cache.set('c', 3)
+    assert cache.get('b') is None and cache.get('c') == 3
+    cache.set('d', 4, ttl_seconds=-1)
+    assert cache.get('d') is None
+    cache.invalidate('a')
+    assert cache.get('a') is None
+    assert cache.stats == {'hits': 2, 'misses': 4, 'evictions': 2}
+    assert cache.hit_rate() == 2 / 6
+
+
+def test_user_and_settings_caches_invalidated_on_writes(tmp_path):
+    db = make_db(tmp_path)
+    try:
+        db.create_user(1, 'ali', 'Ali', '')
+        assert db.get_user(1)['username'] == 'ali'
+        hits = db.user_cache.stats['hits']
+        assert db.get_user(1)['username'] == 'ali'
+        assert db.user_cache.stats['hits'] == hits + 1
+
+        db.create_user(1, 'ali2', 'Ali', '')
+        assert db.get_user(1)['username'] == 'ali2'
+        db.reserve_request(1)
+        assert db.get_user(1)['daily_requests'] == 1
+
+        # تغییر یک کپی برگشتی، کش را خراب نمی‌کند
+        db.get_user(1)['username'] = 'changed'
+        assert db.get_user(1)['username'] == 'ali2'
+
+        assert db.get_user_settings(1)['research_depth'] == 'comprehensive'
+        db.update_user_settings(1, {'research_depth': 'deep'})
+        assert db.get_user_settings(1)['research_depth'] == 'deep'
+        assert db.settings_cache.stats['hits'] == 0
+
+        db.reset_caches()
+        assert len(db.user_cache) == 0 and len(db.settings_cache) == 0
+    finally:
+        db.close()
+
+
+def test_retention_deletes_in_chunks_and_reports_freed_pages(tmp_path, monkeypatch):
+    monkeypatch.setattr(tb, 'RETENTION_PAUSE_SECONDS', 0)
+    db = make_db(tmp_path)
+    try:
+        padding = 'x' * 1000
+        with db.pool.connection() as conn:
+            conn.executemany(
+                "INSERT INTO requests (user_id, topic, status, error_message, created_at) "
+                "VALUES (1, 't', 'failed', ?, datetime('now', ?))",
+                [(padding, f'-{tb.ANALYTICS_RETENTION_DAYS + 1} days')] * 1050
+                + [(padding, f'-{tb.ANALYTICS_RETENTION_DAYS - 1} days')] * 5
+            )
+            conn.executemany(
+                "INSERT INTO system_notifications (user_id, title, is_read, created_at, expires_at) "
+                "VALUES (1, ?, ?, datetime('now', ?), ?)",
+                [
+                    ('old read', 1, f'-{tb.NOTIFICATION_RETENTION_DAYS + 1} days', None),
+                    ('old unread', 0, f'-{tb.NOTIFICATION_RETENTION_DAYS + 1} days', None),
+                    ('expired', 0, '-1 days', '2000-01-01 00:00:00'),
+                    ('new read', 1, '-1 days', None),
+                ]
+            )
+            conn.commit()
+            assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+
+            statements = []
+            conn.set_trace_callback(statements.append)
+        try:
+            report = tb.RetentionManager(db, chunk_rows=100).run()
+        finally:
+            with db.pool.connection() as conn:
+                conn.set_trace_callback(None)
+
+        assert report['deleted']['requests'] == 1050
+        assert report['deleted']['system_notifications'] == 2
+        # هر تراکنش حداکثر chunk_rows ردیف: ۱۱ دور (آخری ناقص)
+        assert sum(1 for sql in statements if sql.strip().startswith('DELETE FROM requests')) == 11
+        assert report['freed_pages'] > 250
+
+        with db.pool.connection() as conn:
+            assert conn.execute('SELECT COUNT(*) FROM requests').fetchone()[0] == 5
+            titles = {row[0] for row in conn.execute('SELECT title FROM system_notifications')}
+            assert titles == {'old unread', 'new read'}
+            assert conn.execute('PRAGMA freelist_count').fetchone()[0] == 0
+    finally:
+        db.close()
+
+
+def test_shard_routing_and_disjoint_id_ranges(tmp_path):
+    db = tb.DatabaseManager(str(tmp_path / 'bot.db'), shard_count=3)
+    try:
+        assert [shard.db_path for shard in db.shards] == [
+            str(tmp_path / 'bot.db'), str(tmp_path / 'bot.shard1.db'), str(tmp_path / 'bot.shard2.db')
+        ]
+        users = range(1, 31)
+        for user_id in users:
+            db.save_content(user_id, f'topic {user_id}', 'general', f'body {user_id}')
+            db.save_search_history(user_id, f'query {user_id}', 'general', 1, 0.5, True)
+        db.flush_writes()
+
+        owners = {}
+        for shard in db.shards:
+            span = range(shard.index * tb.DB_SHARD_ID_SPAN, (shard.index + 1) * tb.DB_SHARD_ID_SPAN)
+            with shard.pool.connection() as conn:
+                for row_id, user_id in conn.execute('SELECT id, user_id FROM saved_content'):
+                    # هر ردیف در shard کاربرش و در بازه id همان shard است
+                    assert db.shard_for_user(user_id) is shard and row_id in span
+                    assert db.shard_for_id(row_id) is shard
+                    owners[user_id] = row_id
+                history_users = {row[0] for row in conn.execute('SELECT user_id FROM search_history')}
+                assert all(db.shard_for_user(user_id) is shard for user_id in history_users)
+        assert sorted(owners) == list(users)
+        assert len({db.shard_for_user(user_id).index for user_id in users}) == 3
+
+        # مسیریابی پایدار است و خواندن/نوشتن از shard درست انجام می‌شود
+        assert db.shard_for_user(7) is db.shard_for_user(7)
+        assert [item['topic'] for item in db.get_saved_content(7)] == ['topic 7']
+        assert db.toggle_favorite(owners[7], 7)
+        assert db.get_saved_content(7)[0]['is_favorite'] is True
+
+        # به‌روزرسانی با id (بدون user_id) به shard صاحب ردیف می‌رود
+        remote_user = next(user_id for user_id in users if db.shard_for_user(user_id).index == 2)
+        reminder_id = db.create_reminder(remote_user, 'title', 'topic', 'message', '2030-01-01 09:00')
+        assert db.shard_for_id(reminder_id).index == 2
+        db.update_reminder_status(reminder_id)
+        reminder = db.get_user_reminders_page(remote_user)['items'][0]
+        assert reminder['is_sent'] and reminder['sent_count'] == 1
+    finally:
+        db.close()
+
+    # با باز کردن دوباره، شمارنده‌ها در بازه هر shard ادامه می‌دهند
+    db = tb.DatabaseManager(str(tmp_path / 'bot.db'), shard_count=3)
+    try:
+        db.save_content(7, 'again', 'general', 'body again')
+        db.flush_writes()
+        shard = db.shard_for_user(7)
+        new_id = max(item['id'] for item in db.get_saved_content(7))
+        assert db.shard_for_id(new_id) is shard and new_id > owners[7]
+    finally:
+        db.close()
+
+
+def test_read_pool_cancels_queries_over_budget(tmp_path):
+    db = make_db(tmp_path)
+    pool = tb.ConnectionPool(db.db_path, read_only=True, query_budget=0.05)
+    slow_sql = 'WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT COUNT(*) FROM n'
+    try:
+        start = time.monotonic()
+        with pytest.raises(tb.QueryBudgetExceeded):
+            with pool.connection() as conn:
+                conn.execute(slow_sql).fetchone()
+        assert time.monotonic() - start < 2
+
+        # سقف زمان برای هر کوئری تازه می‌شود و اتصال بعد از لغو قابل استفاده است
+        time.sleep(0.1)
+        with pool.connection() as conn:
+            assert conn.execute('SELECT COUNT(*) FROM users').fetchone() == (0,)
+
+        # اتصال فقط‌خواندنی نوشتن را رد می‌کند
+        with pytest.raises(sqlite3.OperationalError, match='readonly'):
+            with pool.connection() as conn:
+                conn.execute("INSERT INTO users (user_id, username) VALUES (1, 'x')")
+    finally:
+        pool.close_all()
+        db.close()
+
+
+def _raw_counters(db, user_id):
+    with db.shard_for_user(user_id).pool.connection() as conn:
+        requests = conn.execute('''
+            SELECT COUNT(*), COUNT(CASE WHEN status = 'completed' THEN 1 END),
+                   COUNT(CASE WHEN status = 'failed' THEN 1 END), COALESCE(SUM(processing_time), 0),
+                   COUNT(processing_time)
+            FROM requests WHERE user_id = ?
+        ''', (user_id,)).fetchone()
+        content = conn.execute('''
+            SELECT COUNT(*), COUNT(CASE WHEN is_favorite = 1 THEN 1 END), COUNT(CASE WHEN is_public = 1 THEN 1 END)
+            FROM saved_content WHERE user_id = ?
+        ''', (user_id,)).fetchone()
+        categories = conn.execute('''
+            SELECT category, COUNT(*) FROM requests WHERE user_id = ? GROUP BY category
+        ''', (user_id,)).fetchall()
+    return requests, content, dict(categories)
+
+
+def _assert_counters_match(db, user_id):
+    (total, successful, failed, time_sum, timed), (saved, favorites, public), categories = _raw_counters(db, user_id)
+    counters = db.get_user_counters(user_id, top_categories=10)
+    assert (counters['total_requests'], counters['successful_requests'], counters['failed_requests']) == (total, successful, failed)
+    assert counters['avg_processing_time'] == pytest.approx(time_sum / timed if timed else 0)
+    assert (counters['content_saved'], counters['favorites'], counters['public_content']) == (saved, favorites, public)
+    assert dict(counters['popular_categories']) == categories
+
+
+def test_user_counters_follow_requests_and_saved_content(tmp_path):
+    db = make_db(tmp_path)
+    try:
+        db.log_request(1, 'a', 'ai', 'completed', 2.0)
+        db.log_request(1, 'b', 'ai', 'failed', error_message='boom')
+        db.log_request(1, 'c', 'business', 'completed', 4.0)
+        db.log_request(2, 'd', 'general', 'completed', 1.0)
+        for topic in ('x', 'y', 'z'):
+            db.save_content(1, topic, 'ai', f'body {topic}')
+        db.flush_writes()
+        _assert_counters_match(db, 1)
+        _assert_counters_match(db, 2)
+        assert db.get_user_counters(1)['popular_categories'][0] == ('ai', 2)
+
+        # تغییر علاقه‌مندی و عمومی بودن و حذف محتوا شمارنده‌ها را به‌روز می‌کند
+        content_ids = [item['id'] for item in db.get_saved_content(1)]
+        db.toggle_favorite(content_ids[0], 1)
+        db.toggle_favorite(content_ids[1], 1)
+        db.toggle_favorite(content_ids[1], 1)
+        with db.pool.connection() as conn:
+            conn.execute('UPDATE saved_content SET is_public = 1 WHERE id IN (?, ?)', content_ids[:2])
+            conn.commit()
+        _assert_counters_match(db, 1)
+        assert db.get_user_counters(1)['favorites'] == 1
+        with db.pool.connection() as conn:
+            conn.execute('DELETE FROM saved_content WHERE id = ?', (content_ids[0],))
+            conn.commit()
+        _assert_counters_match(db, 1)
+        assert (db.get_user_counters(1)['favorites'], db.get_user_counters(1)['public_content']) == (0, 1)
+
+        # شمارنده درخواست‌ها تجمعی است و با حذف نگه‌داشت کم نمی‌شود
+        with db.pool.connection() as conn:
+            conn.execute('DELETE FROM requests WHERE user_id = 1')
+            conn.commit()
+        assert db.get_user_counters(1)['total_requests'] == 3
+        assert db.get_user_counters(3)['total_requests'] == 0
+    finally:
+        db.close()
@@ -0,0 +1,304 @@
+import asyncio
+import codecs
+import time
+
+import aiohttp
+from aiohttp import web
+
+import telegram_bot as tb
+
+
+async def _serve(handler):
+    app = web.Application()
+    app.router.add_get('/', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://127.0.0.1:{port}/'
+
+
+def test_hanging_provider_opens_circuit(monkeypatch):
+    monkeypatch.setattr(tb, 'RESEARCH_PROVIDER_TIMEOUT_SECONDS', 0.5)
+    monkeypatch.setattr(tb, 'RESEARCH_FETCH_TIMEOUT_SECONDS', 0.2)
+    monkeypatch.setattr(tb, 'RESEARCH_HEDGE_DELAY_SECONDS', 0)
+
+    async def scenario():
+        async def hang(request):
+            await asyncio.sleep(1)
+            return web.Response(text='<html></html>', content_type='text/html')
+
+        runner, url = await _serve(hang)
+        try:
+            async with aiohttp.ClientSession() as session:
+                scraper = tb.ContentScraper(session)
+                monkeypatch.setitem(scraper.PROVIDER_HOSTS, 'duckduckgo', '127.0.0.1')
+                calls = []
+
+                async def search_hanging(query):
+                    calls.append(query)
+                    await scraper.fetch_page(url, tb.RESEARCH_FETCH_TIMEOUT_SECONDS)
+                    return []
+
+                async def search_empty(query):
+                    return []
+
+                scraper.search_duckduckgo = search_hanging
+                scraper.search_bing = search_empty
+                for _ in range(tb.SCRAPE_BREAKER_CONSECUTIVE_FAILURES):
+                    await scraper.search_all_providers('topic')
+
+                breaker = scraper.health.breaker('127.0.0.1')
+                assert breaker.state == tb.BreakerState.OPEN
+                assert breaker.stats['failures'] == tb.SCRAPE_BREAKER_CONSECUTIVE_FAILURES
+
+                # موتور دارای مدار باز دیگر فراخوانی نمی‌شود
+                await scraper.search_all_providers('topic')
+                assert len(calls) == tb.SCRAPE_BREAKER_CONSECUTIVE_FAILURES
+                scraper.close()
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(scenario())
+
+
+def test_parse_search_results_matches_full_tree_parse():
+    from bench_parser import FIXTURES, full_tree_parse, load_fixture
+
+    for engine in FIXTURES:
+        html = load_fixture(engine)
+        results = tb.parse_search_results(engine, html)
+        assert len(results) == 5
+        assert results == full_tree_parse(engine, html)
+
+
+def test_negative_hints_match_ad_containers_only():
+    for hint in ('ad', 'ads', 'top-ads', 'advert-box', 'advertisement', 'sponsored-links'):
+        assert tb.ARTICLE_NEGATIVE_HINTS.search(hint), hint
+    for hint in ('adaptive-content', 'address', 'admin-post', 'headline'):
+        assert not tb.ARTICLE_NEGATIVE_HINTS.search(hint), hint
+
+
+def test_extract_main_text_keeps_adaptive_container():
+    paragraphs = ''.join(f'<p>Paragraph {i} of the article, with useful text, commas, and detail.</p>' for i in range(6))
+    html = (f'<html><body><div class="adaptive-content">{paragraphs}</div>'
+            '<div class="sponsored"><p>Buy now, limited offer, great price, today only.</p></div></body></html>')
+    text = tb.extract_main_text(html)
+    assert 'Paragraph 0' in text and 'Buy now' not in text
+
+
+def test_http_cache_stores_only_explicitly_cacheable_complete_responses(tmp_path):
+    responses = {
+        'plain': {},
+        'fresh': {'Cache-Control': 'max-age=60'},
+        'vary': {'Cache-Control': 'max-age=60', 'Vary': 'User-Agent'},
+        'encoding': {'Cache-Control': 'max-age=60', 'Vary': 'Accept-Encoding'},
+        'big': {'Cache-Control': 'max-age=60'},
+    }
+    hits = dict.fromkeys(responses, 0)
+
+    async def handler(request):
+        case = request.query['case']
+        hits[case] += 1
+        body = '<html>' + 'x' * (4096 if case == 'big' else 10) + '</html>'
+        return web.Response(text=body, content_type='text/html', headers=responses[case])
+
+    async def main():
+        runner, url = await _serve(handler)
+        cache = tb.HttpCache(str(tmp_path / 'http.db'))
+        try:
+            async with aiohttp.ClientSession() as session:
+                scraper = tb.ContentScraper(session, http_cache=cache)
+                for case in ('plain', 'fresh', 'vary', 'encoding'):
+                    for _ in range(2):
+                        assert await scraper.fetch_page(url, params={'case': case})
+                for _ in range(2):
+                    assert len(await scraper.fetch_page(url, params={'case': 'big'}, max_bytes=1024)) == 1024
+                scraper.close()
+        finally:
+            cache.close()
+            await runner.cleanup()
+
+    asyncio.run(main())
+    assert hits == {'plain': 2, 'fresh': 1, 'vary': 2, 'encoding': 1, 'big': 2}
+
+
+
+def test_read_html_caps_bytes_and_sniffs_charset_and_type():
+    persian = 'سلام کتاب'
+    responses = {
+        'big': ('text/html', b'<html>' + b'x' * 100000 + b'</html>'),
+        'small': ('text/html', b'<html>ok</html>'),
+        'header': ('text/html; charset=windows-1256', f'<html>{persian}</html>'.encode('cp1256')),
+        'meta': ('text/html', f'<html><meta charset="windows-1256">{persian}</html>'.encode('cp1256')),
+        'bom': ('text/html', f'<html>{persian}</html>'.encode('utf-16')),
+        'plain': ('text/plain', f'<html>{persian}</html>'.encode('utf-8')),
+        'octet': ('application/octet-stream', b'%PDF-1.4\x00\x01<binary>'),
+        'pdf': ('application/pdf', b'%PDF-1.4 <not html>'),
+    }
+
+    async def handler(request):
+        content_type, body = responses[request.query['case']]
+        return web.Response(body=body, headers={'Content-Type': content_type})
+
+    async def main():
+        runner, url = await _serve(handler)
+        results = {}
+        try:
+            async with aiohttp.ClientSession() as session:
+                scraper = tb.ContentScraper(session)
+                for case in responses:
+                    async with session.get(url, params={'case': case}) as response:
+                        results[case] = await scraper.read_html(response, 40000)
+                scraper.close()
+        finally:
+            await runner.cleanup()
+        return results
+
+    results = asyncio.run(main())
+    text, truncated = results['big']
+    assert truncated and len(text) == 40000 and text.startswith('<html>xxx')
+    assert results['small'] == ('<html>ok</html>', False)
+    for case in ('header', 'meta', 'bom', 'plain'):
+        assert persian in results[case][0] and not results[case][1], case
+    assert results['octet'] == (None, False)
+    assert results['pdf'] == (None, False)
+
+
+def test_detect_charset_prefers_bom_then_header_then_meta():
+    meta = b'<meta http-equiv="Content-Type" content="text/html; charset=windows-1256">'
+    assert tb.detect_charset(codecs.BOM_UTF8 + meta, 'latin-1') == 'utf-8-sig'
+    assert tb.detect_charset(meta, 'latin-1') == 'iso8859-1'
+    assert tb.detect_charset(meta, 'no-such-charset') == 'cp1256'
+    assert tb.detect_charset(b' ' * tb.HTTP_CHARSET_SNIFF_BYTES + meta) == 'utf-8'
+    assert tb.looks_like_html(b'<!doctype html>') and not tb.looks_like_html(b'PK\x03\x04\x00')
+
+
+def _stub_providers(scraper, primary_results, calls, hedge_delay=5.0):
+    async def primary(query):
+        calls.append(('duckduckgo', asyncio.get_running_loop().time()))
+        return primary_results
+
+    async def secondary(query):
+        calls.append(('bing', asyncio.get_running_loop().time()))
+        return [{'url': f'https://b{i}.example', 'title': f'b{i}', 'snippet': 's' * 50} for i in range(5)]
+
+    scraper.search_providers = lambda: [('duckduckgo', primary, 0), ('bing', secondary, hedge_delay)]
+
+
+def test_hedged_provider_starts_when_primary_finishes_short():
+    calls = []
+
+    async def main():
+        scraper = tb.ContentScraper(None)
+        _stub_providers(scraper, [{'url': 'https://a.example', 'title': 'a', 'snippet': 'short'}], calls)
+        started = asyncio.get_running_loop().time()
+        results = await scraper.search_all_providers('q')
+        scraper.close()
+        return started, results
+
+    started, results = asyncio.run(main())
+    assert [name for name, _ in calls] == ['duckduckgo', 'bing']
+    # بدون انتظار برای تأخیر hedge پنج ثانیه‌ای
+    assert calls[1][1] - started < 1.0
+    assert len(results) == 6
+
+
+def test_hedged_provider_not_started_when_primary_is_enough():
+    calls = []
+    good = [{'url': f'https://a{i}.example', 'title': f'a{i}', 'snippet': 's' * 50} for i in range(5)]
+
+    async def main():
+        scraper = tb.ContentScraper(None)
+        _stub_providers(scraper, good, calls)
+        results = await scraper.search_all_providers('q')
+        scraper.close()
+        return results
+
+    assert asyncio.run(main()) == good
+    assert [name for name, _ in calls] == ['duckduckgo']
+
+
+def test_hedged_provider_starts_after_delay_when_primary_is_slow():
+    calls = []
+
+    async def main():
+        scraper = tb.ContentScraper(None)
+        _stub_providers(scraper, [], calls, hedge_delay=0.2)
+        primary = scraper.search_providers()[0][1]
+
+        async def slow(query):
+            await asyncio.sleep(2)
+            return await primary(query)
+
+        providers = scraper.search_providers()
+        scraper.search_providers = lambda: [('duckduckgo', slow, 0), providers[1]]
+        started = asyncio.get_running_loop().time()
+        results = await scraper.search_all_providers('q')
+        scraper.close()
+        return started, results
+
+    started, results = asyncio.run(main())
+    assert [name for name, _ in calls] == ['bing']
+    assert 0.15 < calls[0][1] - started < 1.0
+    assert len(results) == 5
+
+
+def _open_breaker(breaker):
+    for _ in range(tb.SCRAPE_BREAKER_CONSECUTIVE_FAILURES):
+        breaker.record(breaker.allow(), False, 0.1)
+    assert breaker.state == tb.BreakerState.OPEN
+
+
+def test_breaker_half_open_admits_a_single_probe():
+    breaker = tb.HostCircuitBreaker('example.com')
+    _open_breaker(breaker)
+    assert breaker.allow() is None and breaker.stats['short_circuited'] == 1
+
+    breaker.open_until = 0
+    probe = breaker.allow()
+    assert probe is not None and breaker.state == tb.BreakerState.HALF_OPEN
+    assert breaker.allow() is None
+
+    # probe لغو شده مجوز را آزاد می‌کند و مدار نیمه‌باز می‌ماند
+    breaker.record(probe, None, 0)
+    assert breaker.state == tb.BreakerState.HALF_OPEN
+    probe = breaker.allow()
+    breaker.record(probe, True, 0.2)
+    assert breaker.state == tb.BreakerState.CLOSED and breaker.trips == 0
+
+
+def test_breaker_failed_probe_reopens_with_longer_cooldown():
+    breaker = tb.HostCircuitBreaker('example.com')
+    _open_breaker(breaker)
+    breaker.open_until = 0
+    breaker.record(breaker.allow(), False, 0.1)
+    assert breaker.state == tb.BreakerState.OPEN and breaker.trips == 2
+    assert breaker.open_until - time.monotonic() > tb.SCRAPE_BREAKER_COOLDOWN_SECONDS
+
+
+def test_breaker_ignores_stale_requests_while_half_open():
+    breaker = tb.HostCircuitBreaker('example.com')
+    stale = breaker.allow()  # درخواست کندی که پیش از باز شدن مدار شروع شده
+    _open_breaker(breaker)
+    breaker.open_until = 0
+    probe = breaker.allow()
+
+    breaker.record(stale, True, 5.0)
+    assert breaker.state == tb.BreakerState.HALF_OPEN and breaker.allow() is None
+    breaker.record(stale, False, 5.0)
+    assert breaker.state == tb.BreakerState.HALF_OPEN and breaker.trips == 1
+
+    breaker.record(probe, True, 0.2)
+    assert breaker.state == tb.BreakerState.CLOSED
+
+
+def test_breaker_ignores_stale_failures_while_open():
+    breaker = tb.HostCircuitBreaker('example.com')
+    stale = [breaker.allow() for _ in range(3)]
+    _open_breaker(breaker)
+    open_until = breaker.open_until
+    for token in stale:
+        breaker.record(token, False, 5.0)
+    assert breaker.trips == 1 and breaker.open_until == open_until